@@ -1,2 +1,10 @@
 import pkgutil
-__all__ = [name for loader, name, is_pkg in pkgutil.walk_packages(__path__)]
+from .lazy_import import lazy_module
+__all__ = [name for loader, name, is_pkg in pkgutil.iter_modules(__path__)]
+
+
+def __getattr__(name):
+    # modules of the package are imported on first use, see lazy_import
+    if name in __all__:
+        return lazy_module(__name__ + '.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,139 @@
+'''
+Asynchronous VISA transport for instrument drivers.
+
+pyvisa calls block, so every resource gets its own single worker thread that performs all I/O of that resource in
+order. Coroutines (write_async, query_async, ...) hand the call to the worker of the resource and await it, which
+allows a single asyncio event loop to talk to several instruments concurrently:
+
+    vna = open_resource('TCPIP0::192.168.1.2::inst0::INSTR')
+    sa = open_resource('GPIB0::18::INSTR')
+    vna_data, sa_data = await asyncio.gather(vna.query_binary_values_async('CALC:DATA? SDATA'),
+                                             sa.query_binary_values_async('TRAC:DATA? TRACE1'))
+
+The blocking methods (write, query, ask, read, query_binary_values, ...) go through the same worker, so drivers
+keep using AsyncVisaResource as a drop-in replacement of the pyvisa resource in self._visainstrument. Attributes
+that are not wrapped (timeout, read_termination, ...) are passed through to the pyvisa resource.
+
+For tests without hardware, open_resource(address, backend='@sim') uses the pyvisa-sim backend.
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def open_resource(address, backend=None, **kwargs):
+    '''
+    Opens a VISA resource and wraps it in AsyncVisaResource.
+
+    :param address: VISA resource address
+    :param backend: pyvisa backend, for example '@py' or '@sim' (default: the default pyvisa backend)
+    :param kwargs: passed to ResourceManager.open_resource
+    '''
+    import visa
+    resource_manager = visa.ResourceManager(backend) if backend else visa.ResourceManager()
+    return AsyncVisaResource(resource_manager.open_resource(address, **kwargs))
+
+
+class AsyncVisaResource:
+    def __init__(self, resource):
+        self.resource = resource
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        ## 'opc' waits for operation complete with a blocking *OPC? query, 'srq' waits for the service request
+        ## raised by the OPC bit of the event status register (requires an interface with SRQ support, e.g. GPIB)
+        self.opc_mode = 'opc'
+
+    def __getattr__(self, name):
+        if 'resource' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__['resource'], name)
+
+    def __setattr__(self, name, value):
+        if name in ('resource', 'executor', 'opc_mode') or 'resource' not in self.__dict__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.resource, name, value)
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        Runs function in the I/O thread of this resource, after all previously submitted I/O.
+
+        :returns: concurrent.futures.Future
+        '''
+        return self.executor.submit(function, *args, **kwargs)
+
+    def _call(self, function, *args, **kwargs):
+        return self.submit(function, *args, **kwargs).result()
+
+    async def _call_async(self, function, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(function, *args, **kwargs))
+
+    ## blocking API
+    def write(self, command):
+        return self._call(self.resource.write, command)
+
+    def read(self):
+        return self._call(self.resource.read)
+
+    def query(self, command):
+        return self._call(self.resource.query, command)
+
+    def ask(self, command):
+        return self.query(command)
+
+    def query_binary_values(self, command, **kwargs):
+        return self._call(self.resource.query_binary_values, command, **kwargs)
+
+    def query_ascii_values(self, command, **kwargs):
+        return self._call(self.resource.query_ascii_values, command, **kwargs)
+
+    def write_binary_values(self, command, values, **kwargs):
+        return self._call(self.resource.write_binary_values, command, values, **kwargs)
+
+    def wait_operation_complete(self, timeout=None, block=True, command=None):
+        '''
+        Waits until all pending operations of the instrument are complete. Call it after the command that starts
+        the operation (e.g. INIT), instead of polling *ESR?.
+
+        :param timeout: maximum waiting time in s (default: the VISA timeout of the resource)
+        :param block: if False, return a concurrent.futures.Future instead of waiting
+        :param command: command that starts the operation (e.g. 'INIT:IMM'); it is sent in the same message as the
+            operation complete request, which saves a round trip per trigger
+        '''
+        future = self.submit(self._wait_operation_complete, timeout, command)
+        return future.result() if block else future
+
+    ## asyncio API
+    async def write_async(self, command):
+        return await self._call_async(self.resource.write, command)
+
+    async def read_async(self):
+        return await self._call_async(self.resource.read)
+
+    async def query_async(self, command):
+        return await self._call_async(self.resource.query, command)
+
+    async def query_binary_values_async(self, command, **kwargs):
+        return await self._call_async(self.resource.query_binary_values, command, **kwargs)
+
+    async def wait_operation_complete_async(self, timeout=None, command=None):
+        return await self._call_async(self._wait_operation_complete, timeout, command)
+
+    def _wait_operation_complete(self, timeout, command=None):
+        # runs in the I/O thread
+        visa_timeout = self.resource.timeout
+        if timeout is not None:
+            self.resource.timeout = timeout*1e3
+        prefix = command+';' if command else ''
+        try:
+            if self.opc_mode == 'srq':
+                self.resource.write(prefix+'*ESE 1;*SRE 32;*OPC')
+                self.resource.wait_for_srq(self.resource.timeout)
+                self.resource.query('*ESR?') # clears the event status register and the SRQ
+            else:
+                self.resource.query(prefix+'*OPC?')
+        finally:
+            self.resource.timeout = visa_timeout
+
+    def close(self):
+        self.executor.shutdown()
+        self.resource.close()
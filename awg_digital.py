@@ -61,7 +61,8 @@ class awg_digital:
             validation_measurement = modem.exdir_db.select_measurement(measurement_type='modem_readout_delay_validation',
                                                                                 references_that={'calibration':calibration_measurement.id}, metadata=validation_metadata)
         except Exception as e:
-            print(traceback.format_exc())
+            if not isinstance(e, IndexError): # IndexError: no validation of this calibration saved yet
+                print(traceback.format_exc())
             xc_dataset = MeasurementDataset([MeasurementParameter(
                 name='Time delta',
                 values=modem.xc_points,
@@ -7,6 +7,7 @@ import numpy as np
 import logging
 from .save_pkl import *
 from .config import get_config
+from .calibration_surface import CalibrationSurface
 from matplotlib import pyplot as plt
 #import time
 
@@ -30,9 +31,9 @@ def build_param_names(params):
     list_of_strs = []
     for param_name, param_value in sorted(params.items()):
         if type(param_value) != str:  # if value is numeric (not str)
-            list_of_strs = '{0}-{1:6.4g}'.format(param_name, param_value)
+            list_of_strs.append('{0}-{1:6.4g}'.format(param_name, param_value))
         else:
-            param_name + '-' + param_value
+            list_of_strs.append(param_name + '-' + param_value)
     return '-'.join(list_of_strs)
 
 
@@ -103,7 +104,7 @@ class Carrier:
         self.parent.ignore_calibration_drift = v
 
     def get_calibration_measurement(self):
-        return self.parent.exdir_db.select_measurement(measurement_type='iq_rf_calibration', metadata=self.parent.rf_calibration_identifier(self)).id
+        return self.parent.get_rf_calibration_measurement(self)
 
 
 class Awg_iq_multi:
@@ -143,6 +144,11 @@ class Awg_iq_multi:
         self.rf_calibrations = {}
         self.sideband_id = 0
         self.ignore_calibration_drift = False
+        # calibrations at new frequencies are interpolated from the saved ones if the error estimate is below the
+        # tolerance (see calibration_surface); 0 or None turns the interpolation off
+        self.rf_calibration_tolerance = 0
+        self.dc_calibration_tolerance = 0
+        self.calibration_surfaces = {}
 
         self.frozen = False
         self.use_offset_I = hasattr(self.awg_I, 'set_offset')  # set DC offsets by set_offset
@@ -328,6 +334,10 @@ class Awg_iq_multi:
         -------
 
         """
+        calibration = self.interpolate_dc_calibration()
+        if calibration is not None:
+            self.dc_calibrations[self.dc_cname()] = calibration
+            return calibration
         try:
             calibration = self.exdir_db.select_measurement(measurement_type='iq_dc_calibration', metadata=self.dc_calibration_identifier()).metadata
             self.dc_calibrations[self.dc_cname()] = {}
@@ -351,7 +361,10 @@ class Awg_iq_multi:
     def save_dc_calibration(self):
         calibration = self.dc_calibration_identifier()
         calibration.update({k: str(v) for k,v in self.dc_calibrations[self.dc_cname()].items()})
-        self.exdir_db.save(measurement_type='iq_dc_calibration', metadata=calibration, type_revision='1')
+        data = self.exdir_db.save(measurement_type='iq_dc_calibration', metadata=calibration, type_revision='1')
+        surface = self.calibration_surfaces.get(self.calibration_surface_key('dc'))
+        if surface is not None:
+            surface.add((self.lo.get_frequency(),), self.dc_calibrations[self.dc_cname()]['dc'], data.id)
 
     def rf_calibration_identifier(self, carrier):
         return {'cname':self.name, 'if':carrier.get_if(), 'frequency':carrier.get_frequency(), 'sideband_id':self.sideband_id}
@@ -369,6 +382,10 @@ class Awg_iq_multi:
         """
         #calibration_path = get_config()['datadir']+'/calibrations/'
         #filename = 'iq-rf-'+self.rf_cname(carrier)
+        calibration = self.interpolate_rf_calibration(carrier)
+        if calibration is not None:
+            self.rf_calibrations[self.rf_cname(carrier)] = calibration
+            return calibration
         try:
             calibration = self.exdir_db.select_measurement(measurement_type='iq_rf_calibration', metadata=self.rf_calibration_identifier(carrier)).metadata
             self.rf_calibrations[self.rf_cname(carrier)] = {}
@@ -397,10 +414,79 @@ class Awg_iq_multi:
         #qjson.dump(type='iq-rf',name=self.rf_cname(carrier), params=self.rf_calibrations[self.rf_cname(carrier)])
         calibration = self.rf_calibration_identifier(carrier)
         calibration.update({k:str(v) for k,v in self.rf_calibrations[self.rf_cname(carrier)].items()})
-        self.exdir_db.save(measurement_type='iq_rf_calibration', metadata=calibration, type_revision='1')
+        data = self.exdir_db.save(measurement_type='iq_rf_calibration', metadata=calibration, type_revision='1')
+        surface = self.calibration_surfaces.get(self.calibration_surface_key('rf'))
+        if surface is not None:
+            surface.add((self.lo.get_frequency(), carrier.get_if()), self.rf_calibrations[self.rf_cname(carrier)]['Q'],
+                        data.id)
+
+    def get_rf_calibration_measurement(self, carrier):
+        """Returns the id of the saved rf calibration of the carrier. An interpolated calibration has no record of its
+        own, the id of the nearest saved calibration of the surface it was interpolated from is returned."""
+        calibration = self.rf_calibrations.get(self.rf_cname(carrier), {})
+        if 'data_id' in calibration:
+            return calibration['data_id']
+        return self.exdir_db.select_measurement(measurement_type='iq_rf_calibration',
+                                                metadata=self.rf_calibration_identifier(carrier)).id
+
+    def calibration_surface_key(self, kind):
+        if kind == 'rf':
+            return kind, self.name, self.sideband_id
+        return kind, self.name
+
+    def interpolated_calibration_stale(self, calibration):
+        """True if the calibration is interpolated and a measurement has been invalidated since."""
+        return 'error' in calibration and calibration['invalidations'] != self.exdir_db.invalidations
+
+    def get_calibration_surface(self, kind):
+        """Returns the calibration surface ('rf' or 'dc') of this mixer. All saved calibrations of the mixer are
+        loaded with a single database query on first use and again after an invalidation."""
+        key = self.calibration_surface_key(kind)
+        if key in self.calibration_surfaces and self.calibration_surfaces[key].stale():
+            del self.calibration_surfaces[key]
+        if key not in self.calibration_surfaces:
+            if kind == 'rf':
+                surface = CalibrationSurface(self.exdir_db, 'iq_rf_calibration',
+                                             {'cname': self.name, 'sideband_id': self.sideband_id},
+                                             ('lo_freq', 'if'), 'Q', length_scales=(100e6, 50e6), noise=1e-3,
+                                             amplitude=0.1)
+            else:
+                surface = CalibrationSurface(self.exdir_db, 'iq_dc_calibration', {'mixer': self.name},
+                                             ('lo_freq',), 'dc', length_scales=(100e6,), noise=2e-4, amplitude=0.01)
+            self.calibration_surfaces[key] = surface.load()
+        return self.calibration_surfaces[key]
+
+    def interpolate_rf_calibration(self, carrier):
+        """Returns the rf calibration of the carrier interpolated from the saved calibrations of this mixer, or None
+        if the error estimate of Q exceeds rf_calibration_tolerance and a new calibration is needed."""
+        if not self.rf_calibration_tolerance or self.exdir_db is None:
+            return None
+        surface = self.get_calibration_surface('rf')
+        Q, error = surface.predict(self.lo.get_frequency(), carrier.get_if())
+        if error > self.rf_calibration_tolerance:
+            return None
+        return {'I': 0.5, 'Q': Q, 'error': error, 'if': carrier._if, 'lo_freq': self.lo.get_frequency(),
+                'data_id': surface.nearest(self.lo.get_frequency(), carrier.get_if()),
+                'invalidations': surface.invalidations}
+
+    def interpolate_dc_calibration(self):
+        """Returns the dc calibration interpolated from the saved calibrations of this mixer, or None if the error
+        estimate exceeds dc_calibration_tolerance and a new calibration is needed."""
+        if not self.dc_calibration_tolerance or self.exdir_db is None:
+            return None
+        surface = self.get_calibration_surface('dc')
+        dc, error = surface.predict(self.lo.get_frequency())
+        if error > self.dc_calibration_tolerance:
+            return None
+        return {'dc': dc, 'error': error, 'data_id': surface.nearest(self.lo.get_frequency()),
+                'invalidations': surface.invalidations}
 
     def calib_dc(self):
         cname = self.dc_cname()
+        # an interpolated calibration is renewed after an invalidation; no database query otherwise
+        if self.interpolated_calibration_stale(self.dc_calibrations.get(cname, {})):
+            del self.dc_calibrations[cname]
+            self.get_dc_calibration()
         if self.ignore_calibration_drift:
             if cname not in self.dc_calibrations:
                 dc_c = [calib for calib in self.dc_calibrations.values()]
@@ -411,6 +497,9 @@ class Awg_iq_multi:
 
     def calib_rf(self, carrier):
         cname = self.rf_cname(carrier)
+        if self.interpolated_calibration_stale(self.rf_calibrations.get(cname, {})):
+            del self.rf_calibrations[cname]
+            self.get_rf_calibration(carrier)
         if self.ignore_calibration_drift:
             if cname not in self.rf_calibrations:
                 rf_c = [calib for calib in self.rf_calibrations.values()]
@@ -420,8 +509,17 @@ class Awg_iq_multi:
             print ('Calibration not loaded. Use ignore_calibration_drift to use any calibration.')
         return self.rf_calibrations[cname]
 
-    def _calibrate_cw_sa(self, sa, carrier, num_sidebands = 3, use_central = False, num_sidebands_final = 9, half_length = True, use_single_sweep=False):
-        """Performs IQ mixer calibration with the spectrum analyzer sa with the intermediate frequency."""
+    def _calibrate_cw_sa(self, sa, carrier, num_sidebands = 3, use_central = False, num_sidebands_final = 9, half_length = True, use_single_sweep=False, method='model'):
+        """Performs IQ mixer calibration with the spectrum analyzer sa with the intermediate frequency.
+
+        method='model' fits the power of the unwanted sidebands (see _calibrate_cw_sa_model), method='fmin' minimizes
+        the ratio of the unwanted to the wanted sidebands with the simplex method. Both take the unwanted sidebands
+        among num_sidebands, the LO leakage (central sideband) only with use_central, and read them in a single sweep
+        only with use_single_sweep."""
+        if method == 'model':
+            return self._calibrate_cw_sa_model(sa, carrier, num_sidebands=num_sidebands, use_central=use_central,
+                                               num_sidebands_final=num_sidebands_final, half_length=half_length,
+                                               use_single_sweep=use_single_sweep)
         from scipy.optimize import fmin
         #import time
         res_bw = 4e6
@@ -522,6 +620,141 @@ class Awg_iq_multi:
 
         return self.rf_calibrations[self.rf_cname(carrier)]
 
+    def _setup_sa_sidebands(self, sa, carrier, num_sidebands):
+        """Sets up sa to read the sidebands lo+n*|if|, n=-(num_sidebands-1)/2...(num_sidebands-1)/2 in a single sweep."""
+        sa.set_centerfreq(self.lo.get_frequency())
+        sa.set_span((num_sidebands-1)*np.abs(carrier.get_if()))
+        sa.set_nop(num_sidebands)
+        sa.set_detector('POS')
+        sa.set_res_bw(4e6)
+        sa.set_video_bw(1e3)
+        sa.set_sweep_time_auto(1)
+
+    def _measure_sidebands(self, sa, carrier, num_sidebands, single_sweep, sideband_ids=None):
+        """Returns the power of the sidebands lo+n*|if| in dBm for n in sideband_ids (by default all
+        n=-(num_sidebands-1)/2...(num_sidebands-1)/2). With single_sweep all sidebands are read in a single sweep
+        (set up by _setup_sa_sidebands), otherwise the analyzer is retuned to each of sideband_ids."""
+        if sideband_ids is None:
+            sideband_ids = np.arange(num_sidebands)-(num_sidebands-1)//2
+        if single_sweep:
+            return sa.measure()['Power'].ravel()[np.asarray(sideband_ids)+(num_sidebands-1)//2]
+        result = []
+        for sideband_id in sideband_ids:
+            sa.set_centerfreq(self.lo.get_frequency()+sideband_id*np.abs(carrier.get_if()))
+            result.append(np.log10(np.sum(10**(sa.measure()['Power']/10)))*10)
+        return np.asarray(result)
+
+    def _calibrate_cw_sa_model(self, sa, carrier, num_sidebands=3, use_central=False, num_sidebands_final=9,
+                               half_length=True, use_single_sweep=False, probe_radius=0.2, max_refinements=6):
+        """Performs IQ mixer calibration with the spectrum analyzer sa with a model of the unwanted sidebands.
+
+        At fixed I, the amplitude of each unwanted sideband is a linear function of the complex Q amplitude (or
+        independent of it, like the LO leakage), so their total power in mW is a rotationally symmetric paraboloid
+        A*|Q-Q0|**2 + floor over the Q plane. The unwanted sidebands are those among num_sidebands but the wanted
+        one and, unless use_central, the LO leakage; with the defaults only the image. Their power is measured at
+        the current solution and at four points around it, the paraboloid is fitted by least squares and the solution
+        jumps to its minimum. The fit is refined around the new solution, with the probe radius set to the distance
+        to the minimum expected from the power at the solution, until the power stops decreasing (at the noise
+        floor of the analyzer). This takes a few tens of power readings instead of the hundreds of the simplex
+        search. With use_single_sweep, analyzers with set_nop read all sidebands in a single sweep, otherwise the
+        analyzer is retuned to each unwanted sideband.
+
+        The model does not hold where the waveforms clip (amplitude above 1). Such points are not measured: probes
+        and jumps to the minimum are moved halfway to the current solution until the waveforms fit, so that the fit
+        and the solution only use unclipped points.
+        """
+        self.calibration_switch_setter()
+
+        sign = 1 if carrier.get_if() > 0 else -1
+        single_sweep = use_single_sweep and hasattr(sa, 'set_nop')
+        sideband_ids = np.arange(num_sidebands)-(num_sidebands-1)//2
+        bad_sideband_ids = sideband_ids[np.logical_and(sideband_ids != sign,
+                                                       np.logical_or(use_central, sideband_ids != 0))]
+        if single_sweep:
+            self._setup_sa_sidebands(sa, carrier, num_sidebands)
+        else:
+            sa.set_detector('rms')
+            sa.set_res_bw(4e6)
+            sa.set_video_bw(1e3)
+            sa.set_span(4e6)
+            if hasattr(sa, 'set_nop'):
+                sa.set_sweep_time(50e-3)
+                sa.set_nop(1)
+
+        self.lo.set_status(True)
+        self.awg_I.run()
+        self.awg_Q.run()
+
+        I = 0.5
+        dc = self.calib_dc()['dc']
+
+        def unwanted_power(Q):
+            if self._set_if_cw(dc, I, Q, carrier.get_if(), half_length) > 1:
+                return np.nan
+            power = np.log10(np.sum(10**(self._measure_sidebands(sa, carrier, num_sidebands, single_sweep,
+                                                                  bad_sideband_ids)/10)))*10
+            print('\rI: {0: 4.2e}\tQ:{1: 4.2e}\tB: {2:4.2f}'.format(I, Q, power), end="")
+            return 10**(power/10)
+
+        def unclipped_power(Q, towards):
+            # Q, moved halfway to towards until the waveforms do not clip, and the unwanted power there
+            for halving_id in range(16):
+                power = unwanted_power(Q)
+                if np.isfinite(power):
+                    return Q, power
+                Q = towards+(Q-towards)/2
+            raise ValueError('IQ mixer calibration: waveform clipped at Q={0:4.2f}'.format(Q))
+
+        probes = np.asarray([0, 1, 1j, -1, -1j])
+        solution, solution_power = unclipped_power(-0.2+0.5j, 0)
+        radius = probe_radius
+        for refinement_id in range(max_refinements+1):
+            Q, powers = [solution], [solution_power]
+            for probe in probes[1:]:
+                q, power = unclipped_power(solution+radius*probe, solution)
+                Q.append(q)
+                powers.append(power)
+            Q, powers = np.asarray(Q), np.asarray(powers)
+            # powers = A*|Q|**2 + B*Re(Q) + C*Im(Q) + D
+            model = np.asarray([np.abs(Q)**2, np.real(Q), np.imag(Q), np.ones(len(Q))]).T
+            (A, B, C, D), residuals, rank, singular_values = np.linalg.lstsq(model, powers, rcond=None)
+            if A <= 0:
+                logging.warning('Unwanted sideband power is not convex in Q, keeping the best probe point')
+                solution = Q[np.argmin(powers)]
+                break
+            minimum, minimum_power = unclipped_power(-(B+1j*C)/(2*A), solution)
+            improved = minimum_power < solution_power/2
+            if minimum_power < solution_power:
+                solution, solution_power = minimum, minimum_power
+            # no improvement with probes at the expected distance to the minimum: the sidebands are at the noise floor
+            if not improved and refinement_id > 0:
+                break
+            radius = np.sqrt(solution_power/A)
+
+        max_amplitude = self._set_if_cw(dc, I, solution, carrier.get_if(), half_length)
+        if max_amplitude > 1:
+            logging.warning('IQ mixer calibration: waveform clipped, max amplitude {0:4.2f}'.format(max_amplitude))
+
+        num_sidebands = num_sidebands_final
+        if single_sweep:
+            self._setup_sa_sidebands(sa, carrier, num_sidebands)
+        result = self._measure_sidebands(sa, carrier, num_sidebands, single_sweep)
+        sideband_ids = np.asarray(np.linspace(-(num_sidebands-1)/2, (num_sidebands-1)/2, num_sidebands), dtype=int)
+        bad_power = np.sum(10**((result[sideband_ids != sign])/20))
+        good_power = np.sum(10**((result[sideband_ids == sign])/20))
+        score = -good_power/bad_power
+        print('\rI: {0: 4.2e}\tQ:{1: 4.2e}\tB: {2:4.2f} G: {3:4.2f}'.format(I, solution, np.log10(bad_power)*20,
+                                                                          np.log10(good_power)*20)+str(result))
+
+        self.rf_calibrations[self.rf_cname(carrier)] = {'I': I,
+                                                        'Q': solution,
+                                                        'score': score,
+                                                        'num_sidebands': num_sidebands,
+                                                        'if': carrier._if,
+                                                        'lo_freq': self.lo.get_frequency()}
+
+        return self.rf_calibrations[self.rf_cname(carrier)]
+
     def _calibrate_zero_sa(self, sa):
         """Performs IQ mixer calibration for DC signals at the I and Q inputs."""
         import time
@@ -0,0 +1,153 @@
+'''
+Recursive invalidation of a measurement with a large number of dependent measurements.
+
+Creates a synthetic reference DAG in a temporary SQLite database: measurement 1 is a calibration, every other
+measurement but a few unreferencing roots references up to three earlier measurements with invalidating or
+non-invalidating reference types, so that only part of the measurements depend on the calibration. Times
+Exdir_db.invalidate of the calibration and checks that exactly the measurements reachable through invalidating
+references got invalidation metadata. For comparison, the node-by-node walk that Exdir_db.invalidate used before
+is timed on a smaller graph.
+
+On the smaller graph, also checks that invalidate with chain=False invalidates only the measurement itself, and that
+invalidating already invalidated measurements again adds metadata only to the newly invalidated ones.
+
+Usage: python benchmarks/exdir_db_invalidation.py [nodes] [baseline_nodes]
+'''
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pony.orm import db_session, select
+
+from qsweepy.ponyfiles.database import MyDatabase
+from qsweepy.ponyfiles.exdir_db import Exdir_db
+
+invalidating = ['calibration', 'pulse']
+non_invalidating = ['comment', 'plot']
+
+
+def create_graph(db, nodes, seed=0):
+    random = np.random.RandomState(seed)
+    references = {}
+    for node in range(2, nodes+1):
+        if random.rand() < 0.02:
+            continue # root, references nothing
+        parents = []
+        for parent in range(1+random.randint(3)):
+            parents.append((random.randint(1, node), (invalidating+non_invalidating)[random.randint(4)]))
+        for that, ref_type in parents:
+            references[(node, ref_type, str(that))] = that
+    with db_session:
+        connection = db.db.get_connection()
+        cursor = connection.cursor()
+        start = datetime.datetime.now()
+        cursor.executemany('INSERT INTO "Data" (id, comment, measurement_type, sample_name, start, filename, '
+                           'type_revision, owner) VALUES (?, \'\', ?, ?, ?, \'\', \'\', \'\')',
+                           [(node, 'synthetic', 'benchmark', start) for node in range(1, nodes+1)])
+        cursor.executemany('INSERT INTO "Reference" (this, that, ref_type, ref_comment) VALUES (?, ?, ?, ?)',
+                           [(this, that, ref_type, comment) for (this, ref_type, comment), that in references.items()])
+        for ref_type in invalidating:
+            db.Invalidations(ref_type=ref_type)
+    # measurements that depend on measurement 1
+    children = {}
+    for (this, ref_type, comment), that in references.items():
+        if ref_type in invalidating:
+            children.setdefault(that, set()).add(this)
+    reachable, pending = {1}, [1]
+    while pending:
+        for child in children.get(pending.pop(), ()):
+            if child not in reachable:
+                reachable.add(child)
+                pending.append(child)
+    return reachable
+
+
+def invalidate_node_by_node(exdir_db, data_id, reason='anonymous'):
+    # the walk of Exdir_db.invalidate before the recursive query: one query and four inserts per measurement
+    invalidation_time = str(datetime.datetime.now())
+    invalidation_types = set(select(i.ref_type for i in exdir_db.db.Invalidations))
+    invalidation_chain = {(None, exdir_db.db.Data[data_id])}
+    invalidation_chain_processed = set()
+    while invalidation_chain:
+        reason_data, current_data = invalidation_chain.pop()
+        exdir_db.db.Metadata(data_id=current_data.id, name='invalidation', value='True')
+        exdir_db.db.Metadata(data_id=current_data.id, name='invalidation_time', value=invalidation_time)
+        exdir_db.db.Metadata(data_id=current_data.id, name='invalidation_reason', value=reason)
+        if reason_data:
+            exdir_db.db.Metadata(data_id=current_data.id, name='invalidation_reason_chain', value=str(reason_data.id))
+        invalidation_chain.update((reference.that, reference.this)
+                                  for reference in exdir_db.db.Reference.select(lambda r: r.that.id == current_data.id)
+                                  if reference.ref_type in invalidation_types)
+        invalidation_chain_processed.add(current_data)
+        invalidation_chain = {i for i in invalidation_chain if i[1] not in invalidation_chain_processed}
+
+
+def run(nodes, invalidate):
+    directory = tempfile.mkdtemp()
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    reachable = create_graph(db, nodes)
+    exdir_db = Exdir_db(db)
+    start = time.perf_counter()
+    with db_session:
+        invalidate(exdir_db)
+    elapsed = time.perf_counter() - start
+    with db_session:
+        invalidated = set(select(m.data_id.id for m in db.Metadata if m.name == 'invalidation'))
+        reason_chain = select(m for m in db.Metadata if m.name == 'invalidation_reason_chain').count()
+    assert 1 < len(reachable) < nodes, 'the graph has no unreachable measurements'
+    assert invalidated == reachable
+    assert reason_chain == len(reachable)-1
+    return elapsed, len(reachable)
+
+
+def check_repeated_invalidation(nodes):
+    directory = tempfile.mkdtemp()
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    reachable = create_graph(db, nodes)
+    exdir_db = Exdir_db(db)
+
+    def metadata():
+        return set(select((m.data_id.id, m.name, m.value) for m in db.Metadata))
+
+    with db_session:
+        assert exdir_db.invalidate(1, reason='first', chain=False) == 1
+        first = metadata()
+        assert {(data_id, name) for data_id, name, value in first} == \
+            {(1, 'invalidation'), (1, 'invalidation_time'), (1, 'invalidation_reason')}
+
+        # the dependent measurements are invalidated, the calibration keeps its metadata
+        assert exdir_db.invalidate(1, reason='second') == len(reachable)
+        second = metadata()
+        assert first < second
+        assert {data_id for data_id, name, value in second if name == 'invalidation'} == reachable
+        assert {(data_id, value) for data_id, name, value in second if name == 'invalidation_reason'} == \
+            {(1, 'first')} | {(data_id, 'second') for data_id in reachable - {1}}
+        assert len([name for data_id, name, value in second if name == 'invalidation_reason_chain']) == \
+            len(reachable)-1
+
+        # invalidating an invalidated measurement again changes nothing
+        assert exdir_db.invalidate(max(reachable), reason='third') >= 1
+        assert exdir_db.invalidate(1, reason='third') == len(reachable)
+        assert metadata() == second
+    print('chain=False and repeated invalidation of {} measurements: metadata as expected'.format(len(reachable)))
+
+
+def main(nodes=100000, baseline_nodes=2000):
+    results = {}
+    results['recursive query, {} nodes'.format(nodes)] = run(nodes, lambda e: e.invalidate(1, reason='benchmark'))
+    results['recursive query, {} nodes'.format(baseline_nodes)] = run(
+        baseline_nodes, lambda e: e.invalidate(1, reason='benchmark'))
+    results['node by node, {} nodes'.format(baseline_nodes)] = run(
+        baseline_nodes, lambda e: invalidate_node_by_node(e, 1, reason='benchmark'))
+    for name, (elapsed, invalidated) in results.items():
+        print('{:35s} {:8.3f} s, {:6d} measurements invalidated'.format(name, elapsed, invalidated))
+    check_repeated_invalidation(baseline_nodes)
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
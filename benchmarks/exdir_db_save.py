@@ -0,0 +1,101 @@
+'''
+Database part of saving many small measurements, e.g. in calibration scans.
+
+Saves measurements with a few sweep parameters, tens of metadata entries and a few references into a temporary
+SQLite database the way Exdir_db.save_measurement does (create_in_database and update_in_database; the exdir files
+are not written) and reports saves per second for
+  - the entity-per-row inserts that create_in_database used before, committing every save,
+  - the multi-row inserts of create_in_database, committing every save,
+  - the multi-row inserts of create_in_database, with commits deferred over the whole scan (Exdir_db.deferred_commit).
+Each saved measurement is selected back by its metadata in the same session to check read-after-write consistency.
+
+Usage: python benchmarks/exdir_db_save.py [saves] [metadata]
+'''
+
+import contextlib
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pony.orm import db_session, commit, select
+
+from qsweepy.ponyfiles.database import MyDatabase
+from qsweepy.ponyfiles.exdir_db import Exdir_db
+from qsweepy.ponyfiles.data_structures import MeasurementState, MeasurementDataset, MeasurementParameter
+
+
+def measurement(save_id, metadata, references):
+    state = MeasurementState(measurement_type='benchmark', sample_name='benchmark',
+                             metadata={'save_id': str(save_id)}, references=references)
+    state.metadata.update({'parameter_{}'.format(i): str(np.random.rand()) for i in range(metadata)})
+    state.datasets['iq'] = MeasurementDataset([MeasurementParameter(np.linspace(6e9, 7e9, 101), True, 'frequency', 'Hz'),
+                                               MeasurementParameter(np.linspace(0, 1, 11), True, 'amplitude', '')],
+                                              np.zeros((101, 11), complex))
+    state.start = datetime.datetime.now()
+    return state
+
+
+def create_entity_per_row(db, state):
+    # the inserts of MyDatabase.create_in_database before the multi-row inserts: one pony entity per row
+    d = db.Data(comment=state.comment, measurement_type=state.measurement_type, sample_name=state.sample_name,
+                start=state.start, filename=state.filename, type_revision=state.type_revision, owner=state.owner,
+                incomplete=True)
+    for dataset in state.datasets.keys():
+        for parameter in state.datasets[dataset].parameters:
+            db.Linear_sweep(data_id=d, min_value=np.min(parameter.values), max_value=np.max(parameter.values),
+                            num_points=len(parameter.values), parameter_name=parameter.name,
+                            parameter_units=parameter.unit)
+    for name, value in state.metadata.items():
+        db.Metadata(data_id=d, name=name, value=value)
+    for ref_description, ref_that in state.references.items():
+        if type(ref_description) is tuple:
+            db.Reference(this=d, that=ref_that, ref_type=ref_description[0], ref_comment=ref_description[1])
+        else:
+            db.Reference(this=d, that=ref_that, ref_type=ref_description, ref_comment='-')
+    commit()
+    state.id = d.id
+    return d.id
+
+
+def run(saves, metadata, create, deferred):
+    directory = tempfile.mkdtemp()
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    exdir_db = Exdir_db(db, sample_name='benchmark')
+    with db_session:
+        calibration = measurement(0, metadata, {})
+        db.create_in_database(calibration)
+        db.update_in_database(calibration)
+    states = [measurement(save_id, metadata, {'calibration': calibration.id, ('reference', 'previous'): calibration.id})
+              for save_id in range(1, saves+1)]
+    start = time.perf_counter()
+    with db_session, (exdir_db.deferred_commit() if deferred else contextlib.nullcontext()):
+        for state in states:
+            create(db, state)
+            state.metadata['fit_result'] = '1.0'
+            db.update_in_database(state)
+            selected = exdir_db.select_measurements_db('benchmark', metadata={'save_id': state.metadata['save_id']})
+            assert [d.id for d in selected] == [state.id]
+    elapsed = time.perf_counter() - start
+    with db_session:
+        assert select(m for m in db.Metadata).count() == metadata+1 + saves*(metadata+2)
+        assert select(r for r in db.Reference).count() == saves*2
+        assert select(l for l in db.Linear_sweep).count() == (saves+1)*2
+    return saves/elapsed
+
+
+def main(saves=500, metadata=30):
+    results = {
+        'entity per row, commit per save': run(saves, metadata, create_entity_per_row, deferred=False),
+        'multi-row inserts, commit per save': run(saves, metadata, MyDatabase.create_in_database, deferred=False),
+        'multi-row inserts, deferred commit': run(saves, metadata, MyDatabase.create_in_database, deferred=True),
+    }
+    for name, saves_per_second in results.items():
+        print('{:40s} {:8.1f} saves/s'.format(name, saves_per_second))
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,55 @@
+'''
+Cold start of the setup scripts: import time of "from qsweepy.instruments import *; from qsweepy import *".
+
+Runs the statement in a fresh interpreter with python -X importtime and sums the cumulative import times of the
+top-level imports, less those of the interpreter start. This includes the modules that the star import of the
+drivers looks up (e.g. numpy and ctypes for the names of "from numpy import *" in a driver). For comparison, the same is measured with eager imports of every module of the
+package and every instrument driver, which is what the star imports did before the modules were imported on first
+use (modules that cannot be imported in the environment are skipped, as the star import of the drivers did).
+Fails if the lazy cold start is not at least two times shorter.
+
+Usage: python benchmarks/import_time.py [repeats]
+'''
+
+import subprocess
+import sys
+
+lazy = 'from qsweepy.instruments import *; from qsweepy import *'
+eager = '''
+import importlib, pkgutil, qsweepy, qsweepy.instrument_drivers
+for package in [qsweepy, qsweepy.instrument_drivers]:
+    for loader, name, is_pkg in pkgutil.iter_modules(package.__path__):
+        try:
+            importlib.import_module(package.__name__ + '.' + name)
+        except Exception:
+            pass
+'''
+
+
+def import_time(statement):
+    '''
+    Sum of the cumulative import times (in seconds) of the top-level imports by statement in a new interpreter.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            total += int(cumulative)
+    return total*1e-6 - (import_time('pass') if statement != 'pass' else 0)
+
+
+def main(repeats=3):
+    results = {'lazy': min(import_time(lazy) for repeat in range(repeats)),
+               'eager': min(import_time(eager) for repeat in range(repeats))}
+    for name, elapsed in results.items():
+        print('{:6s} {:8.3f} s'.format(name, elapsed))
+    assert results['lazy']*2 <= results['eager']
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,146 @@
+'''
+Size of the live updates of a running sweep (live_updates, Sweeper.publish_live_updates).
+
+Runs Sweeper.sweep over a 2d grid of a simulated measurer with a scalar dataset and a trace dataset (point axis)
+in a temporary directory with an SQLite database, publishing live updates to a QueueChannel. Rebuilds every dataset
+from the blocks of the received update messages and checks that it equals the final dataset of the sweep, also with
+on_update_divider > 1 (several points per update). Passes the update messages through
+plotly_plot.live_update_traces for a line trace along the inner sweep parameter and a 2d trace of the trace
+dataset. Reports the pickled bytes per update message (what QueueChannel transports) at the start and at the end of
+the sweep and compares them with the size of the datasets. Fails if the rebuilt datasets differ from the final ones,
+if the line trace is not extended by every measured point, or if the bytes per update grow with the dataset (by
+more than tolerance).
+
+Usage: python benchmarks/live_updates.py [rows] [columns] [tolerance]
+'''
+
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pony.orm import db_session
+
+from qsweepy import plotly_plot
+from qsweepy.live_updates import QueueChannel
+from qsweepy.ponyfiles.database import MyDatabase
+from qsweepy.sweep_extras import Sweeper
+
+
+class trace_measurer:
+    '''
+    Measures a scalar 'S21' and a 'Trace' of trace_points points at the current bias and frequency.
+    '''
+    def __init__(self, trace_points=64, seed=0):
+        self.time = np.linspace(0, 1e-6, trace_points)
+        self.bias = 0.
+        self.frequency = 0.
+        self.random = np.random.RandomState(seed)
+
+    def set_bias(self, bias):
+        self.bias = bias
+
+    def set_frequency(self, frequency):
+        self.frequency = frequency
+
+    def get_points(self):
+        return {'S21': [], 'Trace': [('Time', self.time, 's')]}
+
+    def get_dtype(self):
+        return {'S21': complex, 'Trace': complex}
+
+    def get_opts(self):
+        return {'S21': {}, 'Trace': {}}
+
+    def measure(self):
+        detuning = self.frequency - 7e9*(1 + 1e-3*self.bias)
+        s21 = 1/(1 + 2j*detuning/1e6) + self.random.normal(scale=1e-2)
+        return {'S21': s21, 'Trace': s21*np.exp(-self.time/3e-7) + self.random.normal(scale=1e-2, size=self.time.shape)}
+
+
+def receive(channel):
+    '''
+    Messages of a sweep, until its finish message.
+    '''
+    messages = []
+    while not messages or messages[-1]['type'] != 'finish':
+        message = channel.get(timeout=10)
+        assert message is not None, 'no finish message'
+        messages.append(message)
+    return messages
+
+
+def rebuild(messages):
+    '''
+    Datasets written from the blocks of the update messages into arrays of the shape of the start message.
+    '''
+    datasets = {name: np.full(dataset['shape'], np.nan, dtype=dataset['dtype'])
+                for name, dataset in messages[0]['datasets'].items()}
+    for message in messages:
+        if message['type'] != 'update':
+            continue
+        for block in message['blocks']:
+            datasets[message['dataset']][tuple(block['index'])+(slice(block['start'], block['stop']), Ellipsis)] = \
+                block['data']
+    return datasets
+
+
+def run(sweeper, rows, columns, on_update_divider=1):
+    measurer = trace_measurer()
+    channel = QueueChannel()
+    on_start, on_update, on_finish = sweeper.on_start[:], sweeper.on_update[:], sweeper.on_finish[:]
+    sweeper.publish_live_updates(channel)
+    try:
+        with db_session:
+            state = sweeper.sweep(measurer, (np.linspace(-1, 1, rows), measurer.set_bias, 'Bias', 'mA'),
+                                  (np.linspace(6.99e9, 7.01e9, columns), measurer.set_frequency, 'Frequency', 'Hz'),
+                                  measurement_type='live_updates_benchmark', on_update_divider=on_update_divider)
+    finally:
+        sweeper.on_start, sweeper.on_update, sweeper.on_finish = on_start, on_update, on_finish
+    return state, receive(channel)
+
+
+def main(rows=20, columns=50, tolerance=0.05):
+    directory = tempfile.mkdtemp()
+    os.environ['QTLAB_PATH'] = directory
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    sweeper = Sweeper(db, sample_name='benchmark')
+    sweeper.on_update = [] # no time left printout
+    # no image export of the default plot, it needs kaleido and is not part of the measurement
+    sweeper.on_finish = sweeper.on_finish[:-1]
+
+    for on_update_divider in (1, 7):
+        state, messages = run(sweeper, rows, columns, on_update_divider)
+        assert messages[0]['type'] == 'start' and messages[0]['id'] == state.id
+        for name, data in rebuild(messages).items():
+            assert np.array_equal(data, state.datasets[name].data), \
+                '{} rebuilt from the updates differs from the final dataset'.format(name)
+        print('on_update_divider {}: {} messages, datasets rebuilt from the updates equal the final datasets'.format(
+            on_update_divider, len(messages)))
+
+    state, messages = run(sweeper, rows, columns)
+    updates = [message for message in messages if message['type'] == 'update']
+    selected_traces = pd.DataFrame([
+        {'id': state.id, 'dataset': 'S21', 'op': 'Abs', 'style': '-', 'x-axis': 'Frequency', 'y-axis': 'data'},
+        {'id': state.id, 'dataset': 'Trace', 'op': 'Re', 'style': '2d', 'x-axis': 'Time', 'y-axis': 'Bias'}])
+    extended_points, patches = 0, 0
+    for message in updates:
+        (extend_data, trace_indices), trace_patches = plotly_plot.live_update_traces(message, selected_traces)
+        extended_points += sum(len(y) for y in extend_data['y'])
+        patches += len(trace_patches)
+    assert extended_points == rows*columns
+    print('live_update_traces: {} points extended, {} patches'.format(extended_points, patches))
+
+    for name, dataset in state.datasets.items():
+        sizes = np.asarray([len(pickle.dumps(message)) for message in updates if message['dataset'] == name])
+        first, last = np.median(sizes[:len(sizes)//10]), np.median(sizes[-len(sizes)//10:])
+        print('{:6s} {:8.0f} bytes per update at the start, {:8.0f} at the end, {:10d} bytes of data'.format(
+            name, first, last, dataset.data.nbytes))
+        assert last <= first*(1+tolerance)
+    return messages
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]], *[float(a) for a in sys.argv[3:]])
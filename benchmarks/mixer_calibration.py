@@ -0,0 +1,64 @@
+'''
+Number of spectrum analyzer reads of the IQ mixer sideband calibration.
+
+Calibrates a simulated IQ mixer with amplitude and phase imbalance (simulated_instruments) with the model-based
+method and with the simplex search of Awg_iq_multi._calibrate_cw_sa, and compares the number of sa.measure()
+calls and the image sideband suppression, computed from the noise-free spectrum of the simulated mixer.
+Fails if the model-based calibration does not suppress the image as well as the simplex search (within
+tolerance dB) with at least 5 times fewer analyzer reads. The AWG outputs clip at full scale; a second mixer needs a
+Q amplitude close to full scale, where the probes of the model-based calibration would clip.
+
+Usage: python benchmarks/mixer_calibration.py [tolerance]
+'''
+
+import sys
+
+import numpy as np
+
+from qsweepy import awg_iq_multi
+from qsweepy.dummy_awg import DummyAWG
+from qsweepy.simulated_instruments import SimulatedLO, SimulatedIQMixer, SimulatedSpectrumAnalyzer
+
+
+def calibrate(method, intermediate_frequency=-100e6, amplitude_imbalance=1.08, seed=0):
+    awg = DummyAWG(channels=2)
+    awg.set_clock(1e9)
+    awg.set_nop(1000)
+    lo = SimulatedLO(6e9)
+    mixer = SimulatedIQMixer(awg, awg, 0, 1, lo, amplitude_imbalance=amplitude_imbalance, phase_imbalance=0.07,
+                             lo_leakage=0.01, full_scale=1.)
+    sa = SimulatedSpectrumAnalyzer(mixer, seed=seed)
+
+    iq = awg_iq_multi.Awg_iq_multi(awg, awg, 0, 1, lo, exdir_db=None)
+    iq.dc_calibrations[iq.dc_cname()] = {'dc': 0}
+    carrier = awg_iq_multi.Carrier(iq)
+    carrier.set_frequency(lo.get_frequency()+intermediate_frequency)
+    calibration = iq._calibrate_cw_sa(sa, carrier, method=method)
+
+    frequencies, powers = mixer.get_spectrum()
+    wanted = powers[np.argmin(np.abs(frequencies-carrier.get_frequency()))]
+    image = powers[np.argmin(np.abs(frequencies-(2*lo.get_frequency()-carrier.get_frequency())))]
+    dynamic_range = 10*np.log10(wanted) - sa.noise_floor
+    return {'measure calls': sa.measure_count,
+            'suppression': min(10*np.log10(wanted/image), dynamic_range),
+            'Q': calibration['Q']}
+
+
+def main(tolerance=1.0):
+    results = {}
+    for amplitude_imbalance in (1.08, 0.51):
+        results[amplitude_imbalance] = {method: calibrate(method, amplitude_imbalance=amplitude_imbalance)
+                                        for method in ['fmin', 'model']}
+    print()
+    for amplitude_imbalance, mixer_results in results.items():
+        for method, result in mixer_results.items():
+            print('amplitude imbalance {:4.2f}: {:6s} {:5d} sa.measure() calls, image suppression {:6.2f} dB, '
+                  'Q={:.5f}'.format(amplitude_imbalance, method, result['measure calls'], result['suppression'],
+                                    result['Q']))
+        assert mixer_results['model']['suppression'] >= mixer_results['fmin']['suppression'] - tolerance
+        assert mixer_results['model']['measure calls']*5 <= mixer_results['fmin']['measure calls']
+    return results
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
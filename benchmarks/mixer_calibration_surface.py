@@ -0,0 +1,147 @@
+'''
+Interpolated IQ mixer sideband calibrations (calibration_surface, Awg_iq_multi.interpolate_rf_calibration).
+
+Calibrates a simulated IQ mixer whose amplitude and phase imbalance depend on the LO and intermediate frequencies
+on a grid of frequencies with the model-based method and saves the calibrations in a temporary SQLite database.
+At frequencies between the grid points, compares the interpolated calibration with a calibration measured there:
+the image sideband suppression of both is computed from the noise-free spectrum of the simulated mixer. Fails if
+the interpolated calibration suppresses the image by more than tolerance dB less than the measured one, or if its
+error estimate does not cover the difference of the Q amplitudes.
+
+Also checks that interpolation is off by default, that the interpolated calibrations reference the nearest saved
+calibration (Carrier.get_calibration_measurement), that surfaces of different sideband ids are kept apart, that
+assembling a waveform does not query the database, and that an invalidated calibration is no longer used.
+
+Usage: python benchmarks/mixer_calibration_surface.py [tolerance]
+'''
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+from pony.orm import db_session
+
+from qsweepy import awg_iq_multi
+from qsweepy.dummy_awg import DummyAWG
+from qsweepy.ponyfiles.database import MyDatabase
+from qsweepy.ponyfiles.exdir_db import Exdir_db
+from qsweepy.simulated_instruments import SimulatedLO, SimulatedIQMixer, SimulatedSpectrumAnalyzer
+
+
+def imbalance(lo_frequency, intermediate_frequency):
+    '''
+    Amplitude and phase imbalance of the simulated mixer, smooth on the scale of 100 MHz.
+    '''
+    x, y = (lo_frequency-6e9)/300e6, (intermediate_frequency+100e6)/100e6
+    return 1.08 + 0.03*np.sin(x) + 0.02*y, 0.07 + 0.02*np.cos(x) - 0.01*y
+
+
+class setup:
+    def __init__(self, exdir_db, seed=0):
+        self.awg = DummyAWG(channels=2)
+        self.awg.set_clock(1e9)
+        self.awg.set_nop(1000)
+        self.lo = SimulatedLO(6e9)
+        self.mixer = SimulatedIQMixer(self.awg, self.awg, 0, 1, self.lo, lo_leakage=0.01)
+        self.sa = SimulatedSpectrumAnalyzer(self.mixer, seed=seed)
+        self.iq = awg_iq_multi.Awg_iq_multi(self.awg, self.awg, 0, 1, self.lo, exdir_db=exdir_db)
+        self.iq.name = 'benchmark'
+        self.carrier = awg_iq_multi.Carrier(self.iq)
+        self.iq.carriers['carrier'] = self.carrier
+
+    def tune(self, lo_frequency, intermediate_frequency):
+        self.lo.set_frequency(lo_frequency)
+        self.carrier.set_frequency(lo_frequency+intermediate_frequency)
+        self.mixer.amplitude_imbalance, self.mixer.phase_imbalance = imbalance(lo_frequency, intermediate_frequency)
+        self.iq.dc_calibrations[self.iq.dc_cname()] = {'dc': 0}
+
+    def calibrate(self):
+        calibration = self.iq._calibrate_cw_sa(self.sa, self.carrier, method='model')
+        self.iq.save_rf_calibration(self.carrier)
+        return calibration
+
+    def suppression(self, calibration):
+        '''
+        Image sideband suppression in dB of a CW tone with the calibration.
+        '''
+        self.iq._set_if_cw(0, calibration['I'], calibration['Q'], self.carrier.get_if(), True)
+        frequencies, powers = self.mixer.get_spectrum()
+        wanted = powers[np.argmin(np.abs(frequencies-self.carrier.get_frequency()))]
+        image = powers[np.argmin(np.abs(frequencies-(2*self.lo.get_frequency()-self.carrier.get_frequency())))]
+        return 10*np.log10(wanted/image)
+
+
+def main(tolerance=3.0):
+    directory = tempfile.mkdtemp()
+    os.environ['QTLAB_PATH'] = directory
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    exdir_db = Exdir_db(db, sample_name='benchmark')
+    lo_grid, if_grid = np.linspace(5.8e9, 6.2e9, 5), np.linspace(-150e6, -50e6, 5)
+
+    with db_session:
+        calibrated = setup(exdir_db)
+        assert calibrated.iq.interpolate_rf_calibration(calibrated.carrier) is None, 'interpolation is on by default'
+        ids = {}
+        for lo_frequency in lo_grid:
+            for intermediate_frequency in if_grid:
+                calibrated.tune(lo_frequency, intermediate_frequency)
+                calibrated.calibrate()
+                ids[(lo_frequency, intermediate_frequency)] = calibrated.iq.get_rf_calibration_measurement(
+                    calibrated.carrier)
+        print('{} calibrations saved'.format(len(ids)))
+
+        interpolated = setup(exdir_db, seed=1)
+        interpolated.iq.rf_calibration_tolerance = 5e-3
+        worst, measured_count = np.inf, 0
+        for lo_frequency in (lo_grid[1:]+lo_grid[:-1])/2:
+            for intermediate_frequency in (if_grid[1:]+if_grid[:-1])/2:
+                interpolated.tune(lo_frequency, intermediate_frequency)
+                calibration = interpolated.iq.get_rf_calibration(interpolated.carrier)
+                assert 'error' in calibration, 'no interpolation at {} {}'.format(lo_frequency, intermediate_frequency)
+                calibrated.tune(lo_frequency, intermediate_frequency)
+                measured = calibrated.calibrate()
+                measured_count += 1
+                interpolated_suppression = interpolated.suppression(calibration)
+                measured_suppression = calibrated.suppression(measured)
+                print('LO {:6.4f} GHz IF {:7.2f} MHz: Q interpolated {:.5f} +- {:.5f}, measured {:.5f}; image '
+                      'suppression {:5.1f} dB interpolated, {:5.1f} dB measured'.format(
+                       lo_frequency/1e9, intermediate_frequency/1e6, calibration['Q'], calibration['error'],
+                       measured['Q'], interpolated_suppression, measured_suppression))
+                assert interpolated_suppression >= measured_suppression - tolerance
+                assert np.abs(calibration['Q']-measured['Q']) <= 3*calibration['error']
+                worst = min(worst, interpolated_suppression-measured_suppression)
+                # the interpolated calibration references the nearest calibration of the grid
+                nearest = min(ids.keys(), key=lambda c: ((c[0]-lo_frequency)/100e6)**2 +
+                                                        ((c[1]-intermediate_frequency)/50e6)**2)
+                assert interpolated.carrier.get_calibration_measurement() == ids[nearest]
+        print('interpolated calibrations suppress the image at most {:.1f} dB less than measured ones'.format(-worst))
+
+        # waveforms are assembled from the loaded calibrations without database queries
+        queries = []
+        select_measurements_metadata = exdir_db.select_measurements_metadata
+        exdir_db.select_measurements_metadata = lambda *args, **kwargs: queries.append(args) or \
+            select_measurements_metadata(*args, **kwargs)
+        interpolated.carrier.set_waveform(np.ones(interpolated.iq.get_nop()))
+        assert not len(queries), 'assemble_waveform queried the database'
+
+        # surfaces of other sidebands are separate
+        interpolated.iq.sideband_id = 1
+        assert interpolated.iq.interpolate_rf_calibration(interpolated.carrier) is None
+        interpolated.iq.sideband_id = 0
+        del queries[:]
+
+        # an invalidated calibration is no longer used
+        lo_frequency, intermediate_frequency = interpolated.lo.get_frequency(), interpolated.carrier.get_if()
+        exdir_db.invalidate(interpolated.carrier.get_calibration_measurement(), reason='benchmark')
+        calibration = interpolated.iq.calib_rf(interpolated.carrier)
+        assert len(queries) == 1, 'the calibration surface was not reloaded after the invalidation'
+        assert interpolated.carrier.get_calibration_measurement() != ids[nearest]
+        assert len(interpolated.iq.get_calibration_surface('rf')) == len(ids) + measured_count - 1
+        print('after the invalidation of calibration {}, the calibration at LO {:6.4f} GHz IF {:7.2f} MHz references '
+              'calibration {}'.format(ids[nearest], lo_frequency/1e9, intermediate_frequency/1e6,
+                                      calibration['data_id']))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
@@ -0,0 +1,143 @@
+'''
+Gain and noise temperature maps of a parametric amplifier from noise powers measured with two input noise
+temperatures (paramp.gain_noise).
+
+Checks paramp.planck_function, paramp.gain_noise and the per-target-frequency cuts of load_noise_measurement,
+load_vna_noise_measurement and load_gain_saturation_measurement against the per-frequency loops they replace, then
+times the solve of a frequencies x pump powers x biases map: at once with paramp.gain_noise, and with the loop over
+frequencies called for every pump power and bias (timed on a few slices and extrapolated to the whole map).
+
+Usage: python benchmarks/paramp_gain_noise.py [frequencies] [pump_powers] [biases] [loop_slices]
+'''
+
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy.constants import Planck, Boltzmann
+
+from qsweepy import paramp
+
+T1 = [(0.02, 0.9), (4., 0.1)]  # (temperature, gain) of the input noise sources with the cold load
+T2 = [(0.5, 0.9), (4., 0.1)]  # and with the hot load
+bw = 1e6
+
+
+def planck_function_loop(f, Ts, gains):
+    # paramp.planck_function before it was vectorized, f is a scalar
+    return np.sum([Planck*f*(0.5+1./(np.exp(Planck*f/(Boltzmann*T))-1))*gain for T, gain in zip(Ts, gains)])
+
+
+def gain_noise_loop(f, P_meas, T1, T2, bw):
+    # paramp.gain_noise before it was vectorized, P_meas of shape (2, len(f))
+    G_ = np.zeros_like(f)
+    TN_ = np.zeros_like(f)
+    P_meas = np.asarray(P_meas)*1e-3
+    for f_id, f_ in enumerate(f):
+        P_in = [planck_function_loop(f_, [t[0] for t in T1], [t[1] for t in T1]),
+                planck_function_loop(f_, [t[0] for t in T2], [t[1] for t in T2])]
+        a = np.asarray([[1, P_in[0]*bw], [1, P_in[1]*bw]])
+        GkTNbw, G = np.linalg.solve(a, P_meas[:, f_id].T)
+        G_[f_id] = G
+        TN_[f_id] = GkTNbw/(Boltzmann*G*bw)
+    return G_, TN_
+
+
+def noise_powers(f, shape, rng):
+    '''
+    Noise powers in mW measured with T1 and T2 for random gains and noise temperatures of the given shape (the
+    last axis is f).
+    '''
+    G = 10**(rng.uniform(0, 25, shape)/10)
+    TN = rng.uniform(0.05, 1, shape)
+    P_in = [np.sum([Planck*f*(0.5+1./np.expm1(Planck*f/(Boltzmann*T)))*g for T, g in Ts], axis=0) for Ts in (T1, T2)]
+    return np.asarray([G*(Boltzmann*TN+P)*bw*1e3 for P in P_in]), G, TN
+
+
+def check_regression(amplifier, rng):
+    f = np.linspace(6e9, 8e9, 101)
+    for f_ in [4e9, 7.5e9]:
+        assert np.isclose(amplifier.planck_function(f_, *zip(*T1)), planck_function_loop(f_, *zip(*T1)), rtol=1e-12)
+    assert np.allclose(amplifier.planck_function(f, *zip(*T2)), [planck_function_loop(f_, *zip(*T2)) for f_ in f],
+                       rtol=1e-12)
+
+    P_meas, G, TN = noise_powers(f, (7, 5, len(f)), rng)
+    G_map, TN_map = amplifier.gain_noise(f, P_meas, T1, T2, bw)
+    assert np.allclose(G_map, G, rtol=1e-8) and np.allclose(TN_map, TN, rtol=1e-6)
+    for i in range(G.shape[0]):
+        for j in range(G.shape[1]):
+            G_loop, TN_loop = gain_noise_loop(f, P_meas[:, i, j, :], T1, T2, bw)
+            assert np.allclose(G_map[i, j], G_loop, rtol=1e-10) and np.allclose(TN_map[i, j], TN_loop, rtol=1e-10)
+
+    directory = tempfile.mkdtemp()
+    target_frequencies = np.concatenate([[5e9], np.linspace(6e9, 8e9, 13), [6.05e9, 9e9]])  # incl. out of range
+
+    P_meas, G, TN = noise_powers(f, (len(target_frequencies), len(f)), rng)
+    temp_files = []
+    for Ts, P in zip((T1, T2), P_meas):
+        filename = os.path.join(directory, 'noise {}.pkl'.format(Ts[0][0]))
+        with open(filename, 'wb') as file:
+            pickle.dump(({}, {'Power': (('Target frequency', 'Frequency'), (target_frequencies, f), 10*np.log10(P))}),
+                        file)
+        temp_files.append((Ts, filename))
+    amplifier.load_noise_measurement(temp_files, bw)
+    for tf_id, tf in enumerate(target_frequencies):
+        G_loop, TN_loop = gain_noise_loop(f, np.asarray(amplifier.GN_P)[:, tf_id, :], T1, T2, bw)
+        assert np.allclose(amplifier.G[tf_id], G_loop, rtol=1e-10)
+        assert np.isclose(amplifier.G_1d[tf_id], np.interp(tf, f, G_loop), rtol=1e-10)
+        assert np.isclose(amplifier.TN_1d[tf_id], np.interp(tf, f, TN_loop), rtol=1e-10)
+
+    S = (rng.normal(size=(len(target_frequencies), len(f))) + 1j*rng.normal(size=(len(target_frequencies), len(f))))
+    S[3, 10] = np.nan
+    filename = os.path.join(directory, 'vna noise.pkl')
+    with open(filename, 'wb') as file:
+        pickle.dump(({}, {'S-parameter': (('Target frequency', 'Frequency'), (target_frequencies, f), S),
+                          'S-parameter std': (('Target frequency', 'Frequency'), (target_frequencies, f), S*0.1)}),
+                    file)
+    amplifier.load_vna_noise_measurement(filename, -30, bw, 60)
+    for tf_id, tf in enumerate(target_frequencies):
+        assert np.allclose(amplifier.G_m_1d[tf_id], np.interp(tf, f, amplifier.G_m[tf_id]), rtol=1e-12, equal_nan=True)
+        assert np.allclose(amplifier.TN_m_1d[tf_id], np.interp(tf, f, amplifier.TN_m[tf_id]), rtol=1e-12,
+                           equal_nan=True)
+
+    pump_powers = np.linspace(-20, 0, 9)
+    S = 10**(rng.uniform(0, 2, (len(target_frequencies), len(pump_powers), len(f))))
+    S *= np.linspace(1, 0.5, len(pump_powers))[np.newaxis, :, np.newaxis]  # compression
+    filename = os.path.join(directory, 'saturation.pkl')
+    with open(filename, 'wb') as file:
+        pickle.dump(({}, {'S-parameter': (('Target frequency', 'Pump power', 'Frequency'),
+                                          (target_frequencies, pump_powers, f), S)}), file)
+    amplifier.load_gain_saturation_measurement(filename)
+    for tf_id, tf in enumerate(target_frequencies):
+        assert np.allclose(amplifier.sat_1db_ft[tf_id], np.interp(tf, f, amplifier.sat_1db_ft_freq[tf_id]),
+                           rtol=1e-12, equal_nan=True)
+
+
+def main(frequencies=1000, pump_powers=200, biases=50, loop_slices=10):
+    rng = np.random.default_rng(0)
+    amplifier = paramp.paramp(None, None, None)
+    check_regression(amplifier, rng)
+
+    f = np.linspace(6e9, 8e9, frequencies)
+    P_meas, G, TN = noise_powers(f, (biases, pump_powers, frequencies), rng)
+
+    start = time.perf_counter()
+    G_map, TN_map = amplifier.gain_noise(f, P_meas, T1, T2, bw)
+    vectorized = time.perf_counter() - start
+    assert np.allclose(G_map, G, rtol=1e-8) and np.allclose(TN_map, TN, rtol=1e-6)
+
+    start = time.perf_counter()
+    for slice_id in range(loop_slices):
+        gain_noise_loop(f, P_meas[:, slice_id % biases, slice_id // biases], T1, T2, bw)
+    loop = (time.perf_counter() - start)/loop_slices*biases*pump_powers
+
+    print('{}x{}x{} map: loop over frequencies {:8.2f} s (extrapolated), gain_noise {:8.3f} s'.format(
+        frequencies, pump_powers, biases, loop, vectorized))
+    return {'loop': loop, 'vectorized': vectorized}
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
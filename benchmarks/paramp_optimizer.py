@@ -0,0 +1,136 @@
+'''
+Instrument evaluations needed to tune up a parametric amplifier (paramp.paramp.measure) with the Nelder-Mead
+restarts of sweep.optimize and with the surrogate optimizer (surrogate_optimizer), against SimulatedParamp measured
+by a SimulatedVNA.
+
+For every optimizer, reports over several seeds (of the VNA noise and the surrogate candidates) the median number of
+VNA measurements until the gain at the target frequency first reaches the target gain, the median number until the
+optimizer returns, and the gain and bandwidth at the operating points found. Nelder-Mead is run with the default
+initial simplex of paramp (hint_rel_errors) and with one spanning half of the search box of the surrogate optimizer
+(hint_abs_errors). A surrogate optimization after loading the saved operating points of the first ones
+(paramp.load_evaluations) shows the reuse of earlier evaluations. Fails if the surrogate optimizer does not reach the
+target gain after fewer evaluations than the matched Nelder-Mead (medians over the seeds), or if the operating point
+it returns misses the target gain or bandwidth for any seed, or if it returns an added evaluation of a target that has drifted since.
+
+Usage: python benchmarks/paramp_optimizer.py [target_gain_dB] [target_bandwidth_MHz] [seeds]
+'''
+
+import contextlib
+import io
+import sys
+
+import numpy as np
+
+from qsweepy import paramp
+from qsweepy.surrogate_optimizer import surrogate_optimizer
+from qsweepy.ponyfiles.data_structures import MeasurementState, MeasurementDataset, MeasurementParameter
+from qsweepy.simulated_instruments import SimulatedLO, SimulatedDCSource, SimulatedParamp, SimulatedVNA
+
+target_f = 7.0e9
+initial = {'pump_frequency': 7.02e9, 'pump_power': -22., 'bias': 0.3e-3}
+
+
+def tune(optimizer, seed=0, evaluations=None, hint_abs_errors=None):
+    pump = SimulatedLO(initial['pump_frequency'], initial['pump_power'])
+    bias = SimulatedDCSource(initial['bias'])
+    model = SimulatedParamp(pump, bias)
+    vna = SimulatedVNA(model, seed=seed)
+
+    gains = []  # gain at the target frequency at every VNA measurement
+    measure = vna.measure
+
+    def measure_and_record():
+        gains.append(10*np.log10(model.gain(target_f)))
+        return measure()
+    vna.measure = measure_and_record
+
+    amplifier = paramp.paramp(vna, pump, bias)
+    amplifier.target_f = target_f
+    amplifier.target_bw = 1e3
+    amplifier.target_power = -30
+    amplifier.settle_time = 0
+    amplifier.optimizer = optimizer
+    amplifier.hint_maxfun = 200
+    amplifier.hint_seed = seed
+    if hint_abs_errors is not None:
+        amplifier.hint_abs_errors = hint_abs_errors
+    if evaluations:
+        amplifier.evaluations = evaluations
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = amplifier.measure()
+    return amplifier, model, result, np.asarray(gains)
+
+
+def saved_measurement(result):
+    # paramp.measure swept over the target frequency, as saved by sweep.sweep
+    target_frequency = MeasurementParameter(np.asarray([target_f]), False, 'Target frequency', 'Hz')
+    state = MeasurementState(measurement_type='paramp_calibration', sample_name='benchmark',
+                             metadata={'target_bw': '1000.0'})
+    for name, value in result.items():
+        state.datasets[name] = MeasurementDataset([target_frequency], np.asarray([value]))
+    return state
+
+
+def summary(runs, target_gain):
+    reached = [np.nonzero(gains >= target_gain)[0] for model, gains in runs]
+    return {'to target gain': np.median([r[0]+1 if len(r) else np.inf for r in reached]),
+            'evaluations': np.median([len(gains) for model, gains in runs]),
+            'gain': np.median([10*np.log10(model.gain(target_f)) for model, gains in runs]),
+            'min gain': np.min([10*np.log10(model.gain(target_f)) for model, gains in runs]),
+            'bandwidth': np.median([model.bandwidth() for model, gains in runs]),
+            'min bandwidth': np.min([model.bandwidth() for model, gains in runs])}
+
+
+def check_drifted_evaluations():
+    '''
+    The optimum of a quadratic target has drifted away from an added evaluation that is better than anything the
+    target now reaches. minimize returns a point it evaluated itself.
+    '''
+    x = [0.]
+    for max_evaluations in (0, 20):
+        optimizer = surrogate_optimizer(lambda: (x[0]-0.7)**2, (lambda value: x.__setitem__(0, value), 0.5, 0, 1),
+                                        max_evaluations=max_evaluations, seed=0)
+        optimizer.add_evaluations([[0.2]], [-1.])
+        point, value = optimizer.minimize()
+        assert value == (point[0]-0.7)**2 and x[0] == point[0], 'minimize returned a drifted added evaluation'
+    print('drifted added evaluation: minimize returns x = {:.3f}, cost {:.2e}'.format(point[0], value))
+
+
+def main(target_gain=20, target_bandwidth=3, seeds=5):
+    check_drifted_evaluations()
+    ranges = paramp.paramp(None, None, None).hint_search_ranges
+    optimizers = [('Nelder-Mead', 'nelder-mead', None),
+                  ('Nelder-Mead, matched', 'nelder-mead', tuple(r/2 for r in ranges)),
+                  ('surrogate', 'surrogate', None)]
+    results = {}
+    reused = paramp.paramp(None, None, None)
+    for name, optimizer, hint_abs_errors in optimizers:
+        runs = []
+        for seed in range(int(seeds)):
+            amplifier, model, result, gains = tune(optimizer, seed, hint_abs_errors=hint_abs_errors)
+            runs.append((model, gains))
+            if seed == 0:
+                reused.load_evaluations(saved_measurement(result))
+        results[name] = summary(runs, target_gain)
+
+    runs = []
+    for seed in range(int(seeds)):
+        evaluations = {f: list(points) for f, points in reused.evaluations.items()}
+        amplifier, model, result, gains = tune('surrogate', seeds+seed, evaluations=evaluations)
+        runs.append((model, gains))
+    results['surrogate, reused'] = summary(runs, target_gain)
+
+    print('medians over {} seeds'.format(int(seeds)))
+    for name, result in results.items():
+        print('{:22s} {:6} evaluations to {} dB, {:6} in total, gain {:5.1f} dB (min {:5.1f} dB), '
+              'bandwidth {:5.1f} MHz (min {:5.1f} MHz)'.format(name, result['to target gain'], target_gain,
+                                                               result['evaluations'], result['gain'], result['min gain'],
+                                                               result['bandwidth']/1e6, result['min bandwidth']/1e6))
+    assert results['surrogate']['to target gain'] < results['Nelder-Mead, matched']['to target gain']
+    for name in ['surrogate', 'surrogate, reused']:
+        assert results[name]['min gain'] >= target_gain and results[name]['min bandwidth'] >= target_bandwidth*1e6
+    return results
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:3]], *[int(a) for a in sys.argv[3:]])
@@ -0,0 +1,90 @@
+'''
+Latency of the plotly viewer callbacks on a large synthetic measurement.
+
+Creates a 4096x4096 heatmap and a 2**20-point trace in a temporary exdir directory with an sqlite database,
+and times plotly_plot.plot for
+    - the first callback (measurement loaded into measurement_pool, decimated views computed),
+    - repeated callbacks (views served from the pool),
+    - a callback after the measurement file was modified (reload),
+    - a full-resolution callback (width=None), which is what every callback cost before the pool.
+The time includes the JSON serialization of the figure.
+
+Usage: python benchmarks/plotly_plot_latency.py [size] [repeats]
+'''
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from qsweepy import plotly_plot
+from qsweepy.ponyfiles import save_exdir
+from qsweepy.ponyfiles.data_structures import MeasurementState, MeasurementDataset, MeasurementParameter
+from qsweepy.ponyfiles.database import MyDatabase
+from pony.orm import db_session
+
+
+def create_measurement(db, directory, size):
+    x = np.linspace(4e9, 8e9, size)
+    y = np.linspace(-1, 1, size)
+    t = np.linspace(0, 1e-3, size*size//16)
+    heatmap = np.cos(x[:, np.newaxis]*1e-8)*np.sin(10*y[np.newaxis, :]) + np.random.normal(size=(size, size))*0.1
+    trace = np.exp(-t/3e-4)*np.cos(t*2e5) + np.random.normal(size=t.shape)*0.01
+    state = MeasurementState(measurement_type='benchmark', filename=os.path.join(directory, 'benchmark'))
+    state.datasets['heatmap'] = MeasurementDataset(parameters=[MeasurementParameter(x, None, 'Frequency', 'Hz'),
+                                                               MeasurementParameter(y, None, 'Voltage', 'V')],
+                                                   data=heatmap)
+    state.datasets['trace'] = MeasurementDataset(parameters=[MeasurementParameter(t, None, 'Time', 's')], data=trace)
+    save_exdir.save_exdir(state)
+    with db_session:
+        db.create_in_database(state)
+    return state
+
+
+def timed(function, repeats):
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main(size=4096, repeats=5):
+    directory = tempfile.mkdtemp()
+    db = MyDatabase(provider='sqlite', database=':memory:')
+    state = create_measurement(db, directory, size)
+
+    traces = pd.DataFrame([{'id': state.id, 'dataset': 'heatmap', 'op': '', 'style': '2d', 'color': 'salmon',
+                            'x-axis': 'Frequency', 'y-axis': 'Voltage', 'row': 0, 'col': 0},
+                           {'id': state.id, 'dataset': 'trace', 'op': '', 'style': '-', 'color': 'salmon',
+                            'x-axis': 'Time', 'y-axis': 'data', 'row': 0, 'col': 1}])
+    # a dash callback also serializes the figure for the browser
+    plot = lambda width=1200, height=900: json.dumps(plotly_plot.plot(traces, [], db, width=width, height=height),
+                                                     cls=plotly.utils.PlotlyJSONEncoder)
+
+    results = {}
+    plotly_plot.measurement_pool.close()
+    results['first callback'] = timed(plot, 1)
+    results['repeated callback'] = timed(plot, repeats)
+    def modified():
+        os.utime(os.path.join(state.filename+'.exdir', 'heatmap', 'data', 'data.npy'),
+                 ns=(time.time_ns(), time.time_ns()+int(1e9)))
+        plot()
+    results['callback after modification'] = timed(modified, repeats)
+    results['full resolution callback'] = timed(lambda: plot(None, None), 1)
+
+    plotly_plot.measurement_pool.close()
+    print('{}x{} heatmap + {}-point trace'.format(size, size, size*size//16))
+    for name, latency in results.items():
+        print('{:30s} {:8.3f} s'.format(name, latency))
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,257 @@
+'''
+Throughput of the pulsed measurement workflows against the simulated instruments of
+tunable_coupling_transmons/simulated_setup.py (no lab required).
+
+Sets up a qubit_device with a temporary SQLite database and data directory, calibrates the modem readout (trigger
+delay, DC background and DC calibrations) and runs Rabi, Ramsey and randomized benchmarking (mean of 4 random
+sequences per length) sweeps with Sweeper.sweep_fit_dataset_1d_onfly. For each workflow reports measured points per
+second, bytes written to the data directory, database queries per measurement and waveform uploads to the AWG
+(unchanged waveforms are not uploaded again, see SimulatedAWG).
+
+The fits are checked against the simulated qubit: the Rabi frequency against rabi_rate times the amplitude of the
+excitation envelope at the mixer output, the Ramsey frequency against a 2 MHz detuning of the qubit from the
+excitation carrier, and the randomized benchmarking decay against the decay of Cliffords limited by T1 and T2. The
+simulated instruments and the global numpy generator (used by the delay calibration, the mixer calibration and the
+benchmarking sequences) are seeded, so that a run is reproducible.
+
+Usage: python benchmarks/pulsed_measurements.py [points] [nums] [seed]
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pony.orm import db_session
+
+from qsweepy import clifford, data_reduce, interleaved_benchmarking, qubit_device
+from qsweepy.fitters import exp
+from qsweepy.fitters.exp_sin import exp_sin_fitter
+from qsweepy.ponyfiles.database import MyDatabase
+from qsweepy.ponyfiles.exdir_db import Exdir_db
+from qsweepy.pulses import vz
+from qsweepy.sweep_extras import Sweeper
+from qsweepy.tunable_coupling_transmons import simulated_setup
+
+qubit_id = '1'
+ex_channel = 'iq_ex1_q1'
+ro_channel = 'iq_ro_q1'
+ramsey_detuning = 2e6
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(directory) for name in files)
+
+
+def query_count(db):
+    return sum(stat.db_count for stat in db.db.local_stats.values())
+
+
+def setup(directory, nums, seed):
+    db = MyDatabase(provider='sqlite', database=os.path.join(directory, 'benchmark.sqlite'))
+    exdir_db = Exdir_db(db, sample_name='simulated')
+    sweeper = Sweeper(db, sample_name='simulated')
+    # no image export of the default plots, it needs kaleido and is not part of the measurement
+    sweeper.on_finish = sweeper.on_finish[:-1]
+    sweeper.on_finish_fit = sweeper.on_finish_fit[:-1]
+    device = qubit_device.qubit_device(exdir_db, sweeper)
+
+    pulsed_settings = dict(simulated_setup.pulsed_settings, adc_nums=nums)
+    device_settings = dict(simulated_setup.device_settings, seed=seed)
+    # shorter coherence than the default sample, so that the benchmarking sequences decay within their lengths
+    sample_settings = dict(simulated_setup.sample_settings, T1=2.5e-6, T2=2e-6)
+    hardware = simulated_setup.hardware_setup(device_settings, pulsed_settings, sample_settings)
+    hardware.open_devices()
+    hardware.set_pulsed_mode()
+    hardware.setup_iq_channel_connections(exdir_db)
+
+    with db_session:
+        device.set_frequency_controls(qubit_id, [])
+        device.set_qubits_from_dict({qubit_id: {
+            'r': {'Fr': hardware.qubit.resonator_frequency, 'iq_devices': {ro_channel: 'iq_ro'}},
+            'q': {'F': {'F01_min': hardware.qubit.frequency},
+                  'iq_devices': {ex_channel: 'iq_ex1'},
+                  'iq_devices_transitions': {ex_channel: '01'}}}})
+        device.set_two_qubit_gates_from_dict({})
+        device.set_sample_globals({'delay_calibration_nums': nums,
+                                   'delay_calibration_nop': pulsed_settings['adc_nop'],
+                                   'delay_calibration_sequence_length': 1000})
+        device.create_pulsed_interfaces(hardware.iq_devices, hardware.fast_controls,
+                                        extra_channels={'ro_trg': hardware.ro_trg})
+        device.setup_modem_readout(hardware)
+        hardware.adc.set_nums(nums)
+    return db, device, hardware
+
+
+def measurer(device):
+    '''
+    Mean over the shots of the demodulated and DC-calibrated readout signal.
+    '''
+    shots = data_reduce.data_reduce(device.modem.adc)
+    shots.filters['iq'] = device.modem.calibrated_filters[ro_channel]
+    mean = data_reduce.data_reduce(shots)
+    mean.filters['iq'+qubit_id] = data_reduce.mean_reducer(shots, 'iq', 0)
+    return mean
+
+
+def readout_sequence(device, hardware):
+    readout_pulse = device.pg.pmulti(1e-6, (ro_channel, device.pg.rect, 0.5))
+    return device.trigger_readout_seq + [readout_pulse]
+
+
+def excitation(device, length, phase=0.):
+    return [device.pg.pmulti(length, (ex_channel, device.pg.rect, 0.5*np.exp(1j*phase)))]
+
+
+def rabi(device, hardware, points):
+    ro_seq = readout_sequence(device, hardware)
+    lengths = np.linspace(0, 200e-9, points)
+    return device.sweeper.sweep_fit_dataset_1d_onfly(
+        measurer(device),
+        (lengths, lambda length: device.pg.set_seq(excitation(device, length)+ro_seq), 'Excitation length', 's'),
+        fitter_arguments=('iq'+qubit_id, exp_sin_fitter(), -1, []),
+        measurement_type='Rabi_rect', metadata={'qubit_id': qubit_id})
+
+
+def ramsey(device, hardware, points, pi2_length):
+    ro_seq = readout_sequence(device, hardware)
+    delays = np.linspace(0, 2e-6, points)
+
+    def set_delay(delay):
+        device.pg.set_seq(excitation(device, pi2_length)+[device.pg.pmulti(delay)]+excitation(device, pi2_length)+ro_seq)
+
+    # the fringes are at the detuning of the qubit from the excitation carrier
+    hardware.qubit.frequency -= ramsey_detuning
+    try:
+        return device.sweeper.sweep_fit_dataset_1d_onfly(
+            measurer(device), (delays, set_delay, 'Delay', 's'),
+            fitter_arguments=('iq'+qubit_id, exp_sin_fitter(), -1, []),
+            measurement_type='Ramsey', metadata={'qubit_id': qubit_id})
+    finally:
+        hardware.qubit.frequency += ramsey_detuning
+
+
+class sequence_mean:
+    '''
+    Measurer of the mean over the random sequences of an interleaved_benchmarking (which measures only the first).
+    '''
+    def __init__(self, bench):
+        self.bench = bench
+
+    def get_points(self):
+        return self.bench.get_points()
+
+    def get_dtype(self):
+        return self.bench.get_dtype()
+
+    def get_opts(self):
+        return self.bench.get_opts()
+
+    def measure(self):
+        measurements = []
+        for seq_id in range(len(self.bench.interleaving_sequences)):
+            self.bench.set_interleaved_sequence(seq_id)
+            measurements.append(self.bench.measurer.measure())
+        return {name: np.mean([m[name] for m in measurements], axis=0) for name in measurements[0]}
+
+
+def randomized_benchmarking(device, hardware, points, pi2_length, sequences=4):
+    ro_seq = readout_sequence(device, hardware)
+
+    def z(phase):
+        # vz shifts the phase of the following pulses, which rotates the qubit about z by -phase
+        return [device.pg.pmulti(0, (ex_channel, vz, -phase))]
+
+    # H = Z/2 X/2 Z/2 up to a global phase
+    generators = {'H': {'pulses': z(np.pi/2)+excitation(device, pi2_length)+z(np.pi/2),
+                        'unitary': np.sqrt(0.5)*np.asarray([[1, 1], [1, -1]]), 'price': 1.0},
+                  'Z': {'pulses': z(np.pi), 'unitary': np.asarray([[1, 0], [0, -1]]), 'price': 0.1},
+                  'Z/2': {'pulses': z(np.pi/2), 'unitary': np.asarray([[1, 0], [0, 1j]]), 'price': 0.1},
+                  '-Z/2': {'pulses': z(-np.pi/2), 'unitary': np.asarray([[1, 0], [0, -1j]]), 'price': 0.1},
+                  'I': {'pulses': [], 'unitary': np.identity(2), 'price': 0.1}}
+    group = clifford.generate_group(generators)
+    # the pulses of each Clifford are its generators, of which only H takes time
+    clifford_durations = [pi2_length*name.split().count('H') for name in group]
+    bench = interleaved_benchmarking.interleaved_benchmarking(measurer(device),
+                                                              set_seq=lambda seq: device.pg.set_seq(seq+ro_seq),
+                                                              interleavers=group, random_sequence_num=sequences)
+    bench.prepare_random_interleaving_sequences()
+    seq_lengths = np.asarray(np.round(np.linspace(0, 80, points)), int)
+    measurement = device.sweeper.sweep_fit_dataset_1d_onfly(
+        sequence_mean(bench), (seq_lengths, bench.set_sequence_length_and_regenerate, 'Gate number', ''),
+        fitter_arguments=('iq'+qubit_id, exp.exp_fitter(), 0, []),
+        measurement_type='clifford_bench', metadata={'qubit_id': qubit_id})
+    return measurement, clifford_durations
+
+
+def run(name, workflow, db, hardware, points, directory):
+    size, queries = directory_size(directory), query_count(db)
+    uploads, uploaded = hardware.awg.upload_count, hardware.awg.bytes_uploaded
+    skipped = hardware.awg.skipped_upload_count
+    start = time.perf_counter()
+    with db_session:
+        measurement = workflow()
+    elapsed = time.perf_counter() - start
+    result = {'points/s': points/elapsed,
+              'bytes written': directory_size(directory) - size,
+              'queries': query_count(db) - queries,
+              'uploads': hardware.awg.upload_count - uploads,
+              'skipped uploads': hardware.awg.skipped_upload_count - skipped,
+              'bytes uploaded': hardware.awg.bytes_uploaded - uploaded}
+    print('{:8s} {:8.1f} points/s {:10d} bytes written {:6d} DB queries {:6d} uploads ({:d} unchanged skipped) '
+          '{:12d} bytes uploaded'.format(name, *result.values()))
+    return measurement, result
+
+
+def excitation_amplitude(device, hardware):
+    '''
+    Amplitude of the excitation envelope at the output of the simulated mixer during an excitation pulse.
+    '''
+    device.pg.set_seq(excitation(device, 100e-9))
+    envelope = np.abs(hardware.ex_mixer.envelope())
+    return np.median(envelope[envelope > np.max(envelope)/2])
+
+
+def clifford_decay(durations, T1, T2):
+    '''
+    Decay constant (in Cliffords) of the randomized benchmarking sequences, for Cliffords of the given durations
+    limited by T1 and T2: the depolarizing parameter of a Clifford of duration t is exp(-t/T1)/3 + 2*exp(-t/T2)/3.
+    '''
+    durations = np.asarray(durations)
+    p = np.mean(np.exp(-durations/T1)/3 + 2*np.exp(-durations/T2)/3)
+    return -1/np.log(p)
+
+
+def main(points=21, nums=1000, seed=0):
+    np.random.seed(seed)
+    directory = tempfile.mkdtemp()
+    os.environ['QTLAB_PATH'] = directory
+    db, device, hardware = setup(directory, nums, seed)
+    qubit = hardware.qubit
+    results = {}
+
+    measurement, results['Rabi'] = run('Rabi', lambda: rabi(device, hardware, points), db, hardware, points, directory)
+    rabi_frequency = float(measurement.fit.metadata['f'])
+    expected = qubit.rabi_rate*excitation_amplitude(device, hardware)
+    print('Rabi frequency {:.3f} MHz, simulated {:.3f} MHz'.format(rabi_frequency/1e6, expected/1e6))
+    assert abs(rabi_frequency/expected - 1) < 0.03
+    pi2_length = 0.25/rabi_frequency
+
+    measurement, results['Ramsey'] = run('Ramsey', lambda: ramsey(device, hardware, points, pi2_length), db, hardware,
+                                         points, directory)
+    ramsey_frequency = float(measurement.fit.metadata['f'])
+    print('Ramsey frequency {:.3f} MHz, simulated {:.3f} MHz'.format(ramsey_frequency/1e6, ramsey_detuning/1e6))
+    assert abs(ramsey_frequency/ramsey_detuning - 1) < 0.03
+
+    (measurement, clifford_durations), results['RB'] = run(
+        'RB', lambda: randomized_benchmarking(device, hardware, points, pi2_length), db, hardware, points, directory)
+    decay = float(measurement.fit.metadata['decay'])
+    expected = clifford_decay(clifford_durations, qubit.T1, qubit.T2)
+    print('RB decay {:.1f} Cliffords, T1 and T2 limit {:.1f} Cliffords'.format(decay, expected))
+    assert abs(decay/expected - 1) < 0.3
+    return results
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,119 @@
+'''
+Operation complete waits and reconnection of the VISA drivers (async_visa, trigger_and_wait, nndac.connect).
+
+Opens the drivers on SimulatedVisaResources instead of VISA resources. A simulated sweep takes the sweep time times
+the number of averages (if averaging is on) to complete, longer than the VISA timeout. Fails if trigger_and_wait of
+the VNA drivers (or the operation complete timeout of Agilent_N9030A) does not wait for all averages, or if the VISA
+timeout of the resource is not restored afterwards.
+
+Breaks the connection of an nndac and checks that the set retried after the reconnection reaches the DAC, that the
+old connection and its I/O thread are closed and that the new connection has the termination and timeout settings.
+
+Usage: python benchmarks/visa_operation_complete.py [sweep_time] [averages]
+'''
+
+import sys
+import time
+
+from qsweepy import async_visa
+from qsweepy.simulated_instruments import SimulatedVisaResource
+from qsweepy.instrument_drivers.Agilent_N5242A import Agilent_N5242A
+from qsweepy.instrument_drivers.Agilent5071C import AgilentE5071C
+from qsweepy.instrument_drivers.RS_ZNB20 import RS_ZNB20
+from qsweepy.instrument_drivers.Agilent_N9030A import Agilent_N9030A
+from qsweepy.instrument_drivers.nndac import nndac
+
+
+class simulated_analyzer:
+    '''
+    SCPI handler of a network or spectrum analyzer with a sweep time in s and averaging.
+    '''
+    def __init__(self, sweep_time, averages, average=True):
+        self.sweep_time = sweep_time
+        self.averages = averages
+        self.average = average
+
+    def operation_time(self):
+        return self.sweep_time*(self.averages if self.average else 1)
+
+    def __call__(self, command):
+        if command.endswith('SWE:TIME?'):
+            return self.sweep_time
+        if command.endswith('AVER:STAT?'):
+            return int(self.average)
+        if command.endswith('AVER:COUN?'):
+            return self.averages
+        if command.endswith('?'):
+            return 0
+
+
+class simulated_dac:
+    '''
+    SCPI handler of an nndac.
+    '''
+    def __init__(self, channels=24):
+        self.voltages = [0.]*channels
+
+    def __call__(self, command):
+        channel, _, value = command[len('VOLT '):].partition(',')
+        if channel.endswith('?'):
+            return self.voltages[int(channel[:-1])]
+        self.voltages[int(channel)] = float(value)
+        return 'OK'
+
+
+def open_simulated(handler, resources):
+    def open_resource(address, **kwargs):
+        resources.append(SimulatedVisaResource(handler))
+        return async_visa.AsyncVisaResource(resources[-1])
+    return open_resource
+
+
+def main(sweep_time=0.02, averages=10):
+    open_resource = async_visa.open_resource
+    try:
+        for driver in (Agilent_N5242A, AgilentE5071C, RS_ZNB20, Agilent_N9030A):
+            for average in (False, True):
+                analyzer, resources = simulated_analyzer(sweep_time, averages, average), []
+                async_visa.open_resource = open_simulated(analyzer, resources)
+                instrument = driver('analyzer', 'SIM')
+                resource = resources[0]
+                # the VISA timeout is shorter than the sweep with all averages
+                resource.timeout = 0.5*analyzer.operation_time()*1e3
+                resource.operation_time = analyzer.operation_time()
+                timeout = instrument.operation_complete_timeout()
+                assert timeout >= analyzer.operation_time(), '{}: timeout {} s shorter than the sweep'.format(
+                    driver.__name__, timeout)
+                if hasattr(instrument, 'trigger_and_wait'):
+                    start = time.time()
+                    instrument.trigger_and_wait()
+                    assert time.time()-start >= analyzer.operation_time()
+                    assert resource.commands[-1] == '*OPC?'
+                assert resource.timeout == 0.5*analyzer.operation_time()*1e3, 'VISA timeout not restored'
+                print('{:15s} averaging {:d}: sweep {:.2f} s, operation complete timeout {:.2f} s'.format(
+                    driver.__name__, average, analyzer.operation_time(), timeout))
+            resource.timeout = None
+            assert instrument.operation_complete_timeout() is None
+
+        dac, resources = simulated_dac(), []
+        async_visa.open_resource = open_simulated(dac, resources)
+        instrument = nndac('SIM')
+        connection = instrument._visainstrument
+        resources[0].fail = 1
+        instrument.set_voltage(1.5, channel=3)
+        assert len(resources) == 2 and dac.voltages[3] == 1.5 and instrument.get_voltage(3) == 1.5
+        assert resources[0].closed, 'the broken connection was not closed'
+        try:
+            connection.submit(lambda: None)
+            assert False, 'the I/O thread of the broken connection was not shut down'
+        except RuntimeError:
+            pass
+        assert (resources[1].write_termination, resources[1].read_termination, resources[1].timeout) == \
+            ('\n', '\n', 10000), 'the settings of the connection were lost on reconnection'
+        print('nndac: reconnected after a broken connection, old connection closed, settings kept')
+    finally:
+        async_visa.open_resource = open_resource
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:2]], *[int(a) for a in sys.argv[2:]])
@@ -0,0 +1,138 @@
+'''
+Interpolated mixer calibrations.
+
+A CalibrationSurface loads all saved calibrations of one mixer with a single database query (no measurement files
+are read) and fits a smooth model of a calibration value (e.g. the complex Q amplitude of the sideband calibration)
+over the calibration coordinates (e.g. LO and intermediate frequency). The model is a Gaussian process regression
+with a squared exponential kernel: predictions at new frequencies take a few microseconds and come with an error
+estimate, which is small close to calibrated points and grows to the spread of the calibrated values far from them:
+
+    surface = CalibrationSurface(exdir_db, 'iq_rf_calibration', {'cname': 'iq_ex'}, ('lo_freq', 'if'), 'Q',
+                                 length_scales=(100e6, 50e6))
+    Q, error = surface.predict(6e9, -100e6)
+    if error > tolerance:
+        ...  # calibrate with the spectrum analyzer and surface.add((6e9, -100e6), Q)
+
+Calibrated points are returned exactly, with zero error. An interpolated value has no database record of its own;
+nearest returns the id of the closest saved calibration, e.g. to reference it from measurements that use the
+interpolated value. A surface is stale after a calibration has been invalidated (Exdir_db.invalidate) and has to be
+loaded again.
+'''
+
+import numpy as np
+
+
+class CalibrationSurface:
+    def __init__(self, exdir_db, measurement_type, metadata, coordinates, value, length_scales, noise=1e-3,
+                 amplitude=0.1):
+        '''
+        :param exdir_db: Exdir_db of the calibrations
+        :param measurement_type: measurement type of the calibrations, e.g. 'iq_rf_calibration'
+        :param metadata: metadata that selects the calibrations of the mixer, e.g. {'cname': 'iq_ex'}
+        :param coordinates: metadata names of the coordinates, e.g. ('lo_freq', 'if')
+        :param value: metadata name of the (real or complex) calibration value, e.g. 'Q'
+        :param length_scales: scales of the coordinates over which the calibration value changes
+        :param noise: reproducibility of the calibration value
+        :param amplitude: expected spread of the calibration values, used if there are less than three calibrations
+        '''
+        self.exdir_db = exdir_db
+        self.measurement_type = measurement_type
+        self.metadata = metadata
+        self.coordinates = tuple(coordinates)
+        self.value = value
+        self.length_scales = np.asarray(length_scales, dtype=float)
+        self.noise = noise
+        self.amplitude = amplitude
+        self.points = {}
+        self.ids = {}
+        self.invalidations = None
+        self.model = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def load(self):
+        '''
+        Loads all calibrations from the database. Later calibrations of the same coordinates replace earlier ones.
+        '''
+        self.points = {}
+        self.ids = {}
+        self.invalidations = getattr(self.exdir_db, 'invalidations', 0)
+        for data_id, metadata in self.exdir_db.select_measurements_metadata(self.measurement_type,
+                                                                            metadata=self.metadata):
+            try:
+                coordinates = tuple(float(metadata[c]) for c in self.coordinates)
+                value = complex(metadata[self.value])
+            except (KeyError, ValueError):
+                continue
+            self.points[coordinates] = value
+            self.ids[coordinates] = data_id
+        self.model = None
+        return self
+
+    def stale(self):
+        '''
+        True if a measurement has been invalidated in the database since the calibrations were loaded.
+        '''
+        return self.invalidations != getattr(self.exdir_db, 'invalidations', 0)
+
+    def add(self, coordinates, value, data_id=None):
+        '''
+        Adds a new calibration (e.g. just measured and saved with the id data_id) to the model.
+        '''
+        coordinates = tuple(float(c) for c in coordinates)
+        self.points[coordinates] = complex(value)
+        self.ids[coordinates] = data_id
+        self.model = None
+
+    def nearest(self, *coordinates):
+        '''
+        Returns the id of the saved calibration closest to the coordinates (in units of the length scales), or None
+        if there are no calibrations.
+        '''
+        saved = [c for c in self.points.keys() if self.ids.get(c) is not None]
+        if not len(saved):
+            return None
+        distances = np.sum(((np.asarray(saved)-np.asarray(coordinates, dtype=float))/self.length_scales)**2, axis=1)
+        return self.ids[saved[int(np.argmin(distances))]]
+
+    def fit(self):
+        X = np.asarray(list(self.points.keys()), dtype=float).reshape(-1, len(self.coordinates))/self.length_scales
+        y = np.asarray(list(self.points.values()), dtype=complex)
+        mean = np.mean(y) if len(y) else 0
+        if len(y) >= 3:
+            amplitude = max(np.sqrt(np.mean(np.abs(y-mean)**2)), self.noise)
+        else:
+            amplitude = self.amplitude
+        K = self._kernel(X, X) + (self.noise/amplitude)**2*np.identity(len(y))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y-mean))
+        self.model = {'X': X, 'L': L, 'alpha': alpha, 'mean': mean, 'amplitude': amplitude,
+                      'real': not np.any(np.imag(y))}
+        return self.model
+
+    def predict(self, *coordinates):
+        '''
+        Returns the calibration value at the coordinates and its error estimate. Without any calibrations, the
+        value is None and the error is infinite.
+        '''
+        key = tuple(float(c) for c in coordinates)
+        if key in self.points:
+            return self.points[key], 0.
+        if not len(self.points):
+            return None, np.inf
+        if self.model is None:
+            self.fit()
+        x = np.asarray(key)[np.newaxis, :]/self.length_scales
+        k = self._kernel(self.model['X'], x)[:, 0]
+        value = self.model['mean'] + np.dot(k, self.model['alpha'])
+        v = np.linalg.solve(self.model['L'], k)
+        error = self.model['amplitude']*np.sqrt(max(1 - np.dot(v, v), 0)) + self.noise
+        if self.model['real']:
+            value = np.real(value)
+        return value, error
+
+    @staticmethod
+    def _kernel(X1, X2):
+        distances = np.sum((X1[:, np.newaxis, :]-X2[np.newaxis, :, :])**2, axis=2)
+        return np.exp(-distances/2)
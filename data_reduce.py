@@ -5,6 +5,17 @@ import numpy as np
 import logging
 import threading
 
+def supports_segmented(measurer):
+	'''
+	Whether measurer.measure_segmented can acquire segments with its current settings. Measurers that
+	support it only in some modes (e.g. TSW14J56_evm_reducer) implement supports_segmented().
+	'''
+	if not hasattr(measurer, 'measure_segmented'):
+		return False
+	if hasattr(measurer, 'supports_segmented'):
+		return measurer.supports_segmented()
+	return True
+
 class data_reduce:
 	def __init__(self, source, thread_limit=1):
 		self.source = source
@@ -31,6 +42,19 @@ class data_reduce:
 		result = { filter_name:filter['filter'](data) for filter_name, filter in self.filters.items()}
 		del data
 		return result
+
+	def supports_segmented(self):
+		return supports_segmented(self.source)
+
+	def measure_segmented(self, num_segments):
+		'''
+		Acquire num_segments interleaved segments (see pulses.set_seq_segmented) in a single source acquisition
+		and apply the filters to each of them separately.
+		'''
+		if not hasattr(self.source, 'measure_segmented'):
+			raise ValueError('Source does not support segmented acquisition')
+		return [{ filter_name:filter['filter'](data) for filter_name, filter in self.filters.items()}
+					for data in self.source.measure_segmented(num_segments)]
 		
 	def postprocess_thread_func(self, data, callback, args):
 		#print ('Spawned deferred postprocessing thread with args: ', args)
@@ -72,6 +96,8 @@ class data_reduce:
 		t.start()
 	
 	def join_deferred(self):
+		if hasattr(self.source, 'join_deferred'):
+			self.source.join_deferred()
 		for t in self.threads:
 			t.join()
 		
@@ -29,10 +29,15 @@ class DummyAWG:
 		return self.clock
 	def set_nop(self, nop):
 		self.nop = nop
+		self.waveform = np.zeros((self.channel, self.nop))
 	def set_clock(self, clock):
 		self.clock = clock
-	def set_status(self, status):
+	def set_status(self, status, channel=None):
 		self.status = status
+	def run(self):
+		self.status = 1
+	def stop(self):
+		self.status = 0
 	def get_waveform(self, channel):
 		return self.waveform[channel, :]
 	#	#if not hasattr(self, 'waveform'):
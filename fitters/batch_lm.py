@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def levenberg_marquardt(model_jacobian, p0, y, weights, max_iterations=200, tolerance=1e-8, initial_damping=1e2):
+    '''
+    Stacked Levenberg-Marquardt least-squares fit of many independent problems that share the model shape.
+    All problems are iterated at once; a problem drops out of the iteration as soon as it has converged.
+
+    :param model_jacobian: function of parameters of shape (problems, parameters) that returns the model and
+        its analytic jacobian, of shapes (problems, ...) and (problems, ..., parameters)
+    :param p0: initial parameters, shape (problems, parameters)
+    :param y: data, same shape as the model. Non-finite values must have zero weight.
+    :param weights: weights of the data points, same shape as y (0 excludes a point)
+    :param int max_iterations: maximum number of jacobian evaluations per problem
+    :param float tolerance: relative step size at which the problem is considered converged
+    :param float initial_damping: initial damping relative to the diagonal of the normal equations; a large value
+        makes the first steps gradient-descent-like, which is safer for oscillating models with FFT initial guesses
+    :returns: fitted parameters of shape (problems, parameters), residual sum of squares of shape (problems,)
+    '''
+    p = np.array(p0, dtype=float)
+    num_problems, num_parameters = p.shape
+    y = np.reshape(np.where(weights > 0, y, 0), (num_problems, -1))
+    weights = np.reshape(weights, (num_problems, -1))
+
+    def evaluate(p, problems):
+        model, jacobian = model_jacobian(p)
+        residuals = (np.reshape(model, (len(problems), -1)) - y[problems])*weights[problems]
+        jacobian = np.reshape(jacobian, (len(problems), -1, num_parameters))*weights[problems][:, :, np.newaxis]
+        cost = np.sum(residuals**2, axis=1)
+        cost[np.logical_not(np.isfinite(cost))] = np.inf
+        return residuals, jacobian, cost
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore', under='ignore'):
+        problems = np.arange(num_problems)
+        residuals, jacobian, cost = evaluate(p, problems)
+        damping = np.full(num_problems, float(initial_damping))
+        active = np.logical_and(np.isfinite(cost), np.all(np.isfinite(p), axis=1))
+
+        for iteration in range(max_iterations):
+            problems = np.nonzero(active)[0]
+            if not len(problems):
+                break
+            J = jacobian[problems]
+            JtJ = np.einsum('bmp,bmq->bpq', J, J)
+            gradient = np.einsum('bmp,bm->bp', J, residuals[problems])
+            # Marquardt scaling of the damping term, with a floor for parameters the model does not depend on
+            scale = np.diagonal(JtJ, axis1=1, axis2=2).copy()
+            scale = np.maximum(scale, 1e-12*np.max(scale, axis=1, keepdims=True)+1e-300)
+            system = JtJ + (damping[problems][:, np.newaxis]*scale)[:, :, np.newaxis]*np.identity(num_parameters)
+            try:
+                step = -np.linalg.solve(system, gradient[:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('bpq,bq->bp', np.linalg.pinv(system), gradient)
+
+            p_trial = p[problems] + step
+            residuals_trial, jacobian_trial, cost_trial = evaluate(p_trial, problems)
+            accepted = cost_trial < cost[problems]
+
+            accepted_problems = problems[accepted]
+            converged = np.logical_and(accepted, np.sqrt(np.sum(step**2, axis=1)) <= tolerance*(np.sqrt(np.sum(p[problems]**2, axis=1))+tolerance))
+            p[accepted_problems] = p_trial[accepted]
+            residuals[accepted_problems] = residuals_trial[accepted]
+            jacobian[accepted_problems] = jacobian_trial[accepted]
+            cost[accepted_problems] = cost_trial[accepted]
+
+            damping[problems] = np.where(accepted, damping[problems]*0.3, damping[problems]*10.)
+            converged = np.logical_or(converged, damping[problems] > 1e10)
+            active[problems[converged]] = False
+
+    return p, cost
+
+
+def stack_parameters_old(parameters_old, parameters_flat, num_parameters):
+    '''
+    Converts a list of per-trace parameters_old dicts into an array of shape (traces, parameters).
+    Traces without usable old parameters (None, empty or of the wrong size) are marked in the returned mask.
+
+    :returns: mask of traces with old parameters, array of old parameters (NaN where there are none)
+    '''
+    has_old = np.zeros(len(parameters_old), dtype=bool)
+    p_old = np.full((len(parameters_old), num_parameters), np.nan)
+    for trace, parameters in enumerate(parameters_old):
+        if not parameters:
+            continue
+        try:
+            p_flat = np.asarray(parameters_flat(parameters), dtype=float)
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if p_flat.shape == (num_parameters,):
+            has_old[trace] = True
+            p_old[trace] = p_flat
+    return has_old, p_old
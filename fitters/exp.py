@@ -1,5 +1,6 @@
 import numpy as np
 from . import fit_dataset
+from .batch_lm import levenberg_marquardt, stack_parameters_old
 import traceback
 
 
@@ -10,6 +11,9 @@ class exp_fitter:
     def fit(self, x, y, parameters_old=None):
         return exp_fit(x, y)
 
+    def fit_batch(self, x, y, parameters_old=None, parameters_init=None, max_iterations=200):
+        return exp_fit_batch(x, y, parameters_init, max_iterations)
+
 
 def exp_fit(x, y):
     def model(x, p):
@@ -46,3 +50,90 @@ def exp_fit(x, y):
 
     parameters = {'decay': fitresults[0], 'A': fitresults[1:-y.shape[0]], 'MSE_rel': MSE_rel}
     return fit_dataset.resample_x_fit(x), fitted_curve, parameters
+
+
+def exp_model_jacobian(x, p, num_rows):
+    '''
+    exp model and its jacobian for a stack of parameter vectors p of shape (traces, 1+2*rows),
+    with the parameter order of exp_fit.
+    '''
+    x0 = p[:, 0, np.newaxis, np.newaxis]
+    A = p[:, 1:1+num_rows, np.newaxis]
+    B = p[:, 1+num_rows:, np.newaxis]
+    decay = np.exp(-x/x0)*np.ones(A.shape)
+    model = A*decay+B
+
+    jacobian = np.zeros(model.shape+(p.shape[1],))
+    jacobian[..., 0] = A*decay*x/x0**2
+    for row in range(num_rows):
+        jacobian[:, row, :, 1+row] = decay[:, row]
+        jacobian[:, row, :, 1+num_rows+row] = 1
+    return model, jacobian
+
+
+def exp_fit_batch(x, y, parameters_init=None, max_iterations=200):
+    '''
+    Vectorized exp_fit for a stack of independent traces of shape (traces, rows, len(x)).
+
+    :param parameters_init: list of per-trace parameter dicts (or None) with the 'decay' and 'A' of a previous fit,
+        used as initial guess; the offsets are re-estimated from the data
+    :param int max_iterations: maximum number of Levenberg-Marquardt iterations
+
+    :returns: x_fit, fitted curves of shape (traces, rows, len(x_fit)), list of per-trace parameter dicts
+    '''
+    x = np.asarray(x).ravel()
+    y = np.asarray(y)
+    num_traces, num_rows, num_points = y.shape
+    x_fit = fit_dataset.resample_x_fit(x)
+
+    # like exp_fit, all points that are finite in every row are used
+    finite = np.all(np.isfinite(y), axis=1)
+    weights = finite[:, np.newaxis, :]*np.ones(y.shape)
+    y_zeronans = np.where(weights > 0, y, 0)
+    num_finite = np.sum(finite, axis=1)
+    fitted = num_finite > 0
+
+    x_scale = np.max(np.abs(x)) if np.max(np.abs(x)) > 0 else 1.
+    x_scaled = x/x_scale
+
+    p0 = np.full((num_traces, 1+2*num_rows), np.nan)
+    if np.any(fitted):
+        x_finite = np.where(finite, x_scaled, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            integral = np.sum(y_zeronans[fitted], axis=2)*((np.nanmin(x_finite[fitted], axis=1)-np.nanmax(x_finite[fitted], axis=1))/num_finite[fitted])[:, np.newaxis]
+        first = np.argmax(finite[fitted], axis=1)
+        last = num_points-1-np.argmax(finite[fitted, ::-1], axis=1)
+        y_first = np.take_along_axis(y_zeronans[fitted], first[:, np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        y_last = np.take_along_axis(y_zeronans[fitted], last[:, np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x0 = np.sqrt(np.sum(np.abs(integral)**2, axis=1)/np.sum(np.abs(y_first)**2, axis=1))
+        p0[fitted] = np.hstack([x0[:, np.newaxis], y_first, y_last])
+
+    # warm start from previous fit results. exp_fit does not return the offsets, so they are taken from the data
+    # as the last point minus the decaying part
+    if parameters_init is not None:
+        has_init, p_init = stack_parameters_old(parameters_init, lambda parameters:
+                            [np.ravel(parameters['decay'])[0]/x_scale] + np.ravel(parameters['A']).tolist(), 1+num_rows)
+        has_init = np.logical_and(has_init, np.all(np.isfinite(p_init), axis=1))
+        has_init = np.logical_and(has_init, np.all(np.isfinite(p0), axis=1))
+        if np.any(has_init):
+            p0[has_init, :1+num_rows] = p_init[has_init]
+            x_last = np.nanmax(np.where(finite[has_init], x_scaled, np.nan), axis=1)
+            p0[has_init, 1+num_rows:] -= p_init[has_init, 1:]*np.exp(-x_last/p_init[has_init, 0])[:, np.newaxis]
+
+    fitted = np.all(np.isfinite(p0), axis=1)
+    p = p0.copy()
+    if np.any(fitted):
+        p[fitted] = levenberg_marquardt(lambda p: exp_model_jacobian(x_scaled, p, num_rows), p0[fitted],
+                                        y_zeronans[fitted], weights[fitted], max_iterations=max_iterations)[0]
+    p[:, 0] *= x_scale
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        fitted_curves = exp_model_jacobian(x_fit, p, num_rows)[0]
+        mean = np.sum(weights*y_zeronans, axis=(1, 2))/np.sum(weights, axis=(1, 2))
+        MSE_rel = np.sum(weights*np.abs(exp_model_jacobian(x, p, num_rows)[0]-y_zeronans)**2, axis=(1, 2)) / \
+                  np.sum(weights*np.abs(y_zeronans-mean[:, np.newaxis, np.newaxis])**2, axis=(1, 2))
+
+    parameters_list = [{'decay': p[trace, 0], 'A': p[trace, 1:1+num_rows], 'MSE_rel': MSE_rel[trace]}
+                       for trace in range(num_traces)]
+    return x_fit, fitted_curves, parameters_list
@@ -1,5 +1,6 @@
 import numpy as np
 from . import fit_dataset
+from .batch_lm import levenberg_marquardt, stack_parameters_old
 import traceback
 
 class exp_sin_fitter:
@@ -8,6 +9,8 @@ class exp_sin_fitter:
         self.mode = mode
     def fit(self,x,y, parameters_old=None):
         return exp_sin_fit(x, y, parameters_old, self.mode)
+    def fit_batch(self, x, y, parameters_old=None, parameters_init=None, max_iterations=200):
+        return exp_sin_fit_batch(x, y, parameters_old, self.mode, parameters_init, max_iterations)
 
 def exp_sin_fit(x, y, parameters_old=None, mode='sync'):
     y = np.asarray(y)
@@ -99,7 +102,8 @@ def exp_sin_fit(x, y, parameters_old=None, mode='sync'):
             MSE_rel = MSE_rel_calculator(parameters_new)
             parameters = parameters_new
         else:
-            parameters_old = {k: np.asarray(v)[0] if k != 'A' else v for k,v in parameters_old.items()}
+            parameters_old = {k: np.ravel(v) if k == 'A' or (k == 'inf' and mode == 'unsync') else np.ravel(v)[0]
+                              for k,v in parameters_old.items()}
             MSE_rel_old = MSE_rel_calculator(parameters_old)
             parameters = parameters_old if MSE_rel_new > MSE_rel_old else parameters_new
             MSE_rel = MSE_rel_old if MSE_rel_new > MSE_rel_old else MSE_rel_new
@@ -146,3 +150,203 @@ def exp_sin_fit(x, y, parameters_old=None, mode='sync'):
     parameters['decay_goodness_test'] = 1 if decay_goodness_test else 0
 
     return fit_dataset.resample_x_fit(x_full), fitted_curve, parameters
+
+
+def exp_sin_model_jacobian(x, p, num_rows, mode='sync'):
+    '''
+    exp_sin model and its jacobian for a stack of parameter vectors p of shape (traces, parameters),
+    with the parameter order of exp_sin_fit. Returns arrays of shape (traces, rows, len(x)) and
+    (traces, rows, len(x), parameters).
+    '''
+    phase = p[:, 0, np.newaxis, np.newaxis]
+    freq = p[:, 1, np.newaxis, np.newaxis]
+    x0 = p[:, 2, np.newaxis, np.newaxis]
+    if mode == 'sync':
+        inf = p[:, 3, np.newaxis, np.newaxis]
+        A = p[:, 4:, np.newaxis]
+    elif mode == 'unsync':
+        inf = p[:, 3:3+num_rows, np.newaxis]
+        A = p[:, 3+num_rows:, np.newaxis]
+
+    theta = phase+x*freq*2*np.pi
+    decay = np.exp(-x/x0)
+    oscillation = -np.cos(theta)*decay
+    model = A*(oscillation+inf)
+
+    jacobian = np.zeros(model.shape+(p.shape[1],))
+    jacobian[..., 0] = A*np.sin(theta)*decay
+    jacobian[..., 1] = jacobian[..., 0]*x*2*np.pi
+    jacobian[..., 2] = A*oscillation*x/x0**2
+    for row in range(num_rows):
+        if mode == 'sync':
+            jacobian[:, row, :, 3] = A[:, row]
+            jacobian[:, row, :, 4+row] = oscillation[:, 0]+inf[:, 0]
+        elif mode == 'unsync':
+            jacobian[:, row, :, 3+row] = A[:, row]
+            jacobian[:, row, :, 3+num_rows+row] = oscillation[:, 0]+inf[:, row]
+    return model, jacobian
+
+
+def exp_sin_fit_batch(x, y, parameters_old=None, mode='sync', parameters_init=None, max_iterations=200):
+    '''
+    Vectorized exp_sin_fit for a stack of independent traces. Initial guesses are computed from the FFT of all
+    traces at once, and all traces are fitted by a single stacked Levenberg-Marquardt with analytic jacobian.
+
+    :param x: 1d array of times
+    :param y: array of shape (traces, rows, len(x)); the rows of a trace share phase, frequency and decay
+    :param parameters_old: list of per-trace parameters_old dicts (or None), see exp_sin_fit
+    :param parameters_init: list of per-trace parameter dicts (or None) used as initial guess instead of the FFT
+        estimate, for example the result of the previous fit of a trace that is being filled point by point
+    :param int max_iterations: maximum number of Levenberg-Marquardt iterations
+    :returns: x_fit, fitted curves of shape (traces, rows, len(x_fit)), list of per-trace parameter dicts
+    '''
+    x_full = np.asarray(x).ravel()
+    y_full = np.asarray(y)
+    num_traces, num_rows, num_points = y_full.shape
+    x_fit = fit_dataset.resample_x_fit(x_full)
+    if parameters_old is None:
+        parameters_old = [None]*num_traces
+
+    # like exp_sin_fit, only the points before the first NaN of a trace are used
+    finite = np.all(np.isfinite(y_full), axis=1)
+    first_nan = np.where(np.all(finite, axis=1), num_points, np.argmin(finite, axis=1))
+    weights = (np.arange(num_points) < first_nan[:, np.newaxis, np.newaxis])*np.ones(y_full.shape)
+    y_zeronans = np.where(weights > 0, y_full, 0)
+
+    # fit in units of the scan length to keep the parameters well-scaled
+    x_scale = np.max(np.abs(x_full)) if np.max(np.abs(x_full)) > 0 else 1.
+    x_scaled = x_full/x_scale
+    num_parameters = 4+num_rows if mode == 'sync' else 3+2*num_rows
+    p0 = np.full((num_traces, num_parameters), np.nan)
+
+    # estimating frequency and amplitude from fourier-domain, for all traces of the same length at once
+    for length in np.unique(first_nan):
+        if length < 5:
+            continue
+        traces = np.nonzero(first_nan == length)[0]
+        ft = np.fft.fft(y_zeronans[traces, :, :length], axis=2)/length
+        f = np.fft.fftfreq(length, x_scaled[1]-x_scaled[0])
+        domega = (f[1]-f[0])*2*np.pi
+
+        ft_nomean = ft.copy()
+        ft_nomean[:, :, 0] = 0
+        fR_id = np.argmax(np.sum(np.abs(ft_nomean)**2, axis=1), axis=1)
+        fR_id_conj = length-fR_id
+        fR_id, fR_id_conj = np.minimum(np.maximum(fR_id, fR_id_conj), length-1), np.minimum(fR_id, fR_id_conj)
+        fR = np.abs(f[fR_id])
+
+        ft_R = np.take_along_axis(ft, fR_id[:, np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        ft_R_conj = np.take_along_axis(ft, fR_id_conj[:, np.newaxis, np.newaxis], axis=2)[:, :, 0]
+        phase = np.arctan2(np.real(np.sum(ft_R, axis=1)), np.imag(np.sum(ft_R, axis=1)))
+        A = np.sqrt(np.abs(ft_R)**2+np.abs(ft_R_conj)**2)*2
+
+        # estimating decay rate from fourier-domain
+        T = np.full(len(traces), np.nan)
+        has_neighbours = fR_id+1 < length
+        if np.any(has_neighbours):
+            neighbours = (np.take_along_axis(ft, (fR_id-1)[:, np.newaxis, np.newaxis], axis=2) +
+                          np.take_along_axis(ft, np.minimum(fR_id+1, length-1)[:, np.newaxis, np.newaxis], axis=2))[:, :, 0]/2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                T[has_neighbours] = (np.sqrt(np.mean(np.abs(ft_R)**2, axis=1)/np.mean(np.abs(neighbours)**2, axis=1)-1)/domega/2)[has_neighbours]
+        T[np.logical_not(np.isfinite(T))] = (np.nanmax(x_full)-np.nanmin(x_full))/x_scale
+
+        # estimating asymptotics
+        if mode == 'sync':
+            inf = np.sqrt(np.sum(np.abs(ft[:, :, 0])**2, axis=1)/np.sum(A**2, axis=1))
+            p0[traces] = np.hstack([phase[:, np.newaxis], fR[:, np.newaxis], T[:, np.newaxis], inf[:, np.newaxis], A])
+        elif mode == 'unsync':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inf = np.real(ft[:, :, 0]/ft_R)
+            p0[traces] = np.hstack([phase[:, np.newaxis], fR[:, np.newaxis], T[:, np.newaxis], inf, A])
+
+    def to_scaled(p):
+        p = np.array(p, dtype=float)
+        p[:, 1] *= x_scale
+        p[:, 2] /= x_scale
+        return p
+
+    def from_scaled(p):
+        p = np.array(p, dtype=float)
+        p[:, 1] /= x_scale
+        p[:, 2] *= x_scale
+        return p
+
+    def parameters_flat(parameters):
+        if mode == 'sync':
+            return [np.ravel(parameters['phi'])[0], np.ravel(parameters['f'])[0], np.ravel(parameters['T'])[0],
+                    np.ravel(parameters['inf'])[0]] + np.ravel(parameters['A']).tolist()
+        elif mode == 'unsync':
+            return [np.ravel(parameters['phi'])[0], np.ravel(parameters['f'])[0], np.ravel(parameters['T'])[0]] + \
+                   np.ravel(parameters['inf']).tolist() + np.ravel(parameters['A']).tolist()
+
+    # warm start from previous fit results instead of the FFT estimate
+    if parameters_init is not None:
+        has_init, p_init = stack_parameters_old(parameters_init, parameters_flat, num_parameters)
+        has_init = np.logical_and(has_init, np.all(np.isfinite(p_init), axis=1))
+        has_init = np.logical_and(has_init, first_nan >= 5)
+        p0[has_init] = to_scaled(p_init[has_init])
+
+    model_jacobian = lambda p: exp_sin_model_jacobian(x_scaled, p, num_rows, mode)
+    model = lambda p: exp_sin_model_jacobian(x_scaled, p, num_rows, mode)[0]
+    fitted = np.all(np.isfinite(p0), axis=1)
+    p_new = np.full(p0.shape, np.nan)
+    if np.any(fitted):
+        p_new[fitted] = from_scaled(levenberg_marquardt(model_jacobian, p0[fitted], y_zeronans[fitted], weights[fitted],
+                                                        max_iterations=max_iterations)[0])
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        norm = np.sum(weights*np.abs(y_zeronans-(np.sum(weights*y_zeronans, axis=(1, 2))/np.sum(weights, axis=(1, 2)))[:, np.newaxis, np.newaxis])**2, axis=(1, 2))
+        MSE_rel_calculator = lambda p: np.sum(weights*np.abs(model(to_scaled(p))-y_zeronans)**2, axis=(1, 2))/norm
+
+        p = p_new.copy()
+        MSE_rel = MSE_rel_calculator(p)
+        has_old, p_old = stack_parameters_old(parameters_old, parameters_flat, num_parameters)
+        if np.any(has_old):
+            MSE_rel_old = MSE_rel_calculator(p_old)
+            use_old = np.logical_and(has_old, MSE_rel_old < MSE_rel)
+            p[use_old] = p_old[use_old]
+            MSE_rel[use_old] = MSE_rel_old[use_old]
+
+        p[:, 1] = np.abs(p[:, 1])
+        p[p[:, 2] < 0, 2] = np.inf
+        if mode == 'sync':
+            flip = p[:, 3] < -np.sqrt(MSE_rel)
+            p[flip, 3] = -p[flip, 3]
+            p[flip, 4:] = -p[flip, 4:]
+            p[flip, 0] = p[flip, 0]+np.pi
+        p[:, 0] -= np.floor(p[:, 0]/(2*np.pi)+1.)*2*np.pi
+
+        #sampling fitted curve
+        fitted_curves = exp_sin_model_jacobian(x_fit, p, num_rows, mode)[0]
+        #calculating MSE in relative relative units
+        MSE_rel = MSE_rel_calculator(p)
+
+    parameters_list = []
+    for trace in range(num_traces):
+        x = x_full[:first_nan[trace]]
+        if mode == 'sync':
+            parameters = {'phi': p[trace, 0], 'f': p[trace, 1], 'T': p[trace, 2], 'inf': p[trace, 3], 'A': p[trace, 4:]}
+        elif mode == 'unsync':
+            parameters = {'phi': p[trace, 0], 'f': p[trace, 1], 'T': p[trace, 2],
+                          'inf': p[trace, 3:3+num_rows], 'A': p[trace, 3+num_rows:]}
+        if first_nan[trace] < 5:
+            fitted_curves[trace] = np.nan
+            parameters['MSE_rel'] = np.nan
+            parameters['num_periods_decay'] = np.nan
+            parameters['num_periods_scan'] = np.nan
+            parameters['points_per_period'] = np.nan
+            parameters['decays_in_scan_length'] = np.nan
+        else:
+            parameters['MSE_rel'] = MSE_rel[trace]
+            parameters['num_periods_decay'] = parameters['T']*parameters['f']
+            parameters['num_periods_scan'] = (np.max(x)-np.min(x))*parameters['f']
+            parameters['points_per_period'] = 1/((x[1]-x[0])*parameters['f'])
+            parameters['decays_in_scan_length'] = (np.max(x)-np.min(x))/parameters['T']
+
+        frequency_goodness_test = parameters['MSE_rel']<0.35 and parameters['num_periods_decay']>1.2 and parameters['num_periods_scan']>1.5 and parameters['points_per_period']>4.
+        decay_goodness_test = parameters['decays_in_scan_length']>0.75 and frequency_goodness_test and np.isfinite(parameters['T'])
+        parameters['frequency_goodness_test'] = 1 if frequency_goodness_test else 0
+        parameters['decay_goodness_test'] = 1 if decay_goodness_test else 0
+        parameters_list.append(parameters)
+
+    return x_fit, fitted_curves, parameters_list
@@ -3,7 +3,8 @@ import pandas as pd
 from ..ponyfiles import data_structures
 
 
-def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-1, sweep_parameter_ids=[], allow_unpack_complex=True, use_resample_x_fit=True, mode=None) -> data_structures.MeasurementState:
+def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-1, sweep_parameter_ids=[], allow_unpack_complex=True, use_resample_x_fit=True, mode=None,
+                   incremental=False, refit_min_new_points=5, refit_residual_ratio=2., warm_start_max_iterations=20) -> data_structures.MeasurementState:
     ''' Fits an n-d array of measurements with 1d curve, for example exp-sin or exp (theoretical curve for Rabi, Ramsey, delay in Markov approximation).
         This function is a frontend that uses data_structures, specifically, measurement_parameter.
 
@@ -13,6 +14,11 @@ def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-
         measure the V(t_ro) of dispersive readout after a Rabi pulse (of length t_ex), each t_r point contains signal
         that performs Rabi oscillations. t_ro would be a linear_parameter (see example)
         :param iterable_of_ints sweep_parameter_ids: ids of the parameters that are
+        :param bool incremental: for on-the-fly fitting during a sweep. A slice is refitted only once at least
+        refit_min_new_points new points have been measured in it, starting from its previous fit result with at most
+        warm_start_max_iterations iterations (requires fitter.fit_batch). If the new points deviate from the previous
+        fit curve by more than refit_residual_ratio times its residual on the old points, the slice is refitted
+        from scratch. When the measurement is complete, all slices with pending points are refitted from scratch.
 
         :returns measurement: fit result
     '''
@@ -43,6 +49,30 @@ def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-
     sweep_parameter_shape = np.asarray(data.shape)[sweep_parameter_ids_positive]
     linear_parameter_shape = np.asarray(data.shape)[linear_parameter_ids]
 
+    # results of the previous fit_data call, see below
+    fit_state = {}
+
+    def fit_residual(sweep_parameter_id, new_points_only=False):
+        '''
+        Mean squared deviation of the measured points of a slice from its last fit curve. With new_points_only, only
+        the points that have been measured since the last fit are taken into account.
+        '''
+        y_real = fit_state['y_real_3d'][sweep_parameter_id]
+        y_fit = fit_state['fit_real'][sweep_parameter_id]
+        x_fit = np.asarray(fit_state['x_fit'])
+        order = np.argsort(x_fit)
+        model = np.asarray([np.interp(t, x_fit[order], row[order]) for row in y_fit])
+        points = np.isfinite(y_real)
+        if new_points_only:
+            data_old = fit_state['data_3d'][sweep_parameter_id]
+            finite_old = np.isfinite(data_old)
+            if y_real.shape[0] != data_old.shape[0]:
+                finite_old = np.concatenate((finite_old, finite_old), axis=0)
+            points = np.logical_and(points, np.logical_not(finite_old))
+        if not np.any(points) or model.shape != y_real.shape:
+            return np.nan
+        return np.mean(np.abs(model-y_real)[points]**2)
+
     # make a function for update so that we can replace old data with new data
     def fit_data(source_measurement_updated, indeces_updated):
         data = source_measurement_updated.datasets[dataset_name].data
@@ -88,78 +118,115 @@ def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-
             if unpack_complex:
                 #print('unpacking old_A_2d complex, old shape: ', old_A_2d.shape)
                 #old_A_2d = np.vstack([np.real(A_sorted).T, np.imag(A_sorted).T]).T
-                old_amplitudes_2d = {k: np.vstack([np.real(v).T, np.imag(v).T]) for k, v in old_amplitudes_2d.items()}
+                old_amplitudes_2d = {k: np.hstack([np.real(v), np.imag(v)]) for k, v in old_amplitudes_2d.items()}
                 #print('new shape: ', old_A_2d.shape)
             old_fit_parameters_1d = {k: np.reshape(v, [np.prod(sweep_parameter_shape)]) for k, v in fit_parameters_sorted.items()}
 
-        ## initializing 3d fit array
-        fit_3d_shape = [i for i in data_3d.shape]
-        fit_3d_shape[2] = len(t_fit)
-        fit_3d = np.zeros(fit_3d_shape, data_3d.dtype)
-        fit_parameters = []
-
-
-        ## initializing amplitude array
-        #A = np.zeros((data_3d.shape[0], data_3d.shape[1]), data_3d.dtype)
-        amplitudes = {}
-
-        for sweep_parameter_id in range(data_3d.shape[0]):
-            y = data_3d[sweep_parameter_id, :, :]
-            if unpack_complex:  y_real = np.vstack((np.real(y), np.imag(y)))
-            else:               y_real = y
+        if unpack_complex:  y_real_3d = np.concatenate((np.real(data_3d), np.imag(data_3d)), axis=1)
+        else:               y_real_3d = data_3d
+        fit_state['y_real_3d'] = y_real_3d
 
+        ## initializing 3d fit array, or reusing the results of the previous call: only the sweep slices whose data
+        ## has changed since then are refitted
+        if 'data_3d' in fit_state and fit_state['data_3d'].shape == data_3d.shape:
+            unchanged = np.logical_or(data_3d == fit_state['data_3d'],
+                                      np.logical_and(np.isnan(data_3d), np.isnan(fit_state['data_3d'])))
+            sweep_parameter_ids_updated = np.nonzero(np.logical_not(np.all(unchanged, axis=(1, 2))))[0]
+        else:
+            fit_3d_shape = [i for i in data_3d.shape]
+            fit_3d_shape[2] = len(t_fit)
+            fit_state['fit_3d'] = np.zeros(fit_3d_shape, data_3d.dtype)
+            fit_state['fit_parameters'] = [{} for i in range(data_3d.shape[0])]
+            ## initializing amplitude array
+            fit_state['amplitudes'] = {}
+            ## real-valued fit curves, fit results and residuals of the last fit of each slice, for incremental fits
+            fit_state['fit_real'] = [None]*data_3d.shape[0]
+            fit_state['fitresults_real'] = [None]*data_3d.shape[0]
+            fit_state['residual'] = np.full(data_3d.shape[0], np.nan)
+            fit_state['data_3d'] = np.full(data_3d.shape, np.nan, data_3d.dtype)
+            sweep_parameter_ids_updated = np.arange(data_3d.shape[0])
+
+        sweep_parameter_ids_warm = np.zeros(0, dtype=int)
+        measurement_complete = getattr(source_measurement_updated, 'done_sweeps', 0) >= \
+                               getattr(source_measurement_updated, 'total_sweeps', 0)
+        if incremental and not measurement_complete and len(sweep_parameter_ids_updated):
+            finite_old = np.isfinite(fit_state['data_3d'][sweep_parameter_ids_updated])
+            finite_new = np.isfinite(data_3d[sweep_parameter_ids_updated])
+            num_new_points = np.sum(np.logical_and(finite_new, np.logical_not(finite_old)), axis=(1, 2))
+            fitted_before = np.asarray([fit_state['fit_real'][i] is not None for i in sweep_parameter_ids_updated], dtype=bool)
+            # slices with only a few new points keep their previous fit until more points arrive
+            refit = np.logical_or(np.logical_not(fitted_before), num_new_points >= refit_min_new_points)
+            sweep_parameter_ids_updated = sweep_parameter_ids_updated[refit]
+            if hasattr(fitter, 'fit_batch'):
+                warm = [i for i in sweep_parameter_ids_updated if fit_state['fit_real'][i] is not None and
+                        not fit_residual(i, new_points_only=True) > refit_residual_ratio*fit_state['residual'][i]]
+                sweep_parameter_ids_warm = np.asarray(warm, dtype=int)
+
+        fit_state['data_3d'][sweep_parameter_ids_updated] = data_3d[sweep_parameter_ids_updated]
+        fit_3d = fit_state['fit_3d']
+        fit_parameters = fit_state['fit_parameters']
+        amplitudes = fit_state['amplitudes']
+
+        def get_old_parameters(sweep_parameter_id):
             if hasattr(source_measurement_updated, 'fit'):
                 old_parameters = {k:v[sweep_parameter_id] for k,v in old_fit_parameters_1d.items()}
-                #for k,v in old_fit_parameters_1d.items():
-                #    print('old_fit_parameters_1d[{}] = {}'.format(k, v))
-                #    print('old_parameters[{}][{}] = {}'.format(k, sweep_parameter_id, old_parameters[k]))
-                #old_parameters['A'] = old_A_2d[sweep_parameter_id,:]
                 old_parameters.update({k: v[sweep_parameter_id, :] for k,v in old_amplitudes_2d.items()})
-                #for k,v in old_amplitudes_2d.items():
-                    #print ('old_amplitudes_2d[{}] = {}'.format(k,v))
-                    #print ('old_amplitudes_2d[{}][{}] = {}'.format(k, sweep_parameter_id, v[sweep_parameter_id, :]))
-                    #print ('old_parameters[{}][{}] = {}'.format(k, sweep_parameter_id, old_parameters[v]))
-
             else:
                 old_parameters = None
-
-            #print ('old_parameters:', old_parameters)
-            x_fit, y_fit, fitresults = fitter.fit(t, y_real, old_parameters)
-
-            #print ('x fit shape: ', x_fit.shape, ' x shape: ', t.shape)
-            #print ('y fit shape: ', y_fit.shape, ' y real: ', y_real.shape)
-
-            #print ('num_amplitudes: ', num_amplitudes)
-            #print ('fitresults: ', fitresults)
+            return old_parameters
+
+        if hasattr(fitter, 'fit_batch'):
+            # all updated slices are fitted at once by the vectorized fitting engine, warm-started slices separately
+            # from the ones that are fitted from the FFT initial guess
+            fits = []
+            sweep_parameter_ids_cold = np.setdiff1d(sweep_parameter_ids_updated, sweep_parameter_ids_warm)
+            if len(sweep_parameter_ids_warm):
+                fit_state['x_fit'], y_fit_3d, fitresults_list = fitter.fit_batch(t, y_real_3d[sweep_parameter_ids_warm],
+                                                    [get_old_parameters(i) for i in sweep_parameter_ids_warm],
+                                                    parameters_init=[fit_state['fitresults_real'][i] for i in sweep_parameter_ids_warm],
+                                                    max_iterations=warm_start_max_iterations)
+                fits.extend(zip(sweep_parameter_ids_warm, y_fit_3d, fitresults_list))
+            if len(sweep_parameter_ids_cold):
+                fit_state['x_fit'], y_fit_3d, fitresults_list = fitter.fit_batch(t, y_real_3d[sweep_parameter_ids_cold],
+                                                    [get_old_parameters(i) for i in sweep_parameter_ids_cold])
+                fits.extend(zip(sweep_parameter_ids_cold, y_fit_3d, fitresults_list))
+        else:
+            fits = []
+            for sweep_parameter_id in sweep_parameter_ids_updated:
+                fit_state['x_fit'], y_fit, fitresults = fitter.fit(t, y_real_3d[sweep_parameter_id], get_old_parameters(sweep_parameter_id))
+                fits.append((sweep_parameter_id, y_fit, fitresults))
+        x_fit = fit_state['x_fit']
+        # nothing has been refitted, the previous result is still up to date
+        if not len(fits) and 'result' in fit_state:
+            return fit_state['result']
+
+        for sweep_parameter_id, y_fit, fitresults in fits:
+            fit_state['fit_real'][sweep_parameter_id] = np.asarray(y_fit)
+            fit_state['fitresults_real'][sweep_parameter_id] = dict(fitresults)
+            fit_state['residual'][sweep_parameter_id] = fit_residual(sweep_parameter_id)
             if unpack_complex:
                 num_amplitudes = y_fit.shape[0] // 2
                 fit_3d[sweep_parameter_id, :, :] = y_fit[:num_amplitudes,:]+1j*y_fit[num_amplitudes:,:]
-                #fitresults['A'] = fitresults['A'][:num_amplitudes]+1j*fitresults['A'][num_amplitudes:]
                 # if fit result is twice the length of the amplitude, build a complex out of it
                 for fitresult in fitresults.keys():
-                    #print ('fitresult_name', fitresult, 'value', np.asarray(fitresults[fitresult]).ravel())
                     if len(np.asarray(fitresults[fitresult]).ravel()) == num_amplitudes*2:
                         fitresults[fitresult] = fitresults[fitresult][:num_amplitudes]+1j*fitresults[fitresult][num_amplitudes:]
             else:
                 fit_3d[sweep_parameter_id, :, :] = y_fit
-            fit_parameters.append({k: v for k, v in fitresults.items() if not hasattr(v, '__iter__')})
-            #A[sweep_parameter_id, :] = fitresults['A']
+            fit_parameters[sweep_parameter_id] = {k: v for k, v in fitresults.items() if not hasattr(v, '__iter__')}
             for fitresult in fitresults.keys():
                 if hasattr(fitresults[fitresult], '__iter__'):
                     if not fitresult in amplitudes:
                         amplitudes[fitresult] = np.zeros((data_3d.shape[0], data_3d.shape[1]), data_3d.dtype)
-                    #if unpack_complex:
-                    #    fitresults[fitresult] = fitresults[fitresult][:num_amplitudes]+1j*fitresults[fitresult][num_amplitudes:]
                     amplitudes[fitresult][sweep_parameter_id] = fitresults[fitresult]
-            #print ('amplitudes: ', amplitudes.keys())
 
         fit_parameters_pd = pd.DataFrame(fit_parameters)
 
         ## turning fit back into original shape of data
-        fit_sorted = np.reshape(fit_3d, [i for i in data_sorted.shape][:-1]+list(t_fit.shape))
+        fit_sorted = np.reshape(fit_3d.copy(), [i for i in data_sorted.shape][:-1]+list(t_fit.shape))
         #A_sorted = np.reshape(A, [i for i in data_sorted.shape][:-1])
 
-        amplitudes_sorted = {k: np.reshape(v, [i for i in data_sorted.shape][:-1]) for k,v in amplitudes.items()}
+        amplitudes_sorted = {k: np.reshape(v.copy(), [i for i in data_sorted.shape][:-1]) for k,v in amplitudes.items()}
         if len(sweep_parameter_ids):
             fit_parameters_sorted = {fit_parameter: np.reshape(np.asarray(fit_parameters_pd[fit_parameter]),
                                                                [i for i in data_sorted.shape][:len(sweep_parameter_ids)]) for fit_parameter in fit_parameters_pd.columns}
@@ -197,7 +264,8 @@ def fit_dataset_1d(source_measurement, dataset_name, fitter, time_parameter_id=-
             # copy fit parameters to metadata if singleton
 
         #return fit_unsorted, A_unsorted, fit_parameters_unsorted, metadata, references, x_fit
-        return fit_unsorted, amplitudes_unsorted, fit_parameters_unsorted, metadata, references, x_fit
+        fit_state['result'] = fit_unsorted, amplitudes_unsorted, fit_parameters_unsorted, metadata, references, x_fit
+        return fit_state['result']
 
     # fit_unsorted, A_unsorted, fit_parameters_unsorted, metadata, references, x_fit = fit_data(source_measurement, None)
     fit_unsorted, amplitudes_unsorted, fit_parameters_unsorted, metadata, references, x_fit = fit_data(source_measurement, None)
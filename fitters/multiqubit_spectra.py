@@ -97,15 +97,35 @@ def get_Nondiag_two_tone_spectroscopy(exdir_db_inst, _id, qubit_id,remove_outlie
 	
 	
 	
-def load_spectrum_data_for_fit(exdir_db_inst, qubit_ids, qubit_coil_ids=None, full_qubit_list=None):
+## extracted peak frequencies of the spectroscopy measurements, so that repeated fits do not reload them from exdir
+spectrum_cache = {}
+
+def cached_spectrum(exdir_db_inst, key, loader, reload=False):
+    key = (exdir_db_inst.sample_name,)+key
+    if reload or key not in spectrum_cache:
+        try:
+            spectrum_cache[key] = loader()
+        except IndexError as e:
+            spectrum_cache[key] = e
+    if isinstance(spectrum_cache[key], IndexError):
+        raise spectrum_cache[key]
+    return spectrum_cache[key]
+
+def load_spectrum_data_for_fit(exdir_db_inst, qubit_ids, qubit_coil_ids=None, full_qubit_list=None, reload=False):
+    '''
+    Collects the two-tone spectra of qubit_ids into a DataFrame with a column of voltage for each qubit coil,
+    the qubit_id and the peak frequency f. The peak frequencies are cached in spectrum_cache; use reload=True
+    after new spectroscopy measurements.
+    '''
     if qubit_coil_ids is None:
         qubit_coil_ids = [i for i in qubit_ids]
     
     if full_qubit_list is None:
         full_qubit_list = [i for i in qubit_ids]
     
-    coil_qubit = { qubit_id: exdir_db_inst.select_measurement(measurement_type='nndac_coil_parameters', 
-                            metadata={'qubit_id':qubit_id}).metadata['coil_id'] for qubit_id in full_qubit_list }
+    coil_qubit = { qubit_id: cached_spectrum(exdir_db_inst, ('coil', qubit_id),
+                            lambda: exdir_db_inst.select_measurement(measurement_type='nndac_coil_parameters',
+                            metadata={'qubit_id':qubit_id}).metadata['coil_id'], reload) for qubit_id in full_qubit_list }
     qubit_coil = { coil_id: qubit_id for qubit_id, coil_id in coil_qubit.items() }
     
     data = pd.DataFrame()
@@ -114,7 +134,8 @@ def load_spectrum_data_for_fit(exdir_db_inst, qubit_ids, qubit_coil_ids=None, fu
     for qubit_id in qubit_ids:
         if qubit_id not in qubit_coil_ids:
             continue
-        x, y, metadata = get_Adaptive_two_tone_spectroscopy(exdir_db_inst, qubit_id)
+        x, y, metadata = cached_spectrum(exdir_db_inst, ('diag', qubit_id),
+                                         lambda: get_Adaptive_two_tone_spectroscopy(exdir_db_inst, qubit_id), reload)
 
         V = pd.DataFrame(np.zeros((len(y), len(full_qubit_list))), columns=full_qubit_list)
         V[qubit_id] = x
@@ -132,7 +153,8 @@ def load_spectrum_data_for_fit(exdir_db_inst, qubit_ids, qubit_coil_ids=None, fu
         for qubit_id  in qubit_ids:
             for qubit_coil_id in qubit_coil_ids:
                 try:
-                    x,y, metadata = get_Nondiag_two_tone_spectroscopy(exdir_db_inst, qubit_id, qubit_coil_id)
+                    x,y, metadata = cached_spectrum(exdir_db_inst, ('nondiag', qubit_id, qubit_coil_id),
+                                    lambda: get_Nondiag_two_tone_spectroscopy(exdir_db_inst, qubit_id, qubit_coil_id), reload)
                     y=y/1e9
                 except IndexError as e:
                     continue
@@ -165,77 +187,206 @@ def build_inductance_matrix(parameters):
                 inductance_matrix[qubit_id_, qubit_id_+1] = parameters['inductances'][qubit_id]['right']
     return inductance_matrix
 
-def model(parameters, spectra, print_=False):
-    
+def prepare_spectra(spectra, qubits):
+    '''
+    Converts the DataFrame from load_spectrum_data_for_fit into arrays once per fit: coil voltages of shape
+    (rows, qubits), the index of the measured qubit of each row and the measured frequencies.
+    '''
+    return {'voltages': np.asarray(spectra[qubits], dtype=float).reshape(len(spectra), len(qubits)),
+            'qubit_index': np.asarray(spectra['qubit_id'], dtype=int)-1,
+            'f': np.asarray(spectra['f'], dtype=float) if 'f' in spectra else None}
+
+def model_vectorized(parameters, spectra_arrays, derivatives=False):
+    '''
+    Frequencies (in GHz) of the qubit-like normal modes of the linear oscillator model for all rows of the spectra
+    at once. The oscillator matrices of all rows are diagonalized in a single batched eigh call.
+
+    :param parameters: parameters dict, see build_p0_dict
+    :param spectra_arrays: result of prepare_spectra
+    :param bool derivatives: also return the derivatives of the mode frequencies (Hellmann-Feynman theorem)
+        with respect to EJ1, EJ2, phi0 (shape (rows, qubits)), the inductance matrix (rows, qubits, qubits)
+        and EC, g, J1, J2 (rows,); frequencies are in Hz here
+    :returns: frequencies of shape (rows,) (and the dict of derivatives)
+    '''
     qubits = parameters['qubits']
-    num_qubits = len(qubits)    
-    
-    resonator_freqs = [parameters['fr'][qubit_id] for qubit_id in qubits]
+    num_qubits = len(qubits)
+    voltages = spectra_arrays['voltages']
+    qubit_index = spectra_arrays['qubit_index']
+    num_rows = voltages.shape[0]
+
+    resonator_freqs = np.asarray([parameters['fr'][qubit_id] for qubit_id in qubits], dtype=float)
+    EJ1 = np.asarray([parameters['EJ1'][qubit_id] for qubit_id in qubits], dtype=float)
+    EJ2 = np.asarray([parameters['EJ2'][qubit_id] for qubit_id in qubits], dtype=float)
+    phi0 = np.asarray([parameters['phi0'][qubit_id] for qubit_id in qubits], dtype=float)
+    EC = parameters['EC']
     inductance_matrix = build_inductance_matrix(parameters)
-    
-    frequencies = []
-    
-    for s_id, data in spectra.iterrows():
-        try:
-            induced_flux = inductance_matrix@np.asarray(data[qubits].tolist())
-        except:
-            print ('inductance_matrix:', inductance_matrix)
-            print ('data[qubits].tolist():', data[qubits].tolist())
-            raise
-            
-        #print (induced_flux)
-        
-        qubit_freqs = [fqbare(parameters['EJ1'][qubit_id], 
-                              parameters['EJ2'][qubit_id], 
-                              parameters['EC'], 
-                              induced_flux[qubit_id_]+parameters['phi0'][qubit_id]) 
-                           for qubit_id_, qubit_id in enumerate(qubits)]
-        
-        #print (qubit_freqs)
-        
-        linear_oscillator_matrix = np.diag(resonator_freqs+qubit_freqs)
-        
-        # equal qubit-resonator coupling
-        if parameters['qubit_resonator_individual'] == 'equal_claws':
-            for qubit_id_, qubit_id in enumerate(qubits):
-                linear_oscillator_matrix[qubit_id_, qubit_id_+num_qubits] = \
-                    parameters['g']*np.sqrt(qubit_freqs[qubit_id_])
-                linear_oscillator_matrix[qubit_id_+num_qubits, qubit_id_] = \
-                    parameters['g']*np.sqrt(qubit_freqs[qubit_id_])
-        
-        # qubit-qubit coupling
-        if parameters['qubit_qubit_coupling'] == 'alternating-chain-nn':
-            for qubit_id_, qubit_id in enumerate(qubits):
-                if (qubit_id_ % 2):
-                    Jl, Jr = parameters['J1'], parameters['J2']
-                else:
-                    Jl, Jr = parameters['J2'], parameters['J1']
-                    
-                if qubit_id_ > 0:
-                    linear_oscillator_matrix[num_qubits+qubit_id_, num_qubits+qubit_id_-1] = \
-                        Jl*np.sqrt(qubit_freqs[qubit_id_]*qubit_freqs[qubit_id_-1])
-                if qubit_id_ < num_qubits-1:
-                    linear_oscillator_matrix[num_qubits+qubit_id_, num_qubits+qubit_id_+1] = \
-                        Jr*np.sqrt(qubit_freqs[qubit_id_]*qubit_freqs[qubit_id_+1])
-#         print(linear_oscillator_matrix)
-        #print ('linear_oscillator_matrix:', linear_oscillator_matrix)
-        qubit_freqs[int(qubit_id)-1]
-        try:
-            w, v = np.linalg.eigh(linear_oscillator_matrix/1e9)
-            #print ('w:', w)
-            #print ('v:', v)
-            participations = np.abs(v)**2
-            qubit_like_mode_id = np.argmax(participations[num_qubits+int(data['qubit_id'])-1,:])
-            #print (qubit_like_mode_id )
-            frequencies.append(w[qubit_like_mode_id])
-            if print_:
-                print (w)
-        except Exception as e:
-            #print (e)
-            #print (linear_oscillator_matrix/1e9)
-            frequencies.append(qubit_freqs[int(qubit_id)-1])
-
-    return frequencies
+
+    flux = voltages@inductance_matrix.T + phi0
+    sin2 = np.sin(np.pi*flux)**2
+    cos2 = np.cos(np.pi*flux)**2
+    S = (EJ1-EJ2)**2*sin2+(EJ1+EJ2)**2*cos2
+    qubit_freqs = (8*EC)**0.5*S**0.25-EC # same as fqbare
+    sqrt_qubit_freqs = np.sqrt(qubit_freqs)
+
+    qubits_ = np.arange(num_qubits)
+    linear_oscillator_matrix = np.zeros((num_rows, 2*num_qubits, 2*num_qubits))
+    linear_oscillator_matrix[:, qubits_, qubits_] = resonator_freqs
+    linear_oscillator_matrix[:, num_qubits+qubits_, num_qubits+qubits_] = qubit_freqs
+
+    # equal qubit-resonator coupling
+    claws = parameters['qubit_resonator_individual'] == 'equal_claws'
+    if claws:
+        linear_oscillator_matrix[:, qubits_, num_qubits+qubits_] = parameters['g']*sqrt_qubit_freqs
+        linear_oscillator_matrix[:, num_qubits+qubits_, qubits_] = parameters['g']*sqrt_qubit_freqs
+
+    # qubit-qubit coupling, the bond between qubits i and i+1 is J1 for even i and J2 for odd i
+    bonds = np.arange(num_qubits-1)
+    chain = parameters['qubit_qubit_coupling'] == 'alternating-chain-nn'
+    if chain:
+        J = np.where(bonds % 2, parameters['J2'], parameters['J1'])
+        bond_couplings = J*sqrt_qubit_freqs[:, bonds]*sqrt_qubit_freqs[:, bonds+1]
+        linear_oscillator_matrix[:, num_qubits+bonds, num_qubits+bonds+1] = bond_couplings
+        linear_oscillator_matrix[:, num_qubits+bonds+1, num_qubits+bonds] = bond_couplings
+
+    # rows for which the model is undefined (e.g. negative qubit frequency) fall back to the bare qubit frequency
+    finite = np.all(np.isfinite(linear_oscillator_matrix), axis=(1, 2))
+    linear_oscillator_matrix[np.logical_not(finite)] = np.identity(2*num_qubits)
+    w, v = np.linalg.eigh(linear_oscillator_matrix/1e9)
+    participations = np.abs(v[np.arange(num_rows), num_qubits+qubit_index, :])**2
+    qubit_like_mode_id = np.argmax(participations, axis=1)
+    frequencies = w[np.arange(num_rows), qubit_like_mode_id]
+    frequencies[np.logical_not(finite)] = qubit_freqs[np.logical_not(finite), qubit_index[np.logical_not(finite)]]/1e9
+
+    if not derivatives:
+        return frequencies
+
+    ## derivative of an eigenvalue over a matrix element (a,b) is v_a*v_b (times 2 for symmetric off-diagonal pairs)
+    mode = v[np.arange(num_rows), :, qubit_like_mode_id]
+    mode_resonators, mode_qubits = mode[:, :num_qubits], mode[:, num_qubits:]
+    df_dfq = mode_qubits**2
+    d = {}
+    if claws:
+        df_dfq = df_dfq + mode_resonators*mode_qubits*parameters['g']/sqrt_qubit_freqs
+        d['g'] = np.sum(2*mode_resonators*mode_qubits*sqrt_qubit_freqs, axis=1)
+    else:
+        d['g'] = np.zeros(num_rows)
+    d['J1'] = np.zeros(num_rows)
+    d['J2'] = np.zeros(num_rows)
+    if chain:
+        bond_products = 2*mode_qubits[:, bonds]*mode_qubits[:, bonds+1]
+        df_dfq[:, bonds] += bond_products*J*sqrt_qubit_freqs[:, bonds+1]/(2*sqrt_qubit_freqs[:, bonds])
+        df_dfq[:, bonds+1] += bond_products*J*sqrt_qubit_freqs[:, bonds]/(2*sqrt_qubit_freqs[:, bonds+1])
+        d['J1'] = np.sum((bond_products*sqrt_qubit_freqs[:, bonds]*sqrt_qubit_freqs[:, bonds+1])[:, bonds % 2 == 0], axis=1)
+        d['J2'] = np.sum((bond_products*sqrt_qubit_freqs[:, bonds]*sqrt_qubit_freqs[:, bonds+1])[:, bonds % 2 == 1], axis=1)
+
+    dfq_dS = (8*EC)**0.5/4*S**(-0.75)
+    dfq_dflux = dfq_dS*(-4*np.pi*EJ1*EJ2*np.sin(2*np.pi*flux))
+    d['EJ1'] = df_dfq*dfq_dS*(2*(EJ1-EJ2)*sin2+2*(EJ1+EJ2)*cos2)
+    d['EJ2'] = df_dfq*dfq_dS*(-2*(EJ1-EJ2)*sin2+2*(EJ1+EJ2)*cos2)
+    d['phi0'] = df_dfq*dfq_dflux
+    d['inductances'] = d['phi0'][:, :, np.newaxis]*voltages[:, np.newaxis, :]
+    d['EC'] = np.sum(df_dfq*(2**0.5*EC**(-0.5)*S**0.25-1), axis=1)
+    for k in d.keys():
+        d[k][np.logical_not(finite)] = 0
+    return frequencies, d
+
+def model(parameters, spectra, print_=False):
+    frequencies = model_vectorized(parameters, prepare_spectra(spectra, parameters['qubits']))
+    if print_:
+        print (frequencies)
+    return frequencies.tolist()
+
+def model_jacobian(p, parameters_fixed, qubit_ids, spectra_arrays):
+    '''
+    Model frequencies (in GHz) and their jacobian with respect to the parameter list p of
+    build_podgon_list_from_parameters_dict: a column for each parameter that is not in parameters_fixed.
+    '''
+    parameters = build_parameters_dict_from_podgon_list(p, parameters_fixed, qubit_ids)
+    frequencies, d = model_vectorized(parameters, spectra_arrays, derivatives=True)
+    num_qubits = len(qubit_ids)
+    qubits_ = np.arange(num_qubits)
+
+    ## EJ1, EJ2 and EC are in GHz in the parameter list
+    columns = []
+    if 'EJ1' not in parameters_fixed:
+        columns.append(d['EJ1']*1e9)
+    if 'EJ2' not in parameters_fixed:
+        columns.append(d['EJ2']*1e9)
+    if 'phi0' not in parameters_fixed:
+        columns.append(d['phi0'])
+    if 'inductances' not in parameters_fixed:
+        columns.append(d['inductances'][:, qubits_, qubits_])
+        columns.append(d['inductances'][:, qubits_[:-1], qubits_[:-1]+1])
+        columns.append(d['inductances'][:, qubits_[1:], qubits_[1:]-1])
+    if 'EC' not in parameters_fixed:
+        columns.append(d['EC'][:, np.newaxis]*1e9)
+    for name in ['g', 'J1', 'J2']:
+        if name not in parameters_fixed:
+            columns.append(d[name][:, np.newaxis])
+    return frequencies, np.hstack(columns)/1e9
+
+class SpectrumModel:
+    '''
+    Residuals and jacobian of the linear oscillator model over the parameter list of
+    build_podgon_list_from_parameters_dict. least_squares evaluates the residuals and then the jacobian at the
+    same point, the model keeps the last evaluation so that the oscillator matrices are diagonalized only once.
+    '''
+    def __init__(self, parameters_fixed, qubit_ids, spectra_arrays):
+        self.parameters_fixed = parameters_fixed
+        self.qubit_ids = qubit_ids
+        self.spectra_arrays = spectra_arrays
+        self.last_p = None
+
+    def evaluate(self, p):
+        if self.last_p is None or not np.array_equal(self.last_p, p):
+            self.last_frequencies, self.last_jacobian = model_jacobian(p, self.parameters_fixed, self.qubit_ids,
+                                                                       self.spectra_arrays)
+            self.last_p = np.array(p)
+        return self.last_frequencies, self.last_jacobian
+
+    def residuals(self, p):
+        return self.evaluate(p)[0]-self.spectra_arrays['f']
+
+    def jacobian(self, p):
+        return self.evaluate(p)[1]
+
+def _fit_from_start(p0, parameters_fixed, qubit_ids, spectra_arrays, bounds, least_squares_kwargs):
+    from scipy.optimize import least_squares
+    model = SpectrumModel(parameters_fixed, qubit_ids, spectra_arrays)
+    return least_squares(model.residuals, p0, jac=model.jacobian, bounds=bounds, **least_squares_kwargs)
+
+def fit(parameters, spectra, parameters_fixed={'EC':155e6}, num_starts=1, processes=None, seed=None, **kwargs):
+    '''
+    Global fit of the linear oscillator model to the spectra of all qubits with an analytic jacobian.
+
+    :param parameters: initial parameters dict, see build_p0_dict
+    :param spectra: DataFrame from load_spectrum_data_for_fit
+    :param parameters_fixed: parameters that are not fitted (should contain 'fr')
+    :param int num_starts: number of starting points. The first one is the initial parameters, the others are drawn
+        uniformly from build_bounds_from_parameters_dict. The starts are fitted in a process pool.
+    :param processes: number of worker processes (default: number of CPUs); with 1 all starts are fitted in this process
+    :param kwargs: passed to scipy.optimize.least_squares
+    :returns: fitted parameters dict, least_squares result of the best start
+    '''
+    qubit_ids = parameters['qubits']
+    spectra_arrays = prepare_spectra(spectra, qubit_ids)
+    bounds = np.asarray(build_bounds_from_parameters_dict(parameters, parameters_fixed))
+    bounds = np.min(bounds, axis=0), np.max(bounds, axis=0)
+    p0 = np.clip(build_podgon_list_from_parameters_dict(parameters, parameters_fixed), bounds[0], bounds[1])
+
+    random_state = np.random.RandomState(seed)
+    starts = [p0]+[random_state.uniform(bounds[0], bounds[1]) for start_id in range(num_starts-1)]
+    arguments = [(start, parameters_fixed, qubit_ids, spectra_arrays, bounds, kwargs) for start in starts]
+
+    if processes == 1 or num_starts == 1:
+        results = [_fit_from_start(*a) for a in arguments]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_fit_from_start, *zip(*arguments)))
+
+    best = min(results, key=lambda result: result.cost)
+    return build_parameters_dict_from_podgon_list(best.x, parameters_fixed, qubit_ids), best
 
 def save_parameters_dict(exdir_db_inst, parameters_dict):    
     metadata = {'inductance_matrix_type': parameters_dict['inductance_matrix_type'],
@@ -358,7 +509,9 @@ def build_bounds_from_parameters_dict(parameters, parameters_fixed = {'fr':[], '
         podgon_up.extend([np.abs(parameters['inductances'][qubit_id]['left'])*5 \
                            for qubit_id_, qubit_id in enumerate(qubit_ids) if qubit_id_ > 0])
     
-    #podgon_low.append(parameters['EC']/1e9/2)
+    if 'EC' not in parameters_fixed:
+        podgon_low.append(parameters['EC']/1e9/2)
+        podgon_up.append(parameters['EC']/1e9*2)
     if 'g' not in parameters_fixed:
         podgon_low.append(parameters['g']/2)
         podgon_up.append(parameters['g']*2)   
@@ -391,7 +544,8 @@ def build_podgon_list_from_parameters_dict(parameters, parameters_fixed={'EC':15
         podgon.extend([parameters['inductances'][qubit_id]['left'] \
                        for qubit_id_, qubit_id in enumerate(qubit_ids) if qubit_id_ > 0])
     
-    #podgon.append(parameters['EC']/1e9)
+    if 'EC' not in parameters_fixed:
+        podgon.append(parameters['EC']/1e9)
     if 'g' not in parameters_fixed:
         podgon.append(parameters['g'])
     if 'J1' not in parameters_fixed:
@@ -408,17 +562,20 @@ def build_parameters_dict_from_podgon_list(p, parameters_fixed, qubit_ids):
     parameters = {}
     #fr   = p[:num_qubits]
     #p = p[num_qubits:]
-    EJ1  = p[:num_qubits]
-    p = p[num_qubits:]
-    parameters['EJ1'] = {qubit_id: EJ1_*1e9 for qubit_id, EJ1_ in zip(qubit_ids, EJ1)}
+    if 'EJ1' not in parameters_fixed:
+        EJ1  = p[:num_qubits]
+        p = p[num_qubits:]
+        parameters['EJ1'] = {qubit_id: EJ1_*1e9 for qubit_id, EJ1_ in zip(qubit_ids, EJ1)}
     
-    EJ2  = p[:num_qubits]
-    p = p[num_qubits:]
-    parameters['EJ2'] = {qubit_id: EJ2_*1e9 for qubit_id, EJ2_ in zip(qubit_ids, EJ2)}
+    if 'EJ2' not in parameters_fixed:
+        EJ2  = p[:num_qubits]
+        p = p[num_qubits:]
+        parameters['EJ2'] = {qubit_id: EJ2_*1e9 for qubit_id, EJ2_ in zip(qubit_ids, EJ2)}
     
-    phi0 = p[:num_qubits]
-    p = p[num_qubits:]
-    parameters['phi0'] = {qubit_id: phi0_ for qubit_id, phi0_ in zip(qubit_ids, phi0)}
+    if 'phi0' not in parameters_fixed:
+        phi0 = p[:num_qubits]
+        p = p[num_qubits:]
+        parameters['phi0'] = {qubit_id: phi0_ for qubit_id, phi0_ in zip(qubit_ids, phi0)}
     
     if 'inductances' not in parameters_fixed:
         L = p[:(3*num_qubits-2)]
@@ -432,11 +589,11 @@ def build_parameters_dict_from_podgon_list(p, parameters_fixed, qubit_ids):
             if qubit_id_ > 0:
                 inductances[qubit_id]['left'] = L[2*num_qubits-2+qubit_id_]
                 
-        parameters['inductance'] = inductances        
+        parameters['inductances'] = inductances
     if 'EC' not in parameters_fixed:
         EC = p[0]
         p = p[1:]
-        parameters['EC'] = EC
+        parameters['EC'] = EC*1e9
     if 'g' not in parameters_fixed:
         g = p[0]
         p = p[1:]
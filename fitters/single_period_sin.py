@@ -1,5 +1,6 @@
 import numpy as np
 from . import fit_dataset
+from .batch_lm import levenberg_marquardt, stack_parameters_old
 import traceback
 
 class SinglePeriodSinFitter:
@@ -10,6 +11,9 @@ class SinglePeriodSinFitter:
     def fit(self,x,y, parameters_old=None):
         return single_period_sin_fit(x, y, parameters_old, self.mode)
 
+    def fit_batch(self, x, y, parameters_old=None, parameters_init=None, max_iterations=200):
+        return single_period_sin_fit_batch(x, y, parameters_old, self.mode, parameters_init, max_iterations)
+
 
 def single_period_sin_fit(x, y, parameters_old=None, mode='sync'):
     y = np.asarray(y)
@@ -112,3 +116,120 @@ def single_period_sin_fit(x, y, parameters_old=None, mode='sync'):
     parameters['phase_goodness_test'] = 1 if phase_goodness_test else 0
 
     return fit_dataset.resample_x_fit(x_full), fitted_curve, parameters
+
+
+def single_period_sin_model_jacobian(x, p, num_rows, mode='sync'):
+    '''
+    single_period_sin model and its jacobian for a stack of parameter vectors p of shape (traces, parameters),
+    with the parameter order of single_period_sin_fit.
+    '''
+    phase = p[:, 0, np.newaxis, np.newaxis]
+    if mode == 'sync':
+        inf = p[:, 1, np.newaxis, np.newaxis]
+        A = p[:, 2:, np.newaxis]
+    elif mode == 'unsync':
+        inf = p[:, 1:1+num_rows, np.newaxis]
+        A = p[:, 1+num_rows:, np.newaxis]
+    oscillation = -np.cos(phase+x)
+    model = A*(oscillation+inf)
+
+    jacobian = np.zeros(model.shape+(p.shape[1],))
+    jacobian[..., 0] = A*np.sin(phase+x)
+    for row in range(num_rows):
+        if mode == 'sync':
+            jacobian[:, row, :, 1] = A[:, row]
+            jacobian[:, row, :, 2+row] = oscillation[:, 0]+inf[:, 0]
+        elif mode == 'unsync':
+            jacobian[:, row, :, 1+row] = A[:, row]
+            jacobian[:, row, :, 1+num_rows+row] = oscillation[:, 0]+inf[:, row]
+    return model, jacobian
+
+
+def single_period_sin_fit_batch(x, y, parameters_old=None, mode='sync', parameters_init=None, max_iterations=200):
+    '''
+    Vectorized single_period_sin_fit for a stack of independent traces of shape (traces, rows, len(x)).
+
+    :param parameters_old: list of per-trace parameters_old dicts (or None), see single_period_sin_fit
+    :param parameters_init: list of per-trace parameter dicts (or None) used as initial guess instead of the FFT estimate
+    :param int max_iterations: maximum number of Levenberg-Marquardt iterations
+    :returns: x_fit, fitted curves of shape (traces, rows, len(x_fit)), list of per-trace parameter dicts
+    '''
+    x_full = np.asarray(x).ravel()
+    y_full = np.asarray(y)
+    num_traces, num_rows, num_points = y_full.shape
+    x_fit = fit_dataset.resample_x_fit(x_full)
+    if parameters_old is None:
+        parameters_old = [None]*num_traces
+
+    finite = np.all(np.isfinite(y_full), axis=1)
+    first_nan = np.where(np.all(finite, axis=1), num_points, np.argmin(finite, axis=1))
+    weights = (np.arange(num_points) < first_nan[:, np.newaxis, np.newaxis])*np.ones(y_full.shape)
+    y_zeronans = np.where(np.isfinite(y_full), y_full, 0)
+
+    # estimating amplitude and phase from the second harmonic of the zero-padded traces
+    ft = np.fft.fft(y_zeronans, axis=2)/num_points
+    fR_id = 2
+    fR_id_conj = -2
+    phase = np.arctan2(np.real(np.sum(ft[:, :, fR_id], axis=1)), np.imag(np.sum(ft[:, :, fR_id], axis=1)))
+    A = np.sqrt(np.abs(ft[:, :, fR_id])**2+np.abs(ft[:, :, fR_id_conj])**2)*2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if mode == 'sync':
+            inf = np.sqrt(np.sum(np.abs(ft[:, :, 0])**2, axis=1)/np.sum(A**2, axis=1))
+            p0 = np.hstack([phase[:, np.newaxis], inf[:, np.newaxis], A])
+        elif mode == 'unsync':
+            inf = np.real(ft[:, :, 0]/ft[:, :, fR_id])
+            p0 = np.hstack([phase[:, np.newaxis], inf, A])
+
+    def parameters_flat(parameters):
+        return [np.ravel(parameters['phi'])[0]] + np.ravel(parameters['inf']).tolist() + np.ravel(parameters['A']).tolist()
+
+    # warm start from previous fit results instead of the FFT estimate
+    if parameters_init is not None:
+        has_init, p_init = stack_parameters_old(parameters_init, parameters_flat, p0.shape[1])
+        has_init = np.logical_and(has_init, np.all(np.isfinite(p_init), axis=1))
+        p0[has_init] = p_init[has_init]
+
+    fitted = np.logical_and(first_nan >= 2, np.all(np.isfinite(p0), axis=1))
+    p = np.full(p0.shape, np.nan)
+    if np.any(fitted):
+        p[fitted] = levenberg_marquardt(lambda p: single_period_sin_model_jacobian(x_full, p, num_rows, mode),
+                                        p0[fitted], y_zeronans[fitted], weights[fitted], max_iterations=max_iterations)[0]
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        y_valid = np.where(weights > 0, y_zeronans, 0)
+        mean = np.sum(y_valid, axis=(1, 2))/np.sum(weights, axis=(1, 2))
+        norm = np.sum(weights*np.abs(y_valid-mean[:, np.newaxis, np.newaxis])**2, axis=(1, 2))
+        MSE_rel_calculator = lambda p: np.sum(weights*np.abs(single_period_sin_model_jacobian(x_full, p, num_rows, mode)[0]-y_valid)**2, axis=(1, 2))/norm
+
+        MSE_rel = MSE_rel_calculator(p)
+        has_old, p_old = stack_parameters_old(parameters_old, parameters_flat, p0.shape[1])
+        if np.any(has_old):
+            MSE_rel_old = MSE_rel_calculator(p_old)
+            use_old = np.logical_and(has_old, MSE_rel_old < MSE_rel)
+            p[use_old] = p_old[use_old]
+
+        if mode == 'sync':
+            flip = np.all(p[:, 2:] < 0, axis=1)
+            p[flip, 1:] = -p[flip, 1:]
+            p[flip, 0] = p[flip, 0]+np.pi
+        p[:, 0] -= np.floor(p[:, 0]/(2*np.pi)+1.)*2*np.pi
+
+        #sampling fitted curve
+        fitted_curves = single_period_sin_model_jacobian(x_fit, p, num_rows, mode)[0]
+        #calculating MSE in relative relative units
+        MSE_rel = MSE_rel_calculator(p)
+
+    parameters_list = []
+    for trace in range(num_traces):
+        if mode == 'sync':
+            parameters = {'phi': p[trace, 0], 'inf': p[trace, 1], 'A': p[trace, 2:]}
+        elif mode == 'unsync':
+            parameters = {'phi': p[trace, 0], 'inf': p[trace, 1:1+num_rows], 'A': p[trace, 1+num_rows:]}
+        parameters['MSE_rel'] = MSE_rel[trace] if fitted[trace] else np.nan
+        if not fitted[trace]:
+            fitted_curves[trace] = np.nan
+        phase_goodness_test = np.all(3*parameters['MSE_rel']<parameters['A'])
+        parameters['phase_goodness_test'] = 1 if phase_goodness_test else 0
+        parameters_list.append(parameters)
+
+    return x_fit, fitted_curves, parameters_list
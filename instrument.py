@@ -52,6 +52,11 @@ class Instrument():
 								# back from a device.
 	FLAG_PERSIST = 0x10         # Write parameter to config file if it is set,
 								# try to read again for a new instance
+	FLAG_CACHE = 0x20           # Skip a 'set' if the value equals the last
+								# written or read value (within
+								# 'cache_tolerance'), and answer a 'get' from
+								# the cache if the value is not older than
+								# 'cache_time' seconds.
 
 	USE_ACCESS_LOCK = False     # For now
 
@@ -81,6 +86,9 @@ class Instrument():
 		self._default_read_var = None
 		self._default_write_var = None
 
+		self._cache_statistics = {}
+		self._ramp_scheduler = None
+
 		self._lock_class = kwargs.get('lockclass', name)
 
 	def __str__(self):
@@ -210,6 +218,8 @@ class Instrument():
 				units (string): units for this parameter
 				maxstep (float): maximum step size when changing parameter
 				stepdelay (float): delay when setting steps (in milliseconds)
+				ramp_background (bool): perform maxstep ramps in the
+					background, see set_parameter_rate
 				tags (array): tags for this parameter
 				doc (string): documentation string to add to get/set functions
 				format_map (dict): map describing allowed options and the
@@ -221,6 +231,15 @@ class Instrument():
 					to watch. If any of them changes, execute a get for this
 					parameter. Useful for a parameter that depends on one
 					(or more) other parameters.
+				cache_tolerance (float): with FLAG_CACHE, a set is skipped if
+					the new value differs from the cached one by at most this
+				cache_time (float): with FLAG_CACHE, validity of the cached
+					value in seconds (default: None, gets always query and
+					the cache for sets does not expire)
+				scpi_set (string): SCPI command template that sets the
+					parameter, e.g. 'FREQ:CW {value}'. Parameters with a
+					template are written in one message by set(dict),
+					see write_batch.
 
 		Output: None
 		'''
@@ -492,17 +511,119 @@ class Instrument():
 
 		self.set_parameter_options(var_name, minval=minval, maxval=maxval)
 
-	def set_parameter_rate(self, name, stepsize, stepdelay):
+	def set_parameter_rate(self, name, stepsize, stepdelay, background=False):
 		'''
 		Change the rate properties for a channel.
 
 		Input:
 			stepsize (float): the maximum step size
 			stepdelay (float): the delay after each step
+			background (bool): ramp in the background thread of the
+				instrument's RampScheduler. Ramps of several parameters
+				run concurrently, set(..., wait=False) returns immediately
+				and ramp_done()/wait_ramps() wait for the targets.
 		Output:
 			None
 		'''
-		self.set_parameter_options(name, maxstep=stepsize, stepdelay=stepdelay)
+		self.set_parameter_options(name, maxstep=stepsize, stepdelay=stepdelay,
+			ramp_background=background)
+
+	def get_ramp_scheduler(self):
+		'''
+		Returns the RampScheduler of the background ramps of this
+		instrument. Simultaneous steps of parameters with a 'scpi_set'
+		template are written in one message with write_batch.
+		'''
+		if self._ramp_scheduler is None:
+			from qsweepy.ramp import RampScheduler
+			self._ramp_scheduler = RampScheduler(write_batch=self.write_batch)
+		return self._ramp_scheduler
+
+	def wait_ramps(self, names=None, timeout=None):
+		'''
+		Wait until the background ramps of the given parameters (default:
+		all) have reached their targets.
+		'''
+		if self._ramp_scheduler is not None:
+			self._ramp_scheduler.wait(names, timeout)
+
+	async def ramp_done(self, names=None):
+		'''
+		Coroutine version of wait_ramps.
+		'''
+		if self._ramp_scheduler is not None:
+			await self._ramp_scheduler.ramp_done(names)
+
+	def set_parameter_cache(self, name, enabled=True, tolerance=None, cache_time=None):
+		'''
+		Enable or disable the write-through cache (FLAG_CACHE) of a parameter.
+
+		Input:
+			enabled (bool): enable the cache
+			tolerance (float): maximum difference of values considered equal
+			cache_time (float): validity of the cached value in seconds,
+				None for gets that always query the instrument
+		Output:
+			None
+		'''
+		if name not in self._parameters:
+			print('Parameter %s not defined' % name)
+			return None
+
+		p = self._parameters[name]
+		if enabled:
+			p['flags'] |= Instrument.FLAG_CACHE
+		else:
+			p['flags'] &= ~Instrument.FLAG_CACHE
+		if tolerance is not None:
+			p['cache_tolerance'] = tolerance
+		p['cache_time'] = cache_time
+
+	def invalidate_cache(self, name=None):
+		'''
+		Mark the cached value of a parameter (or of all parameters) as
+		unknown, e.g. after a reset of the instrument or a change from the
+		front panel. The next set and get go to the instrument.
+		'''
+		names = self._parameters.keys() if name is None else [name]
+		for n in names:
+			if n in self._parameters:
+				self._parameters[n].pop('cache_timestamp', None)
+
+	def get_cache_statistics(self, name=None):
+		'''
+		Hit and miss counts of the parameter cache, for profiling.
+
+		Output: dict parameter -> {'set_hits', 'set_misses', 'get_hits',
+			'get_misses'}, or a single such dict if name is given.
+		'''
+		if name is not None:
+			return dict(self._cache_statistics.get(name, {}))
+		return {n: dict(stats) for n, stats in self._cache_statistics.items()}
+
+	def reset_cache_statistics(self):
+		self._cache_statistics = {}
+
+	def _cache_count(self, name, event):
+		stats = self._cache_statistics.setdefault(name,
+			{'set_hits': 0, 'set_misses': 0, 'get_hits': 0, 'get_misses': 0})
+		stats[event] += 1
+
+	def _cache_valid(self, p):
+		if 'cache_timestamp' not in p or 'value' not in p:
+			return False
+		cache_time = p.get('cache_time', None)
+		return cache_time is None or time.time() - p['cache_timestamp'] <= cache_time
+
+	def _cache_equal(self, p, value):
+		cached = p['value']
+		tolerance = p.get('cache_tolerance', 0)
+		try:
+			if type(value) in (int, float) and type(cached) in (int, float):
+				return math.fabs(value - cached) <= tolerance
+			return bool(np.all(np.asarray(cached) == np.asarray(value)))
+		except Exception:
+			return False
 
 	def get_parameter_names(self):
 		'''
@@ -661,6 +782,14 @@ class Instrument():
 			print('Instrument does not support getting of %s' % name)
 			return None
 
+		if flags & Instrument.FLAG_CACHE:
+			if p.get('cache_time', None) is not None and self._cache_valid(p):
+				self._cache_count(name, 'get_hits')
+				if p['type'] == np.ndarray:
+					return np.array(p['value'])
+				return p['value']
+			self._cache_count(name, 'get_misses')
+
 		if 'base_name' in p:
 			base_name = p['base_name']
 		else:
@@ -686,6 +815,7 @@ class Instrument():
 				logging.warning('Unable to cast value "%s" to %s', value, p['type'])
 
 		p['value'] = value
+		p['cache_timestamp'] = time.time()
 		return value
 
 	def get(self, name, query=True, fast=False, **kwargs):
@@ -827,14 +957,33 @@ class Instrument():
 
 		return value
 
-	def _set_value(self, name, value, **kwargs):
+	def _ramp_result(self, name, future, reraise=True):
+		'''
+		Wait for a background ramp of a parameter. If the ramp failed or was
+		stopped, the cached value of the parameter is invalidated and the
+		error is re-raised (if reraise).
+		'''
+		try:
+			return future.result()
+		except BaseException:
+			self.invalidate_cache(name)
+			if reraise:
+				raise
+
+	def _set_value(self, name, value, batch=None, wait=True, futures=None, **kwargs):
 		'''
 		Private wrapper function to set a value.
 
 		Input:  (1) name of parameter (string)
 				(2) value of parameter (whatever type the parameter supports).
 					Type casting is performed if necessary.
-				(3) Optional keyword args that will be passed on.
+				(3) batch (list): if given and the parameter has a 'scpi_set'
+					template, the command is appended to the list instead of
+					calling the _do_set_<name> function
+				(4) wait (bool): wait for the end of a background ramp
+				(5) futures (dict): if given and wait is False, the future of
+					a background ramp is stored under the parameter name
+				(6) Optional keyword args that will be passed on.
 		Output: Value returned by the _do_set_<name> function,
 				or result of get in FLAG_GET_AFTER_SET specified.
 		'''
@@ -887,9 +1036,40 @@ class Instrument():
 		else:
 			base_name = name
 
+		if p['flags'] & Instrument.FLAG_CACHE:
+			if self._cache_valid(p) and self._cache_equal(p, value):
+				self._cache_count(name, 'set_hits')
+				return p['value']
+			self._cache_count(name, 'set_misses')
+
 		func = p['set_func']
-		if 'maxstep' in p and p['maxstep'] is not None:
-			curval = p['value']
+		if batch is not None and 'scpi_set' in p and p.get('maxstep', None) is None \
+				and not p['flags'] & self.FLAG_GET_AFTER_SET:
+			batch.append(p['scpi_set'].format(value=value, **kwargs))
+		elif p.get('maxstep', None) is not None and p.get('ramp_background', False):
+			curval = p.get('value', None)
+			if curval is None:
+				logging.warning('Current value not available, ignoring maxstep')
+				curval = value
+			command = None
+			if 'scpi_set' in p:
+				command = lambda v: p['scpi_set'].format(value=v, **kwargs)
+			future = self.get_ramp_scheduler().ramp(name, curval, value, p['maxstep'],
+				lambda v: func(v, **kwargs), p.get('stepdelay', 50) / 1000.0, command)
+			if wait:
+				self._ramp_result(name, future)
+			else:
+				# a get after set would read an intermediate value of the ramp
+				p['value'] = value
+				p['cache_timestamp'] = time.time()
+				# a failed or stopped ramp leaves the channel somewhere on the way
+				future.add_done_callback(lambda f: self._ramp_result(name, f, False))
+				if futures is not None:
+					futures[name] = future
+				return value
+
+		elif 'maxstep' in p and p['maxstep'] is not None:
+			curval = p.get('value', None)
 			if curval is None:
 				logging.warning('Current value not available, ignoring maxstep')
 				curval = value + 0.01 * p['maxstep']
@@ -926,9 +1106,10 @@ class Instrument():
 
 
 		p['value'] = value
+		p['cache_timestamp'] = time.time()
 		return value
 
-	def set(self, name, value=None, fast=False, **kwargs):
+	def set(self, name, value=None, fast=False, wait=True, **kwargs):
 		'''
 		Set one or more Instrument parameter values.
 
@@ -941,6 +1122,8 @@ class Instrument():
 			value (any): the value to set
 			fast (bool): if True perform as fast as possible, e.g. don't
 				emit a signal to update the GUI.
+			wait (bool): if False, return without waiting for background
+				ramps (see set_parameter_rate)
 			kwargs: Optional keyword args that will be passed on.
 
 		Output: True or False whether the operation succeeded.
@@ -960,15 +1143,35 @@ class Instrument():
 		result = True
 		changed = {}
 		if type(name) == dict:
+			# parameters with a 'scpi_set' template are written in one message
+			batch = []
+			futures = {}
 			for key, val in name.items():
-				val = self._set_value(key, val, **kwargs)
+				# background ramps of all parameters are started before waiting
+				val = self._set_value(key, val, batch=batch, wait=False, futures=futures, **kwargs)
 				if val is not None:
 					changed[key] = val
 				else:
 					result = False
+			if len(batch):
+				try:
+					self.write_batch(batch)
+				except:
+					self.invalidate_cache()
+					raise
+			if wait:
+				# every ramp is waited for before the first error is re-raised
+				errors = []
+				for key, future in futures.items():
+					try:
+						self._ramp_result(key, future)
+					except BaseException as e:
+						errors.append(e)
+				if len(errors):
+					raise errors[0]
 
 		else:
-			val = self._set_value(name, value, **kwargs)
+			val = self._set_value(name, value, wait=wait, **kwargs)
 			if val is not None:
 				changed[name] = val
 			else:
@@ -980,6 +1183,15 @@ class Instrument():
 
 		return result
 
+	def write_batch(self, commands):
+		'''
+		Write several SCPI commands in one message and wait for their
+		completion. Used by set(dict) for parameters with a 'scpi_set'
+		template; drivers without a _visainstrument override this.
+		'''
+		message = ';'.join(':' + command.lstrip(':') for command in commands)
+		self._visainstrument.ask(message + ';*OPC?')
+
 	def update_value(self, name, value):
 		'''
 		Update a parameter value if new information is obtained.
@@ -993,6 +1205,7 @@ class Instrument():
 			return None
 
 		p['value'] = value
+		p['cache_timestamp'] = time.time()
 
 	def get_argspec_dict(self, a):
 		return dict(args=a[0], varargs=a[1], keywords=a[2], defaults=a[3])
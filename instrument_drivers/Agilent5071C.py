@@ -19,7 +19,7 @@
 
 from qsweepy.instrument import Instrument
 from matplotlib import pyplot as plt
-import visa
+from qsweepy import async_visa
 import types
 import logging
 from time import sleep
@@ -48,9 +48,10 @@ class AgilentE5071C(Instrument):
         Instrument.__init__(self, name, tags=['physical'])
 
         self._address = address
-        self._visainstrument = visa.ResourceManager().open_resource(self._address)# no term_chars for GPIB!!!!!
+        self._visainstrument = async_visa.open_resource(self._address)# no term_chars for GPIB!!!!!
 
         self._zerospan = False
+        self._data_format_set = False
         self._freqpoints = 0
         self._ci = channel_index
         self._start = 0
@@ -192,6 +193,7 @@ class AgilentE5071C(Instrument):
         self._visainstrument.write(":INIT:CONT ON")
         self.write("*ESE 1")
         self.set_average_mode(":POIN")
+        self.set_data_format()
 
 
     def post_sweep(self):
@@ -313,12 +315,60 @@ class AgilentE5071C(Instrument):
         if int(self.get_avg_status()) == 1: return True
         else: return False
 
+    def set_data_format(self, force=False):
+        '''
+        Selects little-endian 32-bit binary transfer of trace data. The format is kept by the instrument,
+        so it is sent only once (and again after a preset or with force=True).
+        '''
+        if force or not self._data_format_set:
+            self._visainstrument.write(':FORM:DATA REAL32;:FORM:BORD SWAP')
+            self._data_format_set = True
+
+    def operation_complete_timeout(self):
+        '''
+        Timeout of waiting for a sweep in s: the VISA timeout, or twice the time of the sweep and all its averages if
+        that is longer. An infinite (None) VISA timeout stays infinite.
+        '''
+        timeout = self._visainstrument.timeout
+        if timeout is None:
+            return None
+        sweeps = self.get_averages() if self.get_average() else 1
+        return max(timeout*1e-3, 2*sweeps*self.get_sweep_time()*1e-3)
+
+    def trigger_and_wait(self):
+        '''
+        Clears the status, triggers a single sweep (trigger source BUS, see pre_sweep) and waits for its completion
+        in a single command.
+        '''
+        timeout = self.operation_complete_timeout()
+        self._visainstrument.wait_operation_complete(timeout=timeout, command='*CLS;:TRIG:SING')
+
+    def read_sdata(self, query=None):
+        '''
+        Reads complex data of the active trace (or of the trace given by the query) as one binary block.
+        '''
+        self.set_data_format()
+        if query is None:
+            query = ':CALC%i:DATA:SDAT?' % self._ci
+        data = self._visainstrument.query_binary_values(query, datatype=u'f', container=numpy.array)
+        return numpy.asarray(data, dtype=numpy.float32).view(numpy.complex64).astype(complex)
+
     def get_data(self):
-        data = self._visainstrument.query_binary_values("CALCulate:DATA? SDATA", datatype=u'f')
-        data_size = numpy.size(data)
-        datareal = numpy.array(data[0:data_size:2])
-        dataimag = numpy.array(data[1:data_size:2])
-        return datareal+1j*dataimag
+        return self.read_sdata()
+
+    def get_tracedata_all(self):
+        '''
+        Triggers one sweep and reads the complex data of all traces of the channel.
+        The E5071C has no query for several traces at once, so every trace is read as a separate binary block.
+        For segmented sweeps all segments are contained in the traces.
+
+        Output:
+            complex array of shape (traces, nop)
+        '''
+        self.trigger_and_wait()
+        num_traces = int(self._visainstrument.ask(':CALC%i:PAR:COUN?' % self._ci))
+        return numpy.asarray([self.read_sdata(':CALC%i:TRAC%i:DATA:SDAT?' % (self._ci, trace))
+                              for trace in range(1, num_traces+1)])
 
     def get_tracedata(self, format = 'AmpPha'):
         '''
@@ -328,27 +378,10 @@ class AgilentE5071C(Instrument):
             format (string) : 'AmpPha': Amp in dB and Phase, 'RealImag',
 
         Output:
-            'AmpPha':_ Amplitude and Phase
-        '''
-        #Clear status, initiate measurement
-        self.write("*CLS")
-        self.init()
-        #Set bit in ESR when operation complete
-        #self.ask("*OPC?")
-        #Wait until ready and let plots to handle events (mouse drag and so on)
-        sleep(self.get_sweep_time()*0.001)
-        self.ask("*OPC?")
-
-        #self._visainstrument.write(':FORMAT REAL,32; FORMat:BORDer SWAP;')
-        #data = self._visainstrument.ask_for_values(':FORMAT REAL,32; FORMat:BORDer SWAP;*CLS; CALC:DATA? SDATA;*OPC',format=visa.single)
-        #data = self._visainstrument.ask_for_values(':FORMAT REAL,32;CALC:DATA? SDATA;',format=visa.double)
-        #data = self._visainstrument.ask_for_values('FORM:DATA REAL; FORM:BORD SWAPPED; CALC%i:SEL:DATA:SDAT?'%(self._ci), format = visa.double)
-        #test
-        self._visainstrument.write("FORM:DATA REAL32;")
-        self._visainstrument.write("FORM:BORD SWAP")
-
-        values = self._visainstrument.query_binary_values("CALC1:DATA:SDAT?")
-        return numpy.array(values)[0:-1:2] + 1j*numpy.array(values)[1::2]
+            complex data of the trace
+        '''
+        self.trigger_and_wait()
+        return self.read_sdata()
 
     def get_sweep_time(self):
         """
@@ -504,6 +537,10 @@ class AgilentE5071C(Instrument):
 
 #Frequency	
     def get_freqpoints(self):
+        if self.get_sweep_mode().strip().upper().startswith('SEGM'):
+            # segmented sweep: the stimulus values are not equidistant
+            self._freqpoints = numpy.asarray(self._visainstrument.query_ascii_values(':SENS%i:FREQ:DATA?' % self._ci))
+            return self._freqpoints
         self._start = self.get_startfreq()
         self._stop = self.get_stopfreq()
         self._nop = self.get_nop()
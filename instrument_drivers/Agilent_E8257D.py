@@ -30,8 +30,9 @@ class Agilent_E8257D(Instrument):
 	Initialize with
 	<name> = instruments.create('<name>', 'Agilent_E8257D', address='<GBIP address>, reset=<bool>')
 	'''
+	hardware_list_sweep = True
 
-	def __init__(self, name, address, reset=False):
+	def __init__(self, name, address, reset=False, cache_time=1.):
 		'''
 		Initializes the Agilent_E8257D, and communicates with the wrapper.
 
@@ -39,6 +40,10 @@ class Agilent_E8257D(Instrument):
 		  name (string)	   : name of the instrument
 		  address (string) : GPIB address
 		  reset (bool)	   : resets to default values, default=False
+		  cache_time (float) : validity of the cached frequency, power and
+			output status in s. Within it, sets of the cached value are
+			skipped and gets are answered from the cache, so that changes
+			from the front panel or other clients are seen after it.
 		'''
 		logging.info(__name__ + ' : Initializing instrument Agilent_E8257D')
 		Instrument.__init__(self, name, tags=['physical'])
@@ -48,16 +53,23 @@ class Agilent_E8257D(Instrument):
 		self._visainstrument = visa.ResourceManager().open_resource(self._address)
 
 		self.add_parameter('power',
-			flags=Instrument.FLAG_GETSET, units='dBm', minval=-20, maxval=18, type=float)
+			flags=Instrument.FLAG_GETSET|Instrument.FLAG_CACHE, units='dBm', minval=-20, maxval=18, type=float,
+			scpi_set='POW:AMPL {value}', cache_time=cache_time)
 		self.add_parameter('phase',
 			flags=Instrument.FLAG_GETSET, units='rad', minval=-numpy.inf, maxval=numpy.inf, type=float)
 		self.add_parameter('frequency',
-			flags=Instrument.FLAG_GETSET, units='Hz', minval=1e5, maxval=20e9, type=float)
+			flags=Instrument.FLAG_GETSET|Instrument.FLAG_CACHE, units='Hz', minval=1e5, maxval=20e9, type=float,
+			scpi_set='FREQ:CW {value}', cache_time=cache_time)
 		self.add_parameter('status',
-			flags=Instrument.FLAG_GETSET, type=bool)
+			flags=Instrument.FLAG_GETSET|Instrument.FLAG_CACHE, type=bool, scpi_set='OUTP {value:d}',
+			cache_time=cache_time)
 
 		self.add_function('reset')
 		self.add_function ('get_all')
+		self.add_function('set_frequency_list')
+		self.add_function('start_list_sweep')
+		self.add_function('send_sweep_trigger')
+		self.add_function('set_cw_mode')
 
 
 		if (reset):
@@ -77,6 +89,7 @@ class Agilent_E8257D(Instrument):
 		'''
 		logging.info(__name__ + ' : resetting instrument')
 		self._visainstrument.write('*RST')
+		self.invalidate_cache()
 		self.get_all()
 
 	def get_all(self):
@@ -213,6 +226,61 @@ class Agilent_E8257D(Instrument):
 		logging.debug(__name__ + ' : set status to %s' % status)
 		self._visainstrument.write('OUTP %s' % int(status))
 
+	def set_frequency_list(self, frequencies, powers=None, trigger_source='EXT', dwell=None):
+		'''
+		Programs a list sweep. The list is stepped by the point trigger, e.g. by the trigger output of a VNA
+		(see list_sweep.list_sweep), so that a whole frequency axis is acquired without a SCPI round-trip per point.
+
+		Input:
+			frequencies (list of float) : Frequencies in Hz
+			powers (list of float) : Powers in dBm, one per frequency (default: fixed power)
+			trigger_source (string) : point trigger, 'EXT', 'BUS' (see send_sweep_trigger) or 'IMM'
+			dwell (float) : dwell time per point in s, used with the 'IMM' trigger source
+
+		Output:
+			None
+		'''
+		logging.debug(__name__ + ' : set frequency list of %d points' % len(frequencies))
+		self._visainstrument.write(':LIST:TYPE LIST')
+		self._visainstrument.write(':LIST:FREQ ' + ','.join('%.3f' % f for f in frequencies))
+		if powers is not None:
+			if len(powers) != len(frequencies):
+				raise ValueError('set_frequency_list(): powers and frequencies must have the same length')
+			self._visainstrument.write(':LIST:POW ' + ','.join('%.3f' % p for p in powers))
+			self._visainstrument.write(':POW:MODE LIST')
+		else:
+			self._visainstrument.write(':POW:MODE FIX')
+		if dwell is not None:
+			self._visainstrument.write(':LIST:DWEL %g' % dwell)
+		self._visainstrument.write(':LIST:TRIG:SOUR %s' % trigger_source)
+		self._visainstrument.write(':TRIG:SOUR IMM')
+		self._visainstrument.write(':INIT:CONT OFF')
+		self._visainstrument.ask(':FREQ:MODE LIST;*OPC?')
+		# the list sweep moves the frequency and power
+		self.invalidate_cache('frequency')
+		self.invalidate_cache('power')
+
+	def start_list_sweep(self):
+		'''
+		Arms the list sweep programmed by set_frequency_list; the source goes to the first point of the list
+		and waits for point triggers.
+		'''
+		self._visainstrument.ask(':INIT;*OPC?')
+
+	def send_sweep_trigger(self):
+		'''
+		Steps the list sweep to the next point (trigger source 'BUS').
+		'''
+		self._visainstrument.write('*TRG')
+
+	def set_cw_mode(self):
+		'''
+		Returns from a list sweep to a fixed frequency and power.
+		'''
+		self._visainstrument.ask(':FREQ:MODE CW;:POW:MODE FIX;*OPC?')
+		self.invalidate_cache('frequency')
+		self.invalidate_cache('power')
+
 	# shortcuts
 	def off(self):
 		'''
@@ -19,7 +19,7 @@
 
 from qsweepy.instrument import Instrument
 from matplotlib import pyplot as plt
-import visa
+from qsweepy import async_visa
 import types
 import logging
 from time import sleep
@@ -48,9 +48,10 @@ class Agilent_N5242A(Instrument):
         Instrument.__init__(self, name, tags=['physical'])
 
         self._address = address
-        self._visainstrument = visa.ResourceManager().open_resource(self._address)# no term_chars for GPIB!!!!!
+        self._visainstrument = async_visa.open_resource(self._address)# no term_chars for GPIB!!!!!
 
         self._zerospan = False
+        self._data_format_set = False
         self._freqpoints = 0
         self._ci = channel_index
         self._start = 0
@@ -191,6 +192,7 @@ class Agilent_N5242A(Instrument):
         self.set_trigger_source("MAN")
         self.write("*ESE 1")
         self.set_average_mode("POIN")
+        self.set_data_format()
 
     def post_sweep(self):
         self.set_trigger_source("IMM")
@@ -306,12 +308,80 @@ class Agilent_N5242A(Instrument):
         if int(self.get_avg_status()) == 1: return True
         else: return False
 
+    def set_data_format(self, force=False):
+        '''
+        Selects little-endian 32-bit binary transfer of trace data. The format is kept by the instrument,
+        so it is sent only once (and again after a preset or with force=True).
+        '''
+        if force or not self._data_format_set:
+            self._visainstrument.write(':FORMAT REAL,32;FORMat:BORDer SWAP')
+            self._data_format_set = True
+
+    def operation_complete_timeout(self):
+        '''
+        Timeout of waiting for a sweep in s: the VISA timeout, or twice the time of the sweep and all its averages if
+        that is longer. An infinite (None) VISA timeout stays infinite.
+        '''
+        timeout = self._visainstrument.timeout
+        if timeout is None:
+            return None
+        sweeps = self.get_averages() if self.get_average() else 1
+        return max(timeout*1e-3, 2*sweeps*self.get_sweep_time()*1e-3)
+
+    def trigger_and_wait(self):
+        '''
+        Clears the status, starts a sweep and waits for its completion in a single command.
+        '''
+        timeout = self.operation_complete_timeout()
+        self._visainstrument.wait_operation_complete(timeout=timeout, command='*CLS;INIT:IMM')
+
+    def read_sdata(self, query='CALCulate:DATA? SDATA'):
+        '''
+        Reads complex data of the current trace (or of several traces, see get_tracedata_multi) as one binary block.
+        '''
+        self.set_data_format()
+        data = self._visainstrument.query_binary_values(query, datatype=u'f', container=numpy.array)
+        return numpy.asarray(data, dtype=numpy.float32).view(numpy.complex64).astype(complex)
+
     def get_data(self):
-        data = self._visainstrument.query_binary_values("CALCulate:DATA? SDATA", datatype=u'f')
-        data_size = numpy.size(data)
-        datareal = numpy.array(data[0:data_size:2])
-        dataimag = numpy.array(data[1:data_size:2])
-        return datareal+1j*dataimag
+        return self.read_sdata()
+
+    def get_tracedata_multi(self, measurement_numbers):
+        '''
+        Triggers one sweep and reads the complex data of several measurements of the channel in one binary block.
+        For segmented sweeps all segments are contained in the trace.
+
+        Input:
+            measurement_numbers (list of int) : measurement numbers (CALC:PAR:MNUM)
+
+        Output:
+            list of complex arrays, one per measurement
+        '''
+        self.trigger_and_wait()
+        data = self.read_sdata('CALC%i:DATA:MSD? "%s"' % (self._ci, ','.join(str(m) for m in measurement_numbers)))
+        return numpy.split(data, len(measurement_numbers))
+
+    def set_list_sweep_mode(self, nop, trigger_output=True):
+        '''
+        CW sweep of nop points at the current CW frequency, for hardware list sweeps of an external source
+        (see list_sweep.list_sweep). With trigger_output, the AUX1 trigger output sends a pulse after every point,
+        which steps the source to the next point of its list.
+
+        Input:
+            nop (int) : number of points of the list
+            trigger_output (bool) : enable the per-point trigger output
+
+        Output:
+            None
+        '''
+        self._visainstrument.write('SENS%i:SWE:TYPE CW' % self._ci)
+        self._visainstrument.write('SENS%i:SWE:POIN %i' % (self._ci, nop))
+        self._nop = nop
+        if trigger_output:
+            self._visainstrument.write('TRIG:CHAN%i:AUX1:INT POIN' % self._ci)
+            self._visainstrument.write('TRIG:CHAN%i:AUX1:POS AFT' % self._ci)
+        self._visainstrument.write('TRIG:CHAN%i:AUX1 %s' % (self._ci, 'ON' if trigger_output else 'OFF'))
+        self._visainstrument.ask('*OPC?')
 
     def get_tracedata(self, format = 'AmpPha'):
         '''
@@ -323,28 +393,11 @@ class Agilent_N5242A(Instrument):
         Output:
             'AmpPha':_ Amplitude and Phase
         '''
-        #Clear status, initiate measurement
-        self.write("*CLS")
-        self.init()
-        #Set bit in ESR when operation complete
-
-        self.write("*OPC")
-        self.write("*OPC?")
-        #Wait until ready and let plots to handle events (mouse drag and so on)
-        while int(self.ask("*ESR?"))==0:
-            sleep(0.002)
-
-        self._visainstrument.write(':FORMAT REAL,32; FORMat:BORDer SWAP;')
-        #data = self._visainstrument.ask_for_values(':FORMAT REAL,32; FORMat:BORDer SWAP;*CLS; CALC:DATA? SDATA;*OPC',format=visa.single)
-        #data = self._visainstrument.ask_for_values(':FORMAT REAL,32;CALC:DATA? SDATA;',format=visa.double)
-        #data = self._visainstrument.ask_for_values('FORM:DATA REAL; FORM:BORD SWAPPED; CALC%i:SEL:DATA:SDAT?'%(self._ci), format = visa.double)
-        #test
-        data = self._visainstrument.query_binary_values("CALCulate:DATA? SDATA", datatype=u'f')
-        data_size = numpy.size(data)
-        datareal = numpy.array(data[0:data_size:2])
-        dataimag = numpy.array(data[1:data_size:2])
-
-        #print datareal,dataimag,len(datareal),len(dataimag)
+        self.trigger_and_wait()
+        data = self.read_sdata()
+        datareal = numpy.real(data)
+        dataimag = numpy.imag(data)
+
         if format.upper() == 'REALIMAG':
             if self._zerospan:
                 return numpy.mean(datareal), numpy.mean(dataimag)
@@ -358,16 +411,7 @@ class Agilent_N5242A(Instrument):
                 datapha = numpy.arctan(dataimag/datareal)
                 return dataamp, datapha
             else:
-                dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
-                datapha = numpy.arctan2(dataimag,datareal)
-                #Unwrap
-            for i in range(0, len(datapha)-1 ):
-                if datapha[i+1]-datapha[i] >= numpy.pi:
-                    datapha[i+1] = datapha[i+1] - 2.*numpy.pi
-                elif datapha[i+1]-datapha[i] <= -numpy.pi:
-                    datapha[i+1] = datapha[i+1] + 2.*numpy.pi
-
-            return dataamp, datapha
+                return numpy.abs(data), numpy.unwrap(numpy.angle(data))
         else:
             raise ValueError('get_tracedata(): Format must be AmpPha or RealImag')
 
@@ -525,6 +569,10 @@ class Agilent_N5242A(Instrument):
 
 #Frequency	
     def get_freqpoints(self):
+        if self.get_sweep_mode().strip().upper().startswith('SEGM'):
+            # segmented sweep: the stimulus values are not equidistant
+            self._freqpoints = numpy.asarray(self._visainstrument.query_ascii_values('SENS%i:X?' % self._ci))
+            return self._freqpoints
         self._start = self.get_startfreq()
         self._stop = self.get_stopfreq()
         self._nop = self.get_nop()
@@ -541,8 +589,11 @@ class Agilent_N5242A(Instrument):
         return {'S-parameter':{'log': 20}}
 
     def measure(self):
-        data = self.get_tracedata(format='realimag')
-        return {'S-parameter':(data[0]+1j*data[1])}
+        self.trigger_and_wait()
+        data = self.read_sdata()
+        if self._zerospan:
+            data = numpy.mean(data)
+        return {'S-parameter':data}
 
     def set_xlim(self, start, stop):
         logging.debug(__name__ + ' : setting start freq to %s Hz' % start)
@@ -1,5 +1,5 @@
 from qsweepy.instrument import Instrument
-import visa
+from qsweepy import async_visa
 import types
 import logging
 from time import sleep
@@ -29,7 +29,7 @@ class Agilent_N9030A(Instrument):
 		Instrument.__init__(self, name, tags=['physical'])
 
 		self._address = address
-		self._visainstrument = visa.ResourceManager().open_resource(self._address)# no term_chars for GPIB!!!!!
+		self._visainstrument = async_visa.open_resource(self._address)# no term_chars for GPIB!!!!!
 		self._visainstrument.timeout = 400000
 		self._zerospan = False
 		self._freqpoints = 0
@@ -182,6 +182,17 @@ class Agilent_N9030A(Instrument):
 		if int(self.get_avg_status()) == 1: return True
 		else: return False 
 		
+	def operation_complete_timeout(self):
+		'''
+		Timeout of waiting for a sweep in s: the VISA timeout, or twice the time of the sweep and all its averages if
+		that is longer. An infinite (None) VISA timeout stays infinite.
+		'''
+		timeout = self._visainstrument.timeout
+		if timeout is None:
+			return None
+		sweeps = self.get_averages() if self.get_average() else 1
+		return max(timeout*1e-3, 2*sweeps*self.get_sweep_time()*1e-3)
+
 	def get_tracedata(self, format = 'AmpPha'):
 		'''
 		Get the data of the current trace
@@ -199,10 +210,12 @@ class Agilent_N9030A(Instrument):
 		self.init()
 			#Set bit in ESR when operation complete
 			
-		self.write("*OPC")
 		#Wait until ready and let plots to handle events (mouse drag and so on)
-		while int(self.ask("*ESR?"))==0:
+		timeout = self.operation_complete_timeout()
+		operation_complete = self._visainstrument.wait_operation_complete(timeout=timeout, block=False)
+		while not operation_complete.done():
 			plt.pause(0.05)
+		operation_complete.result()
 		
 		self._visainstrument.write(':FORMAT REAL,32; FORMat:BORDer SWAP;')
 		#data = self._visainstrument.ask_for_values(':FORMAT REAL,32; FORMat:BORDer SWAP;*CLS; CALC:DATA? SDATA;*OPC',format=visa.single) 
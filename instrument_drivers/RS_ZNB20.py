@@ -19,7 +19,7 @@
 
 from qsweepy.instrument import Instrument
 from matplotlib import pyplot as plt
-import visa
+from qsweepy import async_visa
 import types
 import logging
 from time import sleep
@@ -47,9 +47,10 @@ class RS_ZNB20(Instrument):
 		Instrument.__init__(self, name, tags=['physical'])
 
 		self._address = address
-		self._visainstrument = visa.ResourceManager().open_resource(self._address)# no term_chars for GPIB!!!!!
+		self._visainstrument = async_visa.open_resource(self._address)# no term_chars for GPIB!!!!!
 		
 		self._zerospan = False
+		self._data_format_set = False
 		self._freqpoints = 0
 		self._ci = channel_index 
 		self._start = 0
@@ -189,6 +190,7 @@ class RS_ZNB20(Instrument):
 		self.set_trigger_source("ON")
 		self.write("*ESE 1")
 		self.set_average_mode("POIN")
+		self.set_data_format()
 	
 	def post_sweep(self):
 		self.set_trigger_source("OFF")
@@ -304,13 +306,56 @@ class RS_ZNB20(Instrument):
 		if int(self.get_avg_status()) == 1: return True
 		else: return False 
 		
+	def set_data_format(self, force=False):
+		'''
+		Selects little-endian 32-bit binary transfer of trace data. The format is kept by the instrument,
+		so it is sent only once (and again after a preset or with force=True).
+		'''
+		if force or not self._data_format_set:
+			self._visainstrument.write(':FORMAT REAL,32;FORMat:BORDer SWAP')
+			self._data_format_set = True
+
+	def operation_complete_timeout(self):
+		'''
+		Timeout of waiting for a sweep in s: the VISA timeout, or twice the time of the sweep and all its averages if
+		that is longer. An infinite (None) VISA timeout stays infinite.
+		'''
+		timeout = self._visainstrument.timeout
+		if timeout is None:
+			return None
+		sweeps = self.get_averages() if self.get_average() else 1
+		return max(timeout*1e-3, 2*sweeps*self.get_sweep_time()*1e-3)
+
+	def trigger_and_wait(self):
+		'''
+		Clears the status, starts a sweep and waits for its completion in a single command.
+		'''
+		timeout = self.operation_complete_timeout()
+		self._visainstrument.wait_operation_complete(timeout=timeout, command='*CLS;INIT:IMM')
+
+	def read_sdata(self, query='CALCulate:DATA? SDATA'):
+		'''
+		Reads complex data of the current trace (or of all traces, see get_tracedata_all) as one binary block.
+		'''
+		self.set_data_format()
+		data = self._visainstrument.query_binary_values(query, datatype=u'f', container=numpy.array)
+		return numpy.asarray(data, dtype=numpy.float32).view(numpy.complex64).astype(complex)
+
 	def get_data(self):
-		data = self._visainstrument.query_binary_values("CALCulate:DATA? SDATA", datatype=u'f') 
-		data_size = numpy.size(data)
-		datareal = numpy.array(data[0:data_size:2])
-		dataimag = numpy.array(data[1:data_size:2])
-		return datareal+1j*dataimag
-		
+		return self.read_sdata()
+
+	def get_tracedata_all(self):
+		'''
+		Triggers one sweep and reads the complex data of all traces of the channel in one binary block.
+		For segmented sweeps all segments are contained in the traces.
+
+		Output:
+			complex array of shape (traces, nop)
+		'''
+		self.trigger_and_wait()
+		data = self.read_sdata('CALC%i:DATA:CHAN:ALL? SDATA' % self._ci)
+		return numpy.reshape(data, (-1, self.get_nop()))
+
 	def get_tracedata(self, format = 'AmpPha'):
 		'''
 		Get the data of the current trace
@@ -321,27 +366,11 @@ class RS_ZNB20(Instrument):
 		Output:
 			'AmpPha':_ Amplitude and Phase
 		'''
-		#Clear status, initiate measurement
-		self.write("*CLS")
-		self.init()
-		#Set bit in ESR when operation complete
-		
-		self.write("*OPC")
-		#Wait until ready and let plots to handle events (mouse drag and so on)
-		while int(self.ask("*ESR?"))==0:
-			sleep(0.002)
-			
-		self._visainstrument.write(':FORMAT REAL,32; FORMat:BORDer SWAP;')
-		#data = self._visainstrument.ask_for_values(':FORMAT REAL,32; FORMat:BORDer SWAP;*CLS; CALC:DATA? SDATA;*OPC',format=visa.single) 
-		#data = self._visainstrument.ask_for_values(':FORMAT REAL,32;CALC:DATA? SDATA;',format=visa.double) 
-		#data = self._visainstrument.ask_for_values('FORM:DATA REAL; FORM:BORD SWAPPED; CALC%i:SEL:DATA:SDAT?'%(self._ci), format = visa.double)	  
-		#test
-		data = self._visainstrument.query_binary_values("CALCulate:DATA? SDATA", datatype=u'f') 
-		data_size = numpy.size(data)
-		datareal = numpy.array(data[0:data_size:2])
-		dataimag = numpy.array(data[1:data_size:2])
-		
-		#print datareal,dataimag,len(datareal),len(dataimag)
+		self.trigger_and_wait()
+		data = self.read_sdata()
+		datareal = numpy.real(data)
+		dataimag = numpy.imag(data)
+
 		if format.upper() == 'REALIMAG':
 			if self._zerospan:
 				return numpy.mean(datareal), numpy.mean(dataimag)
@@ -355,16 +384,7 @@ class RS_ZNB20(Instrument):
 				datapha = numpy.arctan(dataimag/datareal)
 				return dataamp, datapha
 			else:
-				dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
-				datapha = numpy.arctan2(dataimag,datareal)
-				#Unwrap
-			for i in range(0, len(datapha)-1 ):
-				if datapha[i+1]-datapha[i] >= numpy.pi:
-					datapha[i+1] = datapha[i+1] - 2.*numpy.pi
-				elif datapha[i+1]-datapha[i] <= -numpy.pi:
-					datapha[i+1] = datapha[i+1] + 2.*numpy.pi
-				
-			return dataamp, datapha
+				return numpy.abs(data), numpy.unwrap(numpy.angle(data))
 		else:
 			raise ValueError('get_tracedata(): Format must be AmpPha or RealImag') 
 	  
@@ -522,6 +542,10 @@ class RS_ZNB20(Instrument):
 		
 #Frequency	
 	def get_freqpoints(self):
+		if self.get_sweep_mode().strip().upper().startswith('SEGM'):
+			# segmented sweep: the stimulus values are not equidistant
+			self._freqpoints = numpy.asarray(self._visainstrument.query_ascii_values('CALC%i:DATA:STIM?' % self._ci))
+			return self._freqpoints
 		self._start = self.get_startfreq()
 		self._stop = self.get_stopfreq()
 		self._nop = self.get_nop()
@@ -538,8 +562,11 @@ class RS_ZNB20(Instrument):
 		return {'S-parameter':{'log': 20}}
 
 	def measure(self):
-		data = self.get_tracedata(format='realimag')
-		return {'S-parameter':(data[0]+1j*data[1])} 
+		self.trigger_and_wait()
+		data = self.read_sdata()
+		if self._zerospan:
+			data = numpy.mean(data)
+		return {'S-parameter':data}
 		
 	def set_xlim(self, start, stop):
 		logging.debug(__name__ + ' : setting start freq to %s Hz' % start)
@@ -6,6 +6,8 @@ MAXDESCRIPTORSIZE = 9
 
 
 class SignalCore_5502a():
+    # the SC5502A has no list sweep; set_frequency_list/send_sweep_trigger step through the list in software
+    hardware_list_sweep = False
 
     def search(self):
 
@@ -68,10 +70,32 @@ class SignalCore_5502a():
                 raise RuntimeError(msg)
 
         if "frequencies" in parameters_dict.keys():
-            pass  # we just ignore this option, be careful, there's no support for a list sweep in this source
+            self.set_frequency_list(parameters_dict["frequencies"], parameters_dict.get("powers"))
+
+    def set_frequency_list(self, frequencies, powers=None):
+        if powers is not None and len(powers) != len(frequencies):
+            raise ValueError('powers and frequencies must have the same length')
+        self._list_frequencies = list(frequencies)
+        self._list_powers = list(powers) if powers is not None else None
+        self._list_point = 0
+
+    def start_list_sweep(self):
+        self._list_point = 0
+        self._set_list_point()
 
     def send_sweep_trigger(self):
-        pass  # stub method
+        if not getattr(self, '_list_frequencies', None):
+            return
+        self._list_point = (self._list_point + 1) % len(self._list_frequencies)
+        self._set_list_point()
+
+    def _set_list_point(self):
+        self.set_frequency(self._list_frequencies[self._list_point])
+        if self._list_powers is not None:
+            self.set_power(self._list_powers[self._list_point])
+
+    def set_cw_mode(self):
+        self._list_frequencies = None
 
     def getTemperature(self, temperature):
         getTemperature = self._lib.sc5502a_GetTemperature(self._handle, byref(temperature))
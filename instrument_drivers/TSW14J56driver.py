@@ -20,6 +20,9 @@ from qsweepy import config
 
 #sys.path.append('C:\qtlab_replacement\qsweepy\instrument_drivers\_ADS54J40')
 
+class TSW14J56CaptureTimeout(Exception):
+	pass
+
 class TSW14J56_evm_reducer():
 	def __init__(self, adc):
 		self.adc = adc
@@ -32,6 +35,8 @@ class TSW14J56_evm_reducer():
 		self.cov_norms = {channel_id:1 for channel_id in range(4)}
 		self.cov_signals = {channel_id:None for channel_id in range(4)}
 		self.resultnumbers_dimension = 16
+		self.deferred_executor = None
+		self.deferred_result = None
 		#self.avg_cov_mode = 'norm_cmplx' ## normalized results in complex Volts, IQ
 
 	def get_clock(self):
@@ -93,28 +98,89 @@ class TSW14J56_evm_reducer():
 		return (opts)
 
 	def measure(self):
-		result = {}
-		if self.avg_cov:
-			avg_before =  {'avg_cov'+str(i):self.adc.get_cov_result_avg(i) for i in range(self.adc.num_covariances)}
-		if self.resultnumber:
-			resultnumbers_before = self.adc.get_resultnumbers()
+		self.join_deferred()
+		registers_before = self.capture_start_registers()
 		self.adc.capture(trig=self.trig, cov = (self.last_cov or self.avg_cov or self.resultnumber))
+		return self.capture_result(registers_before)
+
+	def measure_deferred_result(self, callback, args):
+		'''
+		Starts the capture (see TSW14J56_evm.capture_async) and returns without waiting for it to finish. The data is
+		read out on a worker thread and passed to callback(result, *args).
+
+		sweep(use_deferred=True) sets the parameters of the next point during the capture (e.g. uploads the next AWG
+		sequence), so the setters must not change the signal of a running capture. The next measurement waits for the
+		result of the previous one; errors of the readout are raised there or by join_deferred.
+		'''
+		from concurrent.futures import ThreadPoolExecutor
+		self.join_deferred()
+		registers_before = self.capture_start_registers()
+		capture = self.adc.capture_async(trig=self.trig, cov = (self.last_cov or self.avg_cov or self.resultnumber))
+		if self.deferred_executor is None:
+			self.deferred_executor = ThreadPoolExecutor(max_workers=1)
+		self.deferred_result = self.deferred_executor.submit(self.deferred_result_func, capture, registers_before,
+															 callback, args)
+
+	def deferred_result_func(self, capture, registers_before, callback, args):
+		capture.result()
+		callback(self.capture_result(registers_before), *args)
+
+	def join_deferred(self):
+		if self.deferred_result is not None:
+			deferred_result, self.deferred_result = self.deferred_result, None
+			deferred_result.result()
+
+	def capture_start_registers(self):
+		# the accumulating registers are read before and after the capture, each time as one register snapshot
+		if self.avg_cov or self.resultnumber:
+			return self.adc.get_cov_registers(cov=False, avg=self.avg_cov, numbers=self.resultnumber)
+
+	def capture_result(self, registers_before):
+		result = {}
 		if self.output_raw:
 			result.update({'Voltage':self.adc.get_data()})
+		if self.last_cov or self.avg_cov or self.resultnumber:
+			registers = self.adc.get_cov_registers(cov=self.last_cov, avg=self.avg_cov, numbers=self.resultnumber)
 		if self.last_cov:
-			result.update({'last_cov'+str(i):self.adc.get_cov_result(i)/self.cov_norms[i] for i in range(self.adc.num_covariances)})
+			result.update({'last_cov'+str(i):registers['cov'][i]/self.cov_norms[i] for i in range(self.adc.num_covariances)})
 		if self.avg_cov:
-			result_raw = {'avg_cov'+str(i):(self.adc.get_cov_result_avg(i)-avg_before['avg_cov'+str(i)])/self.cov_norms[i] for i in range(self.adc.num_covariances)}
+			result_raw = {'avg_cov'+str(i):(registers['avg'][i]-registers_before['avg'][i])/self.cov_norms[i] for i in range(self.adc.num_covariances)}
 			if self.avg_cov_mode == 'real':
 				result.update(result_raw)
 			elif self.avg_cov_mode == 'iq':
 				result.update({'avg_cov0': (result_raw['avg_cov0']+1j*result_raw['avg_cov1']),
 							   'avg_cov1': (result_raw['avg_cov2']+1j*result_raw['avg_cov3'])})
 		if self.resultnumber:
-			result.update({'resultnumbers': [a-b for a,b in zip(self.adc.get_resultnumbers(), resultnumbers_before)][:self.resultnumbers_dimension]})
+			result.update({'resultnumbers': (registers['numbers']-registers_before['numbers'])[:self.resultnumbers_dimension]})
 
 		return (result)
 
+	def supports_segmented(self):
+		'''
+		Whether measure_segmented can be used with the current outputs (see data_reduce.supports_segmented).
+		'''
+		return not (self.last_cov or self.avg_cov or self.resultnumber)
+
+	def measure_segmented(self, num_segments):
+		'''
+		Captures get_nums() repetitions of num_segments consecutive readout triggers (see pulses.set_seq_segmented)
+		in one acquisition and splits the raw data by segment.
+
+		The covariance accumulators and result counters of the FPGA sum over all triggers of a capture and cannot be
+		split by segment, so only the raw 'Voltage' output is supported.
+		'''
+		if not self.supports_segmented():
+			raise ValueError('Segmented acquisition supports only raw Voltage output, disable last_cov, avg_cov and resultnumber')
+		self.join_deferred()
+		nsegm = self.adc.nsegm
+		self.adc.nsegm = nsegm*num_segments
+		try:
+			self.adc.capture(trig=self.trig, cov=False)
+			data = reshape(self.adc.get_data(), (nsegm, num_segments, self.adc.nsamp))
+		finally:
+			self.adc.nsegm = nsegm
+		return [{'Voltage': data[:, segment_id, :]} for segment_id in range(num_segments)]
+
 	def set_feature_iq(self, feature_id, feature):
 		#self.avg_cov_mode = 'norm_cmplx'
 		feature = feature[:self.adc.ram_size]/np.max(np.abs(feature[:self.adc.ram_size]))
@@ -122,8 +188,8 @@ class TSW14J56_evm_reducer():
 		feature_real_int = np.asarray(np.real(feature), dtype=np.int16)
 		feature_imag_int = np.asarray(np.imag(feature), dtype=np.int16)
 
-		self.adc.set_ram_data([feature_real_int.tolist(),     (feature_imag_int).tolist()],  feature_id*2)
-		self.adc.set_ram_data([(feature_imag_int).tolist(),  (-feature_real_int).tolist()], feature_id*2+1)
+		self.adc.set_ram_data([feature_real_int,     feature_imag_int],  feature_id*2)
+		self.adc.set_ram_data([feature_imag_int,  -feature_real_int], feature_id*2+1)
 
 		self.cov_norms[feature_id*2] = np.sqrt(np.mean(np.abs(feature)**2))*2**13
 		self.cov_norms[feature_id*2+1] = np.sqrt(np.mean(np.abs(feature)**2))*2**13
@@ -141,25 +207,45 @@ class TSW14J56_evm_reducer():
 		feature_real_int = np.asarray(np.real(feature), dtype=np.int16)
 		feature_imag_int = np.asarray(np.imag(feature), dtype=np.int16)
 
-		self.adc.set_ram_data([feature_real_int.tolist(),    (feature_imag_int).tolist()],  feature_id)
+		self.adc.set_ram_data([feature_real_int,    feature_imag_int],  feature_id)
 		self.cov_norms[feature_id] = np.sqrt(np.mean(np.abs(feature)**2))*2**13
 
 	def disable_feature(self, feature_id):
-		self.adc.set_ram_data([np.zeros(self.adc.ram_size, dtype=np.int16).tolist(), np.zeros(self.adc.ram_size, dtype=np.int16).tolist()], feature_id)
+		self.adc.set_ram_data([np.zeros(self.adc.ram_size, dtype=np.int16), np.zeros(self.adc.ram_size, dtype=np.int16)], feature_id)
 		self.adc.set_threshold(thresh=1, ncov=feature_id)
 
 class TSW14J56_evm():
-	def __init__(self, fpga_config = True):
+	def __init__(self, fpga_config = True, reg_block_words = 1):
 		#Number of samples per channel
 		self.nsamp = 65536
 		self.nsegm = 1
 		#Capture timeout
 		self.timeout = 3
+		#Trigger period in seconds, used to estimate the capture duration (set by set_trig_src_period)
+		self.trigger_period = None
+		#Maximum interval between capture status polls in seconds
+		self.capture_poll_interval_max = 0.05
+		self.capture_executor = None
+		#Format of get_data output: 'complex' (complex128), 'complex64' or 'int16' (see get_data)
+		self.data_format = 'complex'
+		#Return the 'complex64' and 'int16' outputs of get_data in buffers that the next call overwrites, saving an
+		#allocation (and for 'int16' a copy) per capture. Only for callers that are done with the data by then.
+		self.reuse_data_buffers = False
+		self.data_buffer = None
+		self.data_buffer_complex = None
 		self.ram_size = 2048 #in words of 32
 		self.num_covariances = 4
 
 		self.usb_reboot_timeout = 10
 		self.debug_print = False
+		## number of 32-bit registers per control transfer in block register/RAM access (set_ram_data,
+		## get_data_RAM, get_cov_registers). Firmware with address auto-increment accepts a block per
+		## REG_READ/REG_WRITE request, the original FX3 firmware only one register. Block transfers are opt-in
+		## (reg_block_words > 1) until validated on the hardware: then check_reg_block_transfer runs once on
+		## connection (saving and restoring the first words of OnChip Memory 0) and falls back to 1 if blocks are not
+		## written and read back correctly.
+		self.reg_block_words = reg_block_words
+		self.ram_data_hashes = {} # hashes of the RAM contents loaded by set_ram_data, by ncov
 		#self.fpga_firmware = "_ADS54J40/qubit_daq.rbf"
 		self.fpga_firmware = config.get_config()['TSW14J56_firmware']
 		self.adc_reducer_hooks = []
@@ -200,6 +286,8 @@ class TSW14J56_evm():
 				self.fpga_config(firmware = firmware)
 
 		self.sync_req()
+		if self.reg_block_words > 1:
+			self.check_reg_block_transfer()
 
 	def get_clock(self):
 		###TODO: get this useless shit right
@@ -229,6 +317,7 @@ class TSW14J56_evm():
 
 	def system_reset(self):
 		self.write_reg(FX3_BASE, FX3_RST, 1)
+		self.ram_data_hashes = {}
 		return
 
 	def reset(self):
@@ -251,6 +340,7 @@ class TSW14J56_evm():
 		if res[0]==0:
 			raise Exception('TSW14J56: FPGA configuration failed!')
 		self.usb_reset()
+		self.ram_data_hashes = {}
 		checksum = zlib.crc32(firmware)
 		self.write_reg(0x10000, 20, checksum)
 
@@ -279,9 +369,69 @@ class TSW14J56_evm():
 		if(self.debug_print): print( "Read:", hex(Value), hex(Index), hex(data) )
 		return data
 
+	def write_reg_block(self, base, offset, data):
+		'''
+		Writes consecutive 32-bit registers starting from base+offset, reg_block_words registers per control transfer.
+
+		Input:
+			data: bytes, big-endian register values (4 bytes per register)
+		'''
+		block_size = 4*int(self.reg_block_words)
+		for block_start in range(0, len(data), block_size):
+			Value, Index = mk_val_ind((base + offset + block_start)<<2)
+			self.dev.ctrl_transfer(vend_req_dir.WR, vend_req.REG_WRITE, Value, Index, data[block_start:block_start+block_size])
+
+	def read_reg_block(self, base, offset, num_words):
+		'''
+		Reads num_words consecutive 32-bit registers starting from base+offset, reg_block_words registers per control
+		transfer.
+
+		Output:
+			data: bytes, big-endian register values (4 bytes per register)
+		'''
+		block_size = 4*int(self.reg_block_words)
+		data = bytearray()
+		for block_start in range(0, num_words*4, block_size):
+			Value, Index = mk_val_ind((base + offset + block_start)<<2)
+			block_length = len(range(block_start, num_words*4)[:block_size])
+			data += bytes(self.dev.ctrl_transfer(vend_req_dir.RD, vend_req.REG_READ, Value, Index, block_length))
+		return bytes(data)
+
+	def check_reg_block_transfer(self, num_words=16):
+		'''
+		Checks that the firmware supports block register transfers: writes a test pattern into the first num_words
+		words of OnChip Memory 0 with block transfers, reads it back both register by register and with block
+		transfers and restores the memory register by register. Sets reg_block_words to 1 if the check fails. Runs on
+		connection only if block transfers were requested (reg_block_words > 1).
+
+		Output:
+			True if block transfers are used
+		'''
+		if self.reg_block_words <= 1:
+			return False
+		original = [int(self.read_reg(RAM_BASE, word*4)) for word in range(num_words)]
+		pattern = (arange(num_words, dtype=uint32)*uint32(0x01020304)) ^ uint32(0xA5C30F96)
+		try:
+			self.write_reg_block(RAM_BASE, 0, pattern.astype(uint32odd).tobytes())
+			supported = [int(self.read_reg(RAM_BASE, word*4)) for word in range(num_words)] == pattern.tolist() and \
+				frombuffer(self.read_reg_block(RAM_BASE, 0, num_words), dtype=uint32odd).tolist() == pattern.tolist()
+		except Exception:
+			supported = False
+		finally:
+			# restored register by register, which works with any firmware
+			for word, value in enumerate(original):
+				self.write_reg(RAM_BASE, word*4, value)
+		if [int(self.read_reg(RAM_BASE, word*4)) for word in range(num_words)] != original:
+			warnings.warn('TSW14J56: OnChip Memory 0 was not restored after the block transfer check')
+			self.ram_data_hashes.pop(0, None)
+		if not supported:
+			warnings.warn('TSW14J56: firmware does not support block register transfers, using one register per transfer')
+			self.reg_block_words = 1
+		return supported
+
 	def capture(self, trig = "man", cov = False, fifo = True):
 		'''
-		Function starts data acquisition
+		Function starts data acquisition and waits until it is finished
 
 		Input:
 			trig: Way to trigger acquisition process: 'man' - after using the function, 'ext' - after external trigger occures
@@ -291,6 +441,37 @@ class TSW14J56_evm():
 		Output:
 			None
 		'''
+		if self.capture_start(trig, cov, fifo):
+			self.capture_wait()
+
+	def capture_async(self, trig = "man", cov = False, fifo = True):
+		'''
+		Function starts data acquisition and returns without waiting for it to finish, so that the triggering
+		instruments can be set up during the capture
+
+		Input:
+			see capture
+
+		Output:
+			future: concurrent.futures.Future that is done when the capture is finished (raises TSW14J56CaptureTimeout
+			on timeout)
+		'''
+		from concurrent.futures import ThreadPoolExecutor, Future
+		if not self.capture_start(trig, cov, fifo):
+			future = Future()
+			future.set_result(None)
+			return future
+		if self.capture_executor is None:
+			self.capture_executor = ThreadPoolExecutor(max_workers=1)
+		return self.capture_executor.submit(self.capture_wait)
+
+	def capture_start(self, trig = "man", cov = False, fifo = True):
+		'''
+		Function arms the data acquisition, see capture
+
+		Output:
+			started: False if trig is unknown and the acquisition has not been started
+		'''
 		self.write_reg(CAP_BASE, CAP_SEGM_NUM, int(self.nsegm))
 		if (cov):
 			self.write_reg(CAP_BASE, COV_LEN, int(self.nsamp/8))
@@ -302,62 +483,110 @@ class TSW14J56_evm():
 			self.write_reg(CAP_BASE, CAP_CTRL, 1<<CAP_CTRL_START |fifo << FIFO_ST )
 		elif(trig == "ext"):
 			self.write_reg(CAP_BASE, CAP_CTRL, 1<<CAP_CTRL_START| 1<<CAP_CTRL_EXT_TRIG |cov << COV_ST |fifo << FIFO_ST)
-		else: return
+		else: return False
+		self.capture_start_time = time.time()
+		return True
 
-		t1 = time.time()
+	def capture_wait(self):
+		'''
+		Function waits for the acquisition started by capture_start to finish. If the trigger period is known,
+		the status register is first polled after the expected capture duration (nsegm trigger periods);
+		the interval between polls then grows up to capture_poll_interval_max.
+		'''
+		expected_duration = self.nsegm*self.trigger_period if self.trigger_period else 0
+		timeout = self.timeout + 2*expected_duration
+		time_left = self.capture_start_time + expected_duration - time.time()
+		if time_left > 0:
+			time.sleep(time_left)
+		poll_interval = 1e-3
 		while(1):
 			if( not( self.read_reg(CAP_BASE, CAP_CTRL) & 1<<CAP_CTRL_BUSY ) ):
 				break
 			else:
 				if(self.debug_print): print("Busy..")
 
-			if(time.time()-t1>self.timeout):
-				print ("Capture failed")
-				break
+			if(time.time()-self.capture_start_time>timeout):
+				raise TSW14J56CaptureTimeout('TSW14J56: capture not finished in {:.3g} s'.format(timeout))
+			time.sleep(poll_interval)
+			poll_interval = poll_interval*2 if poll_interval*2 < self.capture_poll_interval_max else self.capture_poll_interval_max
 		if(self.debug_print): print("Done!")
 
 	def get_data(self):
 		'''
 		Transfer data from DDR
+
+		The data is read into a preallocated buffer that is reused by the next get_data call. The returned array is
+		new unless reuse_data_buffers is set.
+
+		Output:
+			data: array of shape (nsegm, nsamp) depending on data_format:
+				'complex': complex128 array of ADC counts
+				'complex64': complex64 array of ADC counts (with reuse_data_buffers, overwritten by the next call)
+				'int16': int16 array of shape (nsegm, nsamp, 2), with the imaginary part in [..., 0] and the real part
+				in [..., 1] (with reuse_data_buffers, a zero-copy view of the raw buffer overwritten by the next call)
 		'''
+		import array
 		#Number of samples per channel to read
 		nsegm = self.nsegm
 		if self.nsegm ==0:
 			nsegm = 1
 		data_len = self.nsamp*nsegm
+		# pyusb reads directly into an array.array of the right size
+		if self.data_buffer is None or len(self.data_buffer) != data_len*2:
+			self.data_buffer = array.array('h', bytes(data_len*4))
+			self.data_buffer_complex = None
 		self.write_reg(FX3_BASE, FX3_LEN, int(data_len/16))
 		#Trigger DDR read
 		self.write_reg(FX3_BASE, FX3_CTRL, FX3_CTRL_START)
-		data = frombuffer(self.dev.read(endpoints.IN, data_len*4), dtype = dtype(int16))
-
-		data = reshape(data, (data_len, 2))
-		return reshape(data.T[1,:],(self.nsegm, self.nsamp))+1j*reshape(data.T[0,:], (self.nsegm, self.nsamp))
+		bytes_read = self.dev.read(endpoints.IN, self.data_buffer)
+		if bytes_read != data_len*4:
+			raise Exception('TSW14J56: DDR read returned {} bytes instead of {}'.format(bytes_read, data_len*4))
+
+		data = reshape(frombuffer(self.data_buffer, dtype = dtype(int16)), (nsegm, self.nsamp, 2))
+		if self.data_format == 'int16':
+			return data if self.reuse_data_buffers else data.copy()
+		if self.data_format == 'complex64' and self.reuse_data_buffers:
+			# the sample buffer is reused for any shape with the same size, the complex one only for the same shape
+			if self.data_buffer_complex is None or self.data_buffer_complex.shape != (nsegm, self.nsamp):
+				self.data_buffer_complex = empty((nsegm, self.nsamp), dtype=complex64)
+			result = self.data_buffer_complex
+		elif self.data_format == 'complex64':
+			result = empty((nsegm, self.nsamp), dtype=complex64)
+		else:
+			result = empty((nsegm, self.nsamp), dtype=complex)
+		result.real = data[:, :, 1]
+		result.imag = data[:, :, 0]
+		return result
 
 		#dataiq = reshape(data, (2, self.nsamp*self.nsegm))[0]+ 1j*reshape(data, (2, self.nsamp*self.nsegm))[1]
 		#return (reshape(dataiq, (self.nsegm, self.nsamp)))
 
-	def set_ram_data(self,data, ncov):
+	def set_ram_data(self, data, ncov, force=False):
 		'''
 		Function transfer data to FPGA's OnChip Memory
 
 		Input:
-			data: TO DO write a way to load data
+			data: pair of int16 sequences (the two 16-bit halves of each 32-bit RAM word)
 			ncov: Number of OnChip Memory to write the data (From 0 to 3)
+			force: upload even if the same data has already been loaded into this OnChip Memory
 		Output:
 			None
 		'''
-
-		data_RAMLOAD = []
 		### TODO: must be
 		if len(data[0]) > self.ram_size or len(data[1]) > self.ram_size:
 			raise ValueError('Cannot write segment larger than '+str(self.ram_size)+' as window function.')
 
-		for i in range(len(data[0])):
-				data_RAMLOAD.append(int(data[0][i]).to_bytes(2, byteorder = 'big', signed= True) + int(data[1][i]).to_bytes(2, byteorder = 'big', signed = True))
+		data_RAMLOAD = np.empty((len(data[0]), 2), dtype=dtype(int16).newbyteorder('>'))
+		data_RAMLOAD[:, 0] = data[0]
+		data_RAMLOAD[:, 1] = data[1]
+		data_RAMLOAD = data_RAMLOAD.tobytes()
 
-		for i in range(len(data[0])):
-			Value, Index = mk_val_ind((RAM_BASE + (i + ncov*self.ram_size)*4)<<2)
-			self.dev.ctrl_transfer(vend_req_dir.WR, vend_req.REG_WRITE, Value, Index, data_RAMLOAD[i])
+		data_hash = zlib.crc32(data_RAMLOAD)
+		if not force and self.ram_data_hashes.get(ncov) == (len(data_RAMLOAD), data_hash):
+			return
+		self.ram_data_hashes.pop(ncov, None)
+		self.write_reg_block(RAM_BASE, ncov*self.ram_size*4, data_RAMLOAD)
+		self.ram_data_hashes[ncov] = (len(data_RAMLOAD), data_hash)
 
 	def get_data_RAM(self, ncov):
 		'''
@@ -366,17 +595,13 @@ class TSW14J56_evm():
 		Input:
 			ncov: Number of OnChip Memory to write the data (From 0 to 3)
 		Output:
-			data: ...
+			data: int16 array of shape (ram_size, 2), the two 16-bit halves of each 32-bit RAM word
 		'''
-		data_RAM = []
 		dty = dtype(int16)
 		dty = dty.newbyteorder('>')
+		data_RAM = frombuffer(self.read_reg_block(RAM_BASE, ncov*self.ram_size*4, self.ram_size), dtype = dty)
 
-		for i in range(self.nsamp):
-			Value, Index = mk_val_ind((RAM_BASE + (i+ ncov*self.ram_size)*4)<<2)
-			data_RAM.append(frombuffer(self.dev.ctrl_transfer(vend_req_dir.RD, vend_req.REG_READ, Value, Index,4), dtype = dty))
-
-		return (data_RAM)
+		return reshape(data_RAM, (self.ram_size, 2))
 
 	def set_threshold(self, thresh, ncov):
 		'''
@@ -449,6 +674,29 @@ class TSW14J56_evm():
 		q = frombuffer(b1+b0, dtype = dt)[0]
 		return (q)
 
+	def get_cov_registers(self, cov=True, avg=True, numbers=True):
+		'''
+		Function reads the covariance, averaged covariance and result number registers of all discriminators as
+		register blocks (with reg_block_words large enough, one control transfer per block) and decodes them at once
+
+		Input:
+			cov, avg, numbers: which register blocks to read
+		Output:
+			registers: dict with 'cov' and 'avg' (int64 arrays of num_covariances values, same as get_cov_result and
+			get_cov_result_avg) and 'numbers' (int32 array of 16 values, same as get_resultnumbers)
+		'''
+		## 64-bit results are split into a block of low words followed by a block of high words (COV_*_SUBBASE)
+		word = dtype(uint32).newbyteorder('>')
+		cov_dtype = dtype([('lo', word, (4,)), ('hi', word, (4,))])
+		registers = {}
+		for name, base, read in [('cov', COV_RES_BASE, cov), ('avg', COV_RESAVG_BASE, avg)]:
+			if read:
+				block = frombuffer(self.read_reg_block(CAP_BASE, base, 8), dtype=cov_dtype)[0]
+				registers[name] = ((block['hi'].astype(uint64) << uint64(32)) | block['lo'].astype(uint64)).view(int64)[:self.num_covariances]
+		if numbers:
+			registers['numbers'] = frombuffer(self.read_reg_block(CAP_BASE, COV_NUMB_BASE, 16), dtype=dtype(int32).newbyteorder('>')).astype(int32)
+		return registers
+
 	def get_resultnumbers(self):
 		'''
 		Function returns amount of times each discrimination result happens
@@ -474,6 +722,7 @@ class TSW14J56_evm():
 			period: int Period in clock cycles (125 MHz)
 		'''
 		period = int(period)
+		self.trigger_period = period/125e6
 		self.write_reg(TRIG_SRC_BASE, TRIG_SRC_PERIOD_LO, period)
 		self.write_reg(TRIG_SRC_BASE, TRIG_SRC_PERIOD_HI, period>>32)
 		self.write_reg(TRIG_SRC_BASE, TRIG_SRC_CTRL, 1<<TRIG_SRC_CTRL_UPDATE)
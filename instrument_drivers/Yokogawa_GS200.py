@@ -18,7 +18,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 from qsweepy.instrument import Instrument
-import visa
+from qsweepy import async_visa
 import types
 import time
 import logging
@@ -58,8 +58,7 @@ class Yokogawa_GS210(Instrument):
         '''Create a default Yokogawa_GS210 object as a current source'''
         Instrument.__init__(self, 'Yokogawa_GS210', tags=['physical'])
         self._address = address
-        rm = visa.ResourceManager()
-        self._visainstrument = rm.open_resource(self._address)
+        self._visainstrument = async_visa.open_resource(self._address)
 
         current_range = (-200e-3, 200e-3)
         voltage_range = (-32, 32)
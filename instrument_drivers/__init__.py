@@ -1,3 +1,11 @@
 import pkgutil
+from qsweepy.lazy_import import lazy_module
 #from . import * 
-__all__ = [name for loader, name, is_pkg in pkgutil.walk_packages(__path__)]
\ No newline at end of file
+__all__ = [name for loader, name, is_pkg in pkgutil.iter_modules(__path__)]
+
+
+def __getattr__(name):
+    # driver modules are imported on first use, see qsweepy.lazy_import
+    if name in __all__:
+        return lazy_module(__name__ + '.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -1,20 +1,34 @@
 from qsweepy.instrument import Instrument
-import visa
+from qsweepy import async_visa
+from qsweepy.ramp import RampScheduler
 import numpy
 import time
 
 class nndac(Instrument):
 	def __init__(self, resource):
 		self._resource = resource
-		self._visainstrument = visa.ResourceManager().open_resource(self._resource)
-		self._visainstrument.write_termination = '\n'
-		self._visainstrument.read_termination = '\n'
-		self._visainstrument.timeout = 10000 
+		self._visainstrument = None
+		self.connect()
 		self.max_abs = 4.094
 		self.step = 0.002
 		self.cached_voltages = [self.get_voltage(channel=i) for i in range(24)]
 		self.use_cache = True
+		self.ramps = RampScheduler()
 	
+	def connect(self):
+		'''
+		Opens the VISA resource. On reconnection, closes the previous connection and its I/O thread first.
+		'''
+		if self._visainstrument is not None:
+			try:
+				self._visainstrument.close()
+			except Exception:
+				pass # the connection is broken
+		self._visainstrument = async_visa.open_resource(self._resource)
+		self._visainstrument.write_termination = '\n'
+		self._visainstrument.read_termination = '\n'
+		self._visainstrument.timeout = 10000
+
 	def set_voltage(self,value,channel):
 		if numpy.abs(value) < self.max_abs:
 			#print ('Channel {}, current voltage: {}, setting: {}'.format(channel_number, self.cached_voltages[channel_number], value))
@@ -22,7 +36,7 @@ class nndac(Instrument):
 				self._visainstrument.ask('VOLT {:d},{:f}'.format(channel,value))
 			except:
 				time.sleep(1)
-				self._visainstrument = visa.ResourceManager().open_resource(self._resource)
+				self.connect()
 				time.sleep(1)
 				self._visainstrument.ask('VOLT {:d},{:f}'.format(channel,value))
 			self.cached_voltages[channel] = value
@@ -32,25 +46,31 @@ class nndac(Instrument):
 			return(float(self._visainstrument.ask('VOLT {:d}?'.format(channel))))
 		except:
 			time.sleep(1)
-			self._visainstrument = visa.ResourceManager().open_resource(self._resource)
+			self.connect()
 			time.sleep(1)
 			return(float(self._visainstrument.ask('VOLT {:d}?'.format(channel))))
 
 	def get_voltage_cache(self, channel):
 		return self.cached_voltages[channel]
 		
-	def set_voltage_safe(self, value, channel):
-		if value == self.get_voltage_cache(channel):
+	def set_voltage_safe(self, value, channel, wait=True):
+		'''
+		Ramps the voltage of a channel in steps of 32*step with 10 ms delay in the background thread of self.ramps.
+		Ramps of different channels run concurrently; with wait=False the function returns immediately and
+		ramp_done()/the returned future wait for the target.
+
+		Returns: concurrent.futures.Future, or None if the channel is already at the target
+		'''
+		if value == self.get_voltage_cache(channel) and not self.ramps.is_ramping(channel):
 			return
-		#print type(self.get_voltage_cache(channel_number))
-		while numpy.abs(self.get_voltage_cache(channel) - value)>self.step:
-			#if numpy.abs(self.get_voltage_cache(channel_number)) > numpy.abs(value):
-			step_abs = self.step*32.
-			if step_abs < self.step: 
-				step_abs = self.step
-			if step_abs > numpy.abs(value - self.get_voltage_cache(channel)):
-				step_abs = numpy.abs(value - self.get_voltage_cache(channel))
-			step_sign = numpy.sign(value - self.get_voltage_cache(channel))
-			self.set_voltage(channel, self.get_voltage_cache(channel)+step_abs*step_sign)
-			print ('step_abs: ', step_abs, 'step_sign: ', step_sign)
-			time.sleep(0.01)
\ No newline at end of file
+		future = self.ramps.ramp(channel, self.get_voltage_cache(channel), value, self.step*32.,
+								 lambda v: self.set_voltage(v, channel), step_delay=0.01)
+		if wait:
+			future.result()
+		return future
+
+	def ramp_done(self, channels=None):
+		'''
+		Awaitable that is done when the ramps of the channels (default: all) are finished.
+		'''
+		return self.ramps.ramp_done(channels)
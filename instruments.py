@@ -2,22 +2,276 @@
 Description:
 	Loading all modules and subpackages from qsweepy.instrument_drivers package omitting module's
 	members which name starts with "__"
+
+	The driver modules are imported on first use: their members are found by parsing the module
+	sources. Classes and functions defined by a driver are bound to lazy_import.LazyMember proxies,
+	which import the driver when they are called, subclassed or their attributes are accessed.
+	Constants (literals and arithmetic of literals and other constants, e.g. register values) are
+	bound to their values, modules to the modules themselves (lazy_import.lazy_module). Names that a
+	driver imports from qsweepy modules are bound like in these modules (star imports of qsweepy
+	modules are followed through their sources), so that e.g. Instrument can be used without
+	importing the instrument libraries of any driver.
+
+	All other names (other assignments, names a driver imports from other packages, e.g.
+	"from time import sleep" or "from numpy import *") are not proxied: they are looked up by
+	importing the module that defines them on first access. "from qsweepy.instruments import *"
+	looks them up for the drivers whose packages are installed; names that fail to import are left
+	out, as the names of drivers that failed to import were before.
 """
 
-__all__ = []
+import ast
+import importlib
+import importlib.machinery
+import importlib.util
+import operator
 import pkgutil
-import inspect
+import sys
 import qsweepy.instrument_drivers
+from qsweepy.lazy_import import LazyMember, lazy_module
+
+
+class _Deferred:
+	"""
+	Member name of module that is looked up by importing the module on first access. installed is
+	False if a package imported by the module that binds the name is missing.
+	"""
+	def __init__(self, module, name, installed=True):
+		self.module = module
+		self.name = name
+		self.installed = installed
+
+	def resolve(self):
+		module = importlib.import_module(self.module)
+		try:
+			return getattr(module, self.name)
+		except AttributeError:
+			# from package import submodule
+			return importlib.import_module(self.module + '.' + self.name)
+
+
+def _is_qsweepy(module_name):
+	return module_name.split('.')[0] == 'qsweepy'
+
+
+def _spec(module_name):
+	"""
+	Spec of a module, found without executing the module or its parent packages, or None.
+	"""
+	if module_name in sys.modules:
+		return object.__getattribute__(sys.modules[module_name], '__spec__')
+	parent, _, child = module_name.rpartition('.')
+	if not parent:
+		try:
+			return importlib.util.find_spec(module_name)
+		except (ImportError, ValueError):
+			return None
+	parent_spec = _spec(parent)
+	if parent_spec is None or parent_spec.submodule_search_locations is None:
+		return None
+	return importlib.machinery.PathFinder.find_spec(module_name, parent_spec.submodule_search_locations)
+
+
+def _installed(tree):
+	"""
+	False if a package imported at the top level of the module tree is missing.
+	"""
+	for statement in tree.body:
+		if isinstance(statement, ast.Import):
+			names = [alias.name for alias in statement.names]
+		elif isinstance(statement, ast.ImportFrom) and not statement.level and statement.module != '__future__':
+			names = [statement.module]
+		else:
+			continue
+		for name in names:
+			if not _is_qsweepy(name) and _spec(name.partition('.')[0]) is None:
+				return False
+	return True
+
+
+def _rebind(member, installed):
+	# type instead of isinstance: isinstance executes lazy modules
+	if type(member) is _Deferred:
+		return _Deferred(member.module, member.name, member.installed and installed)
+	return member
+
+
+_parsed = {}
+
 
-for loader, name, is_pkg in pkgutil.walk_packages(qsweepy.instrument_drivers.__path__):
+def _module_members(module_name):
+	"""
+	Returns the members of a qsweepy module, found by parsing its source: a dict of names and their
+	LazyMember proxies, constant values, modules or _Deferred lookups, and a list of the other
+	modules that the module star-imports with the installed flags of the importing modules.
+	"""
+	if module_name in _parsed:
+		return _parsed[module_name]
+	members, stars = {}, []
+	_parsed[module_name] = members, stars # import cycles
+	spec = _spec(module_name)
+	if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+		return members, stars
+	with open(spec.origin, 'rb') as f:
+		tree = ast.parse(f.read(), spec.origin)
+	package = module_name if spec.origin.endswith('__init__.py') else module_name.rpartition('.')[0]
+	installed = _installed(tree)
+
+	def bind(name, member):
+		if not name.startswith('__'):
+			members[name] = member
+
+	def visit(statements, top_level):
+		for statement in statements:
+			if isinstance(statement, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+				bind(statement.name, LazyMember(module_name, statement.name))
+			elif isinstance(statement, (ast.Assign, ast.AnnAssign)):
+				targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+				value = _constant(statement.value, members) if top_level and statement.value is not None else None
+				for target in targets:
+					if isinstance(target, ast.Name) and value is not None:
+						bind(target.id, value)
+						continue
+					for node in ast.walk(target):
+						if isinstance(node, ast.Name):
+							bind(node.id, _Deferred(module_name, node.id, installed))
+			elif isinstance(statement, ast.Import):
+				for alias in statement.names:
+					name = alias.asname or alias.name.partition('.')[0]
+					if not top_level:
+						bind(name, _Deferred(module_name, name, installed))
+						continue
+					try:
+						bind(name, lazy_module(alias.name if alias.asname else name))
+					except (ImportError, ValueError):
+						pass # not installed, the driver fails on import
+			elif isinstance(statement, ast.ImportFrom):
+				if statement.module == '__future__':
+					continue
+				source = importlib.util.resolve_name('.'*statement.level + (statement.module or ''), package)
+				for alias in statement.names:
+					name = alias.asname or alias.name
+					if not top_level:
+						if alias.name != '*':
+							bind(name, _Deferred(module_name, name, installed))
+					elif alias.name == '*':
+						if _is_qsweepy(source):
+							source_members, source_stars = _module_members(source)
+							for star_name, member in source_members.items():
+								if not star_name.startswith('_'):
+									bind(star_name, _rebind(member, installed))
+							stars.extend((star, star_installed and installed) for star, star_installed in source_stars)
+						else:
+							stars.append((source, installed))
+					elif _is_qsweepy(source) and alias.name in _module_members(source)[0]:
+						bind(name, _rebind(_module_members(source)[0][alias.name], installed))
+					elif (installed or _is_qsweepy(source)) and _spec(source + '.' + alias.name) is not None:
+						# from package import submodule
+						bind(name, lazy_module(source + '.' + alias.name))
+					else:
+						bind(name, _Deferred(source, alias.name, installed))
+			elif isinstance(statement, (ast.If, ast.Try, ast.With)):
+				for block in ('body', 'orelse', 'finalbody'):
+					visit(getattr(statement, block, []), False)
+				for handler in getattr(statement, 'handlers', []):
+					visit(handler.body, False)
+
+	visit(tree.body, True)
+	return members, stars
+
+
+_constant_operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+	ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+	ast.LShift: operator.lshift, ast.RShift: operator.rshift, ast.BitOr: operator.or_, ast.BitAnd: operator.and_,
+	ast.BitXor: operator.xor, ast.UAdd: operator.pos, ast.USub: operator.neg, ast.Invert: operator.invert}
+
+
+def _constant(node, members):
+	"""
+	Value of a literal, of a name bound to a constant or of arithmetic of constants, otherwise None.
+	"""
+	if isinstance(node, ast.Name):
+		value = members.get(node.id)
+		return value if type(value) in (int, float, complex, str, bytes) else None
+	if isinstance(node, ast.UnaryOp) and type(node.op) in _constant_operators:
+		operand = _constant(node.operand, members)
+		return None if operand is None else _constant_operators[type(node.op)](operand)
+	if isinstance(node, ast.BinOp) and type(node.op) in _constant_operators:
+		left, right = _constant(node.left, members), _constant(node.right, members)
+		if left is None or right is None or (isinstance(node.op, (ast.Pow, ast.LShift)) and abs(right) > 64):
+			return None
+		try:
+			return _constant_operators[type(node.op)](left, right)
+		except (TypeError, ValueError, ArithmeticError):
+			return None
 	try:
-		module = loader.find_module(name).load_module(name)
+		return ast.literal_eval(node)
+	except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+		return None
 
-		for member_name, value in inspect.getmembers(module):
-			if member_name.startswith('__'):
-				continue
-	
-			globals()[member_name] = value
-			__all__.append(member_name)
+
+_members = {}
+_stars = []
+for loader, name, is_pkg in pkgutil.iter_modules(qsweepy.instrument_drivers.__path__):
+	module_name = qsweepy.instrument_drivers.__name__ + '.' + name
+	try:
+		members, stars = _module_members(module_name)
+		_members.update(members)
+		_stars.extend(stars)
 	except Exception as e:
-		print('Failed loading module '+name+': ', e)
\ No newline at end of file
+		print('Failed loading module '+name+': ', e)
+
+_deferred = {name: member for name, member in _members.items() if type(member) is _Deferred}
+globals().update({name: member for name, member in _members.items() if name not in _deferred})
+
+
+def __getattr__(name):
+	if name == '__all__':
+		return _star_names()
+	if name in _deferred:
+		value = _deferred[name].resolve()
+	else:
+		for source, installed in _stars:
+			try:
+				module = importlib.import_module(source)
+			except Exception:
+				continue
+			if not name.startswith('_') and name in vars(module):
+				value = vars(module)[name]
+				break
+		else:
+			raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+	globals()[name] = value
+	return value
+
+
+def _star_names():
+	"""
+	Names bound by "from qsweepy.instruments import *". Looks up the names of the drivers whose packages
+	are installed that are not bound yet.
+	"""
+	names = [name for name in _members if name not in _deferred]
+	for name, member in _deferred.items():
+		if not member.installed:
+			continue
+		try:
+			globals()[name] = member.resolve()
+			names.append(name)
+		except Exception as e:
+			print('Failed loading '+name+' from '+member.module+': ', e)
+	bound = set(names)
+	for source, installed in _stars:
+		if not installed:
+			continue
+		try:
+			module = importlib.import_module(source)
+		except Exception as e:
+			print('Failed loading module '+source+': ', e)
+			continue
+		# vars instead of getattr: does not import the lazily loaded submodules of e.g. numpy
+		for name in getattr(module, '__all__', vars(module)):
+			if not name.startswith('_') and name in vars(module) and name not in bound:
+				globals()[name] = vars(module)[name]
+				names.append(name)
+				bound.add(name)
+	globals()['__all__'] = names
+	return names
@@ -0,0 +1,102 @@
+'''
+Lazy imports that keep the import of qsweepy cheap, including star imports of the package and of the instrument drivers.
+
+lazy_module returns a module that is executed on first attribute access (importlib.util.LazyLoader). The package
+__getattr__ uses it so that ``from qsweepy import *`` binds every module of the package without importing pony,
+plotly, exdir, scipy, sklearn or the instrument libraries.
+
+LazyMember stands for a module member, e.g. an instrument driver class. It imports the module when it is called,
+when one of its attributes is accessed, when it is used as a base class or in isinstance and issubclass:
+
+    Agilent_N5242A = LazyMember('qsweepy.instrument_drivers.Agilent_N5242A', 'Agilent_N5242A')
+    pna = Agilent_N5242A('pna', address=...)  # imports the driver
+    class N5242A_with_switch(Agilent_N5242A): ...  # a subclass of the driver class
+'''
+
+import importlib
+import importlib.machinery
+import importlib.util
+import sys
+
+
+def lazy_module(name):
+    '''
+    Returns the module name from sys.modules or, if it has not been imported yet, a module that is executed on first
+    attribute access. Import errors of the module are raised on first attribute access.
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        # the submodule is found on the path of the parent package without executing it (any attribute access of
+        # a lazy module but object.__getattribute__ executes it)
+        parent_spec = object.__getattribute__(lazy_module(parent), '__spec__')
+        spec = importlib.machinery.PathFinder.find_spec(name, parent_spec.submodule_search_locations)
+    else:
+        spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError('No module named {!r}'.format(name), name=name)
+    if spec.origin is None:
+        # namespace package, there is nothing to execute
+        return importlib.import_module(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+class LazyMember:
+    '''
+    Proxy of the member name of module (of the module itself if name is None) that is imported on first use.
+    '''
+    def __init__(self, module, name=None):
+        self._module = module
+        self._name = name
+        self._loaded = False
+        self._value = None
+
+    def load(self):
+        if not self._loaded:
+            module = importlib.import_module(self._module)
+            if self._name is None:
+                self._value = module
+            else:
+                try:
+                    self._value = getattr(module, self._name)
+                except AttributeError:
+                    # from package import submodule
+                    self._value = importlib.import_module(self._module + '.' + self._name)
+            self._loaded = True
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __mro_entries__(self, bases):
+        # class X(proxy): derives from the member itself
+        return (self.load(),)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self.load())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self.load())
+
+    def __getattr__(self, name):
+        if name in ('_module', '_name', '_loaded', '_value'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def __repr__(self):
+        if self._loaded:
+            return repr(self._value)
+        if self._name is None:
+            return '<lazy module {!r}>'.format(self._module)
+        return '<lazy {!r} from {!r}>'.format(self._name, self._module)
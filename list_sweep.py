@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class list_sweep:
+    '''
+    Measurer for two-tone spectroscopy with a hardware list sweep of the excitation source.
+
+    The frequency (and optionally power) list is programmed into the source once in pre_sweep. Each measure()
+    arms the list and runs a single CW sweep of the VNA with one point per list entry; the trigger output of the
+    VNA steps the source through its list. The excitation frequency axis is thus acquired in one VNA sweep and
+    appears in sweep() as a point axis of the measurer instead of a sweep parameter with a setter:
+
+        spectroscopy = list_sweep(pna, lo_ex, excitation_frequencies)
+        sweep(spectroscopy, (currents, set_current, 'Current', 'A'))
+
+    Sources without hardware list support (source.hardware_list_sweep is False) are stepped in software with one
+    single-point VNA sweep per list entry.
+    '''
+    def __init__(self, vna, source, frequencies, powers=None, axis_name='Excitation frequency',
+                 dataset_name='S-parameter', trigger_source='EXT'):
+        self.vna = vna
+        self.source = source
+        self.frequencies = np.asarray(frequencies)
+        self.powers = np.asarray(powers) if powers is not None else None
+        self.axis_name = axis_name
+        self.dataset_name = dataset_name
+        self.trigger_source = trigger_source
+        self.hardware = getattr(source, 'hardware_list_sweep', False)
+
+    def get_points(self):
+        return {self.dataset_name: [(self.axis_name, self.frequencies, 'Hz')]}
+
+    def get_dtype(self):
+        return {self.dataset_name: complex}
+
+    def get_opts(self):
+        return {self.dataset_name: self.vna.get_opts().get(self.dataset_name, {})}
+
+    def pre_sweep(self):
+        if hasattr(self.vna, 'pre_sweep'):
+            self.vna.pre_sweep()
+        if self.hardware:
+            self.vna.set_list_sweep_mode(len(self.frequencies), trigger_output=True)
+            self.source.set_frequency_list(self.frequencies, self.powers, trigger_source=self.trigger_source)
+        else:
+            self.vna.set_list_sweep_mode(1, trigger_output=False)
+            self.source.set_frequency_list(self.frequencies, self.powers)
+
+    def post_sweep(self):
+        self.source.set_cw_mode()
+        if hasattr(self.vna, 'post_sweep'):
+            self.vna.post_sweep()
+
+    def measure(self):
+        self.source.start_list_sweep()
+        if self.hardware:
+            self.vna.trigger_and_wait()
+            data = self.vna.read_sdata()
+        else:
+            data = np.empty(len(self.frequencies), dtype=complex)
+            for point in range(len(self.frequencies)):
+                if point:
+                    self.source.send_sweep_trigger()
+                self.vna.trigger_and_wait()
+                data[point] = np.mean(self.vna.read_sdata())
+        return {self.dataset_name: data}
@@ -0,0 +1,103 @@
+'''
+Live updates of running measurements.
+
+LiveUpdatePublisher is a set of sweep hooks (see Sweeper.publish_live_updates) that publishes only the newly
+measured points of every dataset to a channel, so that the cost of an update scales with the number of new points
+and not with the size of the dataset. Messages are dicts:
+
+    {'type': 'start', 'id': ..., 'measurement_type': ..., 'datasets': {name: {'parameters': [(name, values, unit)],
+                                                                            'dtype': ..., 'shape': ...}}}
+    {'type': 'update', 'id': ..., 'dataset': name, 'done_sweeps': ..., 'total_sweeps': ...,
+     'blocks': [{'index': sweep indices except the last, 'start': ..., 'stop': ..., 'axis': name of the last
+                 sweep parameter, 'x': its values in start:stop, 'data': data[index + (slice(start, stop), ...)]}]}
+    {'type': 'finish', 'id': ...}
+
+Consecutive points along the last sweep parameter are merged into one block. On the plot side,
+plotly_plot.live_update_traces turns update messages into extendTraces/patch updates.
+
+QueueChannel transports the messages through a multiprocessing queue to a viewer in another process.
+'''
+
+import multiprocessing
+import queue
+import numpy as np
+
+
+class QueueChannel:
+    def __init__(self, maxsize=0):
+        self.queue = multiprocessing.Queue(maxsize)
+
+    def publish(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            pass # the viewer is too slow; it catches up on reload from the file
+
+    def get(self, timeout=None):
+        '''
+        Returns the next message, or None after timeout seconds.
+        '''
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_all(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+
+def update_blocks(data, parameters, indeces):
+    '''
+    Groups the updated sweep indices into runs of consecutive indices of the last sweep parameter and
+    cuts the corresponding blocks from data.
+
+    :param data: dataset data, sweep dimensions first
+    :param parameters: sweep parameters (MeasurementParameter) of the dataset
+    :param indeces: list of updated sweep index tuples
+    '''
+    num_sweep = len(parameters)
+    if num_sweep == 0:
+        return [{'index': [], 'start': 0, 'stop': 0, 'axis': None, 'x': [], 'data': np.array(data)}]
+    runs = {}
+    for index in set(tuple(i) for i in indeces):
+        runs.setdefault(index[:-1], []).append(index[-1])
+    blocks = []
+    for prefix, last in sorted(runs.items()):
+        last = np.sort(last)
+        breaks = np.nonzero(np.diff(last) != 1)[0]+1
+        for run in np.split(last, breaks):
+            start, stop = int(run[0]), int(run[-1])+1
+            blocks.append({'index': list(prefix), 'start': start, 'stop': stop, 'axis': parameters[-1].name,
+                           'x': np.asarray(parameters[-1].values)[start:stop],
+                           'data': np.array(data[tuple(prefix)+(slice(start, stop), Ellipsis)])})
+    return blocks
+
+
+class LiveUpdatePublisher:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def on_start(self, state):
+        datasets = {}
+        for name, dataset in state.datasets.items():
+            datasets[name] = {'parameters': [(p.name, np.asarray(p.values), p.unit) for p in dataset.parameters],
+                              'dtype': str(dataset.data.dtype),
+                              'shape': dataset.data.shape}
+        self.channel.publish({'type': 'start', 'id': state.id, 'measurement_type': state.measurement_type,
+                              'datasets': datasets})
+
+    def on_update(self, state, indeces):
+        updated = getattr(state, 'updated_indeces', None) or [tuple(indeces)]
+        num_sweep = len(updated[0])
+        for name, dataset in state.datasets.items():
+            self.channel.publish({'type': 'update', 'id': state.id, 'dataset': name,
+                                  'done_sweeps': state.done_sweeps, 'total_sweeps': state.total_sweeps,
+                                  'blocks': update_blocks(dataset.data, dataset.parameters[:num_sweep], updated)})
+
+    def on_finish(self, state):
+        self.channel.publish({'type': 'finish', 'id': state.id})
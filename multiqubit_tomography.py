@@ -1,7 +1,30 @@
 from . import data_reduce
 import numpy as np
+import warnings
 from . import readout_classifier
 
+def project_density_matrix(rho):
+	'''
+	Closed-form maximum-likelihood estimate of a density matrix from a linear inversion result (Smolin, Gambetta &
+	Smith, PRL 108, 070502): the eigenvalues are projected onto the probability simplex scaled to the trace of rho,
+	the eigenvectors are kept.
+	'''
+	rho = (rho + np.conj(rho.T))/2
+	trace = np.real(np.trace(rho))
+	if not trace > 0: # no eigenvalue of the projection is positive (also for a nan reconstruction)
+		raise ValueError('Cannot project a density matrix with trace {} onto the physical states, '
+						 'the reconstruction is not normalizable'.format(trace))
+	eigenvalues, eigenvectors = np.linalg.eigh(rho)
+	eigenvalues = eigenvalues[::-1]
+	eigenvectors = eigenvectors[:, ::-1]
+	# Euclidean projection onto {l >= 0, sum(l) = trace}
+	cumulative = np.cumsum(eigenvalues) - trace
+	support = np.arange(1, len(eigenvalues)+1)
+	last_positive = np.nonzero(eigenvalues - cumulative/support > 0)[0][-1]
+	shift = cumulative[last_positive]/(last_positive+1)
+	eigenvalues = np.maximum(eigenvalues - shift, 0)
+	return (eigenvectors*eigenvalues) @ np.conj(eigenvectors.T)
+
 class multiqubit_tomography:
 	def __init__(self, measurer, pulse_generator, proj_seq, reconstruction_basis={}):
 		#self.sz_measurer = sz_measurer
@@ -30,6 +53,14 @@ class multiqubit_tomography:
 		self.output_mode = 'array'
 		self.reconstruction_output_mode = 'array'
 		self.reconstruction_type='cvxopt'
+		## acquire all projections in one segmented AWG upload and acquisition,
+		## requires pulse_generator.set_seq_segmented and measurer.measure_segmented. Batched measurers are
+		## data_reduce.data_reduce over a source with measure_segmented (e.g. SimulatedDigitizer) and
+		## TSW14J56_evm_reducer (also as the source of data_reduce) only with its raw 'Voltage' output (last_cov,
+		## avg_cov and resultnumber off), as the FPGA covariances and result counters sum over all segments. Other
+		## measurers (see data_reduce.supports_segmented) acquire one projection at a time, with a warning.
+		self.batched = False
+		self._reconstruction_cache = None
 
 	def get_points(self):
 		if self.output_mode == 'single':
@@ -62,58 +93,92 @@ class multiqubit_tomography:
 	def set_prepare_seq(self, seq):
 		self.prepare_seq = seq
 
-	def reconstruct(self, measurement_results):
-		from cvxpy import Variable, atoms, abs, reshape, Minimize, Problem, CVXOPT
-		from traceback import print_exc
-		reconstruction_operator_names = []
-		reconstruction_operators = []
-		basis_axes_names = self.reconstruction_basis.keys()
-		basis_vector_norms = np.asarray(
-			[np.linalg.norm(self.reconstruction_basis[r]['operator']) for r in basis_axes_names])
-
-		for reconstruction_operator_name, reconstruction_operator in self.reconstruction_basis.items():
-			reconstruction_operator_names.append(reconstruction_operator_name)
-			reconstruction_operators.append(reconstruction_operator['operator'])
-
-		reconstruction_matrix = []
-		for rot, projection in self.proj_seq.items():
-			for measurement_name, projection_operator in projection['operators'].items():
-				reconstruction_matrix.append([np.sum(projection_operator * np.conj(reconstruction_operator)) / np.sum(
-					np.abs(reconstruction_operator) ** 2) for reconstruction_operator in reconstruction_operators])
+	def invalidate_reconstruction(self):
+		'''
+		Drop the cached reconstruction operators. They are also rebuilt when the operators of proj_seq or
+		reconstruction_basis change (see reconstruction_key).
+		'''
+		self._reconstruction_cache = None
+
+	def reconstruction_key(self):
+		'''
+		Names and operators of proj_seq and reconstruction_basis, on which the reconstruction operators depend.
+		Compared by value, so that changes in place are noticed too.
+		'''
+		def operator_key(operator):
+			operator = np.asarray(operator)
+			return operator.shape, operator.dtype.str, operator.tobytes()
+		return (tuple((name, operator_key(basis['operator'])) for name, basis in self.reconstruction_basis.items()),
+				tuple((rot, name, operator_key(operator)) for rot, projection in self.proj_seq.items()
+					  for name, operator in projection['operators'].items()))
+
+	def get_reconstruction_operators(self):
+		'''
+		Builds (once for the current proj_seq and reconstruction_basis) the matrix that maps the reconstruction
+		basis coefficients onto the measured projections, its pseudo-inverse and, for reconstruction_type 'cvxopt',
+		a parametrized cvxpy problem that is solved for each new measurement vector without recompilation.
+		'''
+		key = self.reconstruction_key()
+		cache = getattr(self, '_reconstruction_cache', None)
+		if cache is not None and cache['key'] == key and (self.reconstruction_type != 'cvxopt' or 'problem' in cache):
+			return cache
 
+		basis_axes_names = list(self.reconstruction_basis.keys())
+		reconstruction_operators = np.asarray([self.reconstruction_basis[r]['operator'] for r in basis_axes_names])
+		projection_operators = np.asarray([projection_operator \
+								for projection in self.proj_seq.values() \
+									for projection_operator in projection['operators'].values()])
+
+		reconstruction_matrix = np.einsum('kab,jab->kj', projection_operators, np.conj(reconstruction_operators)) / \
+								np.sum(np.abs(reconstruction_operators)**2, axis=(1, 2))
 		reconstruction_matrix_pinv = np.linalg.pinv(reconstruction_matrix)
-		reconstruction_matrix = np.asarray(reconstruction_matrix)
+		matrix_size = int(np.round(np.sqrt(len(basis_axes_names))))
+
+		cache = {'key': key,
+				 'basis_axes_names': basis_axes_names,
+				 'reconstruction_matrix': reconstruction_matrix,
+				 'reconstruction_matrix_pinv': reconstruction_matrix_pinv,
+				 'matrix_size': matrix_size}
+
+		if self.reconstruction_type == 'cvxopt':
+			from cvxpy import Variable, Parameter, atoms, abs, reshape, Minimize, Problem
+			# the measurement vector is the only thing that changes between sweep points, so it is a Parameter
+			# and the problem is canonicalized only on the first solve
+			x = Variable(len(basis_axes_names), complex=True)
+			measurement = Parameter(reconstruction_matrix.shape[0], complex=True)
+			lstsq_objective = atoms.sum_squares(abs(np.asarray(reconstruction_matrix, dtype=complex) @ x - measurement))
+			x_reshaped = reshape(x, (matrix_size, matrix_size))
+			constraints = [x_reshaped >> 0, x_reshaped.H == x_reshaped]
+			cache.update({'x': x, 'measurement': measurement, 'problem': Problem(Minimize(lstsq_objective), constraints)})
+
+		self._reconstruction_cache = cache
 		self.reconstruction_matrix = reconstruction_matrix
 		self.reconstruction_matrix_pinv = reconstruction_matrix_pinv
+		return cache
 
-		projections = np.dot(reconstruction_matrix_pinv, measurement_results)
+	def reconstruct(self, measurement_results):
+		from traceback import print_exc
+		operators = self.get_reconstruction_operators()
+		basis_axes_names = operators['basis_axes_names']
+		measurement_results = np.asarray(measurement_results).ravel()
+
+		projections = np.dot(operators['reconstruction_matrix_pinv'], measurement_results)
 		reconstruction = {str(k):v for k,v in zip(basis_axes_names, projections)}
 
 		if self.reconstruction_type == 'cvxopt':
-			#x = cvxpy.Variable(len(projections), complex=True)
-			x = Variable(len(projections), complex=True)
-			rmat_normalized = np.asarray(reconstruction_matrix/np.mean(np.abs(measurement_results)), dtype=complex)
-			meas_normalized = np.asarray(measurement_results).ravel()/np.mean(np.abs(measurement_results))
-			#lstsq_objective = cvxpy.atoms.sum_squares(cvxpy.abs(rmat_normalized @ x - meas_normalized))
-			lstsq_objective = atoms.sum_squares(abs(rmat_normalized @ x - meas_normalized))
-			matrix_size = int(np.round(np.sqrt(len(projections))))
-			#x_reshaped = cvxpy.reshape(x, (matrix_size, matrix_size))
-			x_reshaped = reshape(x, (matrix_size, matrix_size))
-			psd_constraint = x_reshaped >> 0
-			hermitian_constraint = x_reshaped.H == x_reshaped
-			# Create two constraints.
-			constraints = [psd_constraint, hermitian_constraint]
-			# Form objective.
-			#obj = cvxpy.Minimize(lstsq_objective)
-			obj = Minimize(lstsq_objective)
-			# Form and solve problem.
-			prob = cvxpy.Problem(obj, constraints)
+			from cvxpy import CVXOPT
+			# normalize the measurement vector for conditioning; the PSD cone is invariant under positive scaling
+			scale = np.mean(np.abs(measurement_results))
+			operators['measurement'].value = np.asarray(measurement_results/scale, dtype=complex)
 			try:
-				prob.solve(solver=cvxpy.CVXOPT, verbose=True)
-				reconstruction = {str(k): v for k, v in zip(basis_axes_names, np.asarray(x.value))}
+				operators['problem'].solve(solver=CVXOPT, verbose=True)
+				reconstruction = {str(k): v*scale for k, v in zip(basis_axes_names, np.asarray(operators['x'].value))}
 			except ValueError as e:
 				print_exc()
-
+		elif self.reconstruction_type == 'eigenvalue_projection':
+			matrix_size = operators['matrix_size']
+			rho = project_density_matrix(np.reshape(projections, (matrix_size, matrix_size)))
+			reconstruction = {str(k): v for k, v in zip(basis_axes_names, rho.ravel())}
 
 		if self.reconstruction_output_mode == 'array':
 			it = np.nditer([self.reconstruction_output_array, None], flags=['refs_ok'], op_dtypes=(object, complex))
@@ -124,17 +189,33 @@ class multiqubit_tomography:
 
 		return reconstruction
 
+	def get_projection_seq(self, rot):
+		if 'pre_pulses' in self.proj_seq[rot]:
+			return self.proj_seq[rot]['pre_pulses']+self.prepare_seq+self.proj_seq[rot]['pulses']
+		else:
+			return self.prepare_seq+self.proj_seq[rot]['pulses']
+
 	def measure(self):
 		meas = {}
 		measurement_results = []
 		
 
-		for rot, projection in self.proj_seq.items():
-			if 'pre_pulses' in self.proj_seq[rot]:
-				self.pulse_generator.set_seq(self.proj_seq[rot]['pre_pulses']+self.prepare_seq+self.proj_seq[rot]['pulses'])
+		if self.batched and not data_reduce.supports_segmented(self.measurer):
+			warnings.warn('multiqubit_tomography.batched: {} cannot acquire segments with its current settings, '
+						  'measuring the projections one by one'.format(type(self.measurer).__name__))
+		if self.batched and data_reduce.supports_segmented(self.measurer):
+			# all pre-rotations go to the AWG as one segmented waveform and are read out in one acquisition
+			self.pulse_generator.set_seq_segmented([self.get_projection_seq(rot) for rot in self.proj_seq.keys()])
+			measurements = self.measurer.measure_segmented(len(self.proj_seq))
+		else:
+			measurements = None
+
+		for rot_id, (rot, projection) in enumerate(self.proj_seq.items()):
+			if measurements is not None:
+				measurement = measurements[rot_id]
 			else:
-				self.pulse_generator.set_seq(self.prepare_seq+self.proj_seq[rot]['pulses'])
-			measurement = self.measurer.measure()
+				self.pulse_generator.set_seq(self.get_projection_seq(rot))
+				measurement = self.measurer.measure()
 			#print (projection.keys())
 			measurement_ordered = [measurement[readout_name] for readout_name in self.readout_names]
 			#print (rot)
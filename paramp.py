@@ -4,6 +4,26 @@ import time
 import pickle
 
 
+def _interp_rows(x, xp, fp):
+	'''
+	np.interp(x[i], xp, fp[i]) for every row i of fp: the value of each row at its own point (e.g. the gain at the
+	target frequency of each row of a target frequency x probe frequency map).
+	'''
+	x = np.asarray(x, dtype=float)
+	xp = np.asarray(xp, dtype=float)
+	fp = np.asarray(fp)
+	if len(xp) == 1:
+		# a single probe frequency: np.interp returns its value everywhere
+		return fp[:, 0].copy()
+	right = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp)-1)
+	rows = np.arange(fp.shape[0])
+	left_values, right_values = fp[rows, right-1], fp[rows, right]
+	weight = np.clip((x-xp[right-1])/(xp[right]-xp[right-1]), 0, 1)
+	# exact hits of the grid points do not depend on the neighbouring (possibly nan) values, as in np.interp
+	return np.where(weight == 0, left_values,
+					np.where(weight == 1, right_values, left_values+weight*(right_values-left_values)))
+
+
 class paramp:
 	def __init__(self, vna, pump_src, bias_src):
 		self.vna = vna
@@ -25,6 +45,19 @@ class paramp:
 		self.hint_span_bw = 200.
 		self.optimize_pump_frequency = True
 		self.bounds = ((-np.inf, np.inf), (-np.inf, np.inf), (-np.inf, np.inf))
+		self.power_setter = None
+		self.settle_time = 0.2
+
+		# 'nelder-mead' (sweep.optimize) or 'surrogate' (surrogate_optimizer)
+		self.optimizer = 'nelder-mead'
+		# half-widths of the search box of the surrogate optimizer around the current pump frequency, pump power and bias
+		self.hint_search_ranges = (50e6, 5., 1e-4)
+		self.hint_batch_size = 1
+		self.hint_ei_threshold = 0. # dB of SNR, 0: until the trust region of the surrogate optimizer has converged
+		self.surrogate = None # surrogate_optimizer.gp_surrogate by default
+		self.hint_seed = None # of the random candidates of the surrogate optimizer
+		# evaluations (pump frequency, pump power, bias, cost in dB) by target frequency, reused by the surrogate optimizer
+		self.evaluations = {}
 
 		self.pump_on = True
 
@@ -66,23 +99,27 @@ class paramp:
 			self.bias_src.set_status(True)
 
 		def target():
-			time.sleep(0.2)
+			time.sleep(self.settle_time)
 			measurements = self.vna.measure()['S-parameter'].ravel()
 			print ('Gain, dB:', np.log10(np.abs(np.mean(measurements)))*20,
                    'SNR, dB:', np.log10(np.abs(np.mean(measurements))/np.std(measurements))*10)
 			return np.std(measurements)/np.abs(np.mean(measurements))
 
-		costs = {tuple([initial for setter, initial in params]): target()}
-		for restart_id in range(self.num_restarts):
-			initial_simplex = create_initial_simplex(params)
-			res = sweep.optimize(target, *params, initial_simplex=initial_simplex, maxfun=self.hint_maxfun, bounds=self.bounds)
-			for x, p in zip(res[0], params): p[0](x)
-			costs[tuple(res[0])] = target()
-			min_ = np.inf
-			for x, y in costs.items():
-				if y < min_:
-					argmin = x
-					params = [(p[0], v) for p, v in zip(params, argmin)]
+		if self.optimizer == 'surrogate':
+			argmin = self.optimize_surrogate(target, params)
+		else:
+			costs = {tuple([initial for setter, initial in params]): target()}
+			for restart_id in range(self.num_restarts):
+				initial_simplex = create_initial_simplex(params)
+				res = sweep.optimize(target, *params, initial_simplex=initial_simplex, maxfun=self.hint_maxfun, bounds=self.bounds)
+				for x, p in zip(res[0], params): p[0](x)
+				costs[tuple(res[0])] = target()
+				min_ = np.inf
+				for x, y in costs.items():
+					if y < min_:
+						min_ = y
+						argmin = x
+						params = [(p[0], v) for p, v in zip(params, argmin)]
 
 		# iterate over all restarts and find best
 
@@ -104,6 +141,52 @@ class paramp:
 			self.vna.post_sweep()
 		return measurement
 
+	def optimize_surrogate(self, target, params):
+		'''
+		Minimizes the cost (in dB) with surrogate_optimizer in the box of hint_search_ranges around the current
+		parameters, reusing the evaluations at the target frequency of earlier calls and of load_evaluations.
+		'''
+		from .surrogate_optimizer import surrogate_optimizer
+		ranges = self.hint_search_ranges if self.optimize_pump_frequency else self.hint_search_ranges[1:]
+		optimizer = surrogate_optimizer(lambda: 20*np.log10(target()),
+										*[(setter, initial, initial-r, initial+r) for (setter, initial), r in zip(params, ranges)],
+										surrogate=self.surrogate, batch_size=self.hint_batch_size,
+										ei_threshold=self.hint_ei_threshold, max_evaluations=self.hint_maxfun, seed=self.hint_seed)
+		for target_f, evaluations in self.evaluations.items():
+			if abs(target_f-self.target_f) <= self.target_bw:
+				evaluations = np.asarray(evaluations)
+				if not self.optimize_pump_frequency:
+					evaluations = evaluations[evaluations[:, 0] == self.target_f-self.target_bw*3, 1:]
+				optimizer.add_evaluations(evaluations[:, :-1], evaluations[:, -1])
+		previous = len(optimizer.y)
+		argmin, cost = optimizer.minimize()
+
+		evaluations = self.evaluations.setdefault(self.target_f, [])
+		for x, y in zip(optimizer.x[previous:], optimizer.y[previous:]):
+			pump_frequency = [] if self.optimize_pump_frequency else [self.target_f-self.target_bw*3]
+			evaluations.append(tuple(pump_frequency+list(x)+[y]))
+		return tuple(argmin)
+
+	def load_evaluations(self, measurement):
+		'''
+		Adds the operating points of a saved paramp measurement (a sweep of the target frequency, e.g. the
+		calibration of load_calibration) to the evaluations reused by the surrogate optimizer.
+		'''
+		target_frequencies = measurement.datasets['SNR'].parameters[0].values
+		bias = np.reshape(measurement.datasets['Bias'].data, (len(target_frequencies), -1))
+		pump_power = np.reshape(measurement.datasets['Pump_power'].data, bias.shape)
+		if 'Pump_frequency' in measurement.datasets:
+			pump_frequency = np.reshape(measurement.datasets['Pump_frequency'].data, bias.shape)
+		else:
+			pump_frequency = np.tile(np.reshape(target_frequencies, (-1, 1)), (1, bias.shape[1])) - \
+				3*float(measurement.metadata['target_bw'])
+		cost = -20*np.log10(np.abs(np.reshape(measurement.datasets['SNR'].data, bias.shape)))
+		for tf_id, target_f in enumerate(target_frequencies):
+			evaluations = self.evaluations.setdefault(target_f, [])
+			for point in zip(pump_frequency[tf_id], pump_power[tf_id], bias[tf_id], cost[tf_id]):
+				if np.all(np.isfinite(point)):
+					evaluations.append(point)
+
 	def set_target_f(self, value):
 		self.target_f = value
 
@@ -176,17 +259,9 @@ class paramp:
 			self.GN_target_frequencies = noise_powers[1][0]
 			self.GN_frequencies = noise_powers[1][1]
 			self.GN_P.append(10**(noise_powers[2]/10))
-		self.G = np.zeros_like(self.GN_P[0])
-		self.TN = np.zeros_like(self.GN_P[0])
-		self.G_1d = np.zeros(self.GN_target_frequencies.shape[0])
-		self.TN_1d = np.zeros(self.GN_target_frequencies.shape[0])
-		for tf_id, tf in enumerate(self.GN_target_frequencies):
-			gain, noise_T = self.gain_noise(self.GN_frequencies, np.asarray(self.GN_P)[:, tf_id,:], temp_files[0][0], temp_files[1][0], bw)
-			self.G[tf_id, :] = gain
-			self.TN[tf_id, :] = noise_T
-			self.G_1d[tf_id] = np.interp(tf, self.GN_frequencies, gain)
-			self.TN_1d[tf_id] = np.interp(tf, self.GN_frequencies, noise_T)
-			#print (noise_powers)
+		self.G, self.TN = self.gain_noise(self.GN_frequencies, np.asarray(self.GN_P), temp_files[0][0], temp_files[1][0], bw)
+		self.G_1d = _interp_rows(self.GN_target_frequencies, self.GN_frequencies, self.G)
+		self.TN_1d = _interp_rows(self.GN_target_frequencies, self.GN_frequencies, self.TN)
 
 		self.GN_meas = {'Gain frequency dependence': (('Target frequency', 'Probe frequency'),
 						 (self.GN_target_frequencies, self.GN_frequencies),
@@ -212,11 +287,8 @@ class paramp:
 		self.G_m = gain.T if transpose else gain
 		self.GN_m_target_frequencies = data_vna[1]['S-parameter'][1][0]
 		self.GN_m_probe_frequencies = data_vna[1]['S-parameter'][1][1]
-		self.G_m_1d = np.zeros(self.GN_m_target_frequencies.shape[0])
-		self.TN_m_1d = np.zeros(self.GN_m_target_frequencies.shape[0])
-		for tf_id, tf in enumerate(self.GN_m_target_frequencies):
-			self.G_m_1d[tf_id] = np.interp(tf, self.GN_m_probe_frequencies, gain[tf_id,:])
-			self.TN_m_1d[tf_id] = np.interp(tf, self.GN_m_probe_frequencies, noise_T[tf_id,:])
+		self.G_m_1d = _interp_rows(self.GN_m_target_frequencies, self.GN_m_probe_frequencies, gain)
+		self.TN_m_1d = _interp_rows(self.GN_m_target_frequencies, self.GN_m_probe_frequencies, noise_T)
 
 		self.off_gain_m = np.nanmedian(self.G_m)
 
@@ -249,9 +321,7 @@ class paramp:
 		pp[data_filt_uncompressed]=np.nan
 		pp_compression = np.nanmin(pp, axis=0)
 
-		compression_1db_1d = np.zeros(data[1]['S-parameter'][1][0].shape, dtype=float)
-		for tf_id, _tf in enumerate(data[1]['S-parameter'][1][0]):
-			compression_1db_1d[tf_id] = np.interp(_tf, data[1]['S-parameter'][1][2], pp_compression[tf_id,:])
+		compression_1db_1d = _interp_rows(data[1]['S-parameter'][1][0], data[1]['S-parameter'][1][2], pp_compression)
 
 		self.sat_1db_ft_freq = pp_compression
 		self.sat_1db_ft = compression_1db_1d
@@ -285,33 +355,32 @@ class paramp:
 		save_pkl.save_pkl(header, self.GN_m_meas, location=calibration_path)
 
 	def planck_function(self, f, Ts, gains):
+		'''
+		Noise power spectral density of a sum of thermal sources with temperatures Ts, weighted by gains, at
+		frequencies f (scalar or array of any shape).
+		'''
 		from scipy.constants import Planck, Boltzmann
-		return np.sum([Planck*f*(0.5+1./(np.exp(Planck*f/(Boltzmann*T))-1))*gain for T, gain in zip(Ts, gains)])
+		f = np.asarray(f, dtype=float)[..., np.newaxis]
+		Ts = np.asarray(Ts, dtype=float)
+		gains = np.asarray(gains, dtype=float)
+		return np.sum(Planck*f*(0.5+1./(np.exp(Planck*f/(Boltzmann*Ts))-1))*gains, axis=-1)
 
 	def gain_noise(self, f, P_meas, T1, T2, bw):
+		'''
+		Gain and noise temperature of the amplifier from the noise powers P_meas (in mW) measured in bandwidth bw with two
+		sets of input noise sources T1 and T2 (lists of (temperature, gain)).
+
+		The first axis of P_meas enumerates T1 and T2, the last axis the frequencies f. Other axes (target
+		frequencies, pump powers, biases) are solved at once: for every point the 2x2 system
+		P_meas = G*k*TN*bw + G*P_in*bw is solved in closed form.
+		'''
 		from scipy.constants import Boltzmann
-		G_ = np.zeros_like(f)
-		TN_ = np.zeros_like(f)
 		P_meas = np.asarray(P_meas)*1e-3
-		for f_id, f_ in enumerate(f):
-			P_in = [self.planck_function(f_,
-										 [t[0] for t in T1],
-										 [t[1] for t in T1]),
-					self.planck_function(f_,
-										 [t[0] for t in T2],
-										 [t[1] for t in T2])] # input noise powers
-			a = np.asarray([[1, P_in[0]*bw], [1, P_in[1]*bw]])
-			b = P_meas[:, f_id].T
-			#print (f_id, a.shape, b.shape)
-			solution = np.linalg.solve(a, b)
-			#print (solution)
-			#if (f_id<10):
-				#print (a,b, solution)
-			GkTNbw, G = solution
-			TN = GkTNbw/(Boltzmann*G*bw)
-			G_[f_id] = G
-			TN_[f_id] = TN
-		return G_, TN_
+		P_in = [self.planck_function(f, [t[0] for t in T], [t[1] for t in T])*bw for T in (T1, T2)] # input noise powers
+		G = (P_meas[1]-P_meas[0])/(P_in[1]-P_in[0])
+		GkTNbw = (P_in[1]*P_meas[0]-P_in[0]*P_meas[1])/(P_in[1]-P_in[0])
+		TN = GkTNbw/(Boltzmann*G*bw)
+		return G, TN
 
 	def set_target_freq_calib(self, f):
 		self.pump_src.set_frequency(self.pump_frequency_by_target_frequency(f))
@@ -4,6 +4,131 @@ import numpy as np
 from pony.orm import *
 import plotly.io as pio
 import pandas as pd
+import collections
+import glob
+import os
+import threading
+
+
+class MeasurementPool:
+	'''
+	Long-lived pool of lazily loaded measurements for the dash callbacks.
+
+	Measurements are keyed by Data.id and reloaded only if the modification time of their exdir files changes.
+	Decimated views of traces (see decimated_trace) are cached together with the measurement.
+	The least recently used measurements are closed when the pool exceeds max_measurements.
+	'''
+	def __init__(self, max_measurements=16, max_views=64):
+		self.max_measurements = max_measurements
+		self.max_views = max_views
+		self.measurements = collections.OrderedDict()
+		self.views = collections.OrderedDict()
+		self.lock = threading.RLock()
+
+	@staticmethod
+	def modification_time(filename):
+		if not os.path.isdir(filename) and os.path.isdir(filename+'.exdir'):
+			filename = filename+'.exdir'
+		files = [os.path.join(filename, 'attributes.yaml')]+glob.glob(os.path.join(filename, '*', 'data', 'data.npy'))
+		return max([os.stat(f).st_mtime for f in files if os.path.exists(f)]+[0])
+
+	def get(self, measurement_id, db):
+		measurement_id = int(measurement_id)
+		with self.lock:
+			with db_session:
+				filename = db.Data[measurement_id].filename
+				mtime = self.modification_time(filename)
+				if measurement_id in self.measurements:
+					cached_mtime, measurement = self.measurements[measurement_id]
+					if cached_mtime == mtime:
+						self.measurements.move_to_end(measurement_id)
+						return measurement
+					self.close(measurement_id)
+				measurement = save_exdir.load_exdir(filename, db, lazy=True)
+			self.measurements[measurement_id] = (mtime, measurement)
+			while len(self.measurements) > self.max_measurements:
+				self.close(next(iter(self.measurements)))
+			return measurement
+
+	def get_view(self, measurement_id, db, key, compute):
+		'''
+		Returns compute(measurement) for the current version of the measurement, cached under key.
+		'''
+		measurement = self.get(measurement_id, db)
+		with self.lock:
+			view_key = (int(measurement_id), self.measurements[int(measurement_id)][0], key)
+			if view_key not in self.views:
+				self.views[view_key] = compute(measurement)
+				while len(self.views) > self.max_views:
+					self.views.popitem(last=False)
+			self.views.move_to_end(view_key)
+			return self.views[view_key]
+
+	def close(self, measurement_id=None):
+		with self.lock:
+			ids = list(self.measurements.keys()) if measurement_id is None else [measurement_id]
+			for i in ids:
+				mtime, measurement = self.measurements.pop(i)
+				try:
+					measurement.exdir.close()
+				except Exception:
+					pass
+			for view_key in [k for k in self.views.keys() if k[0] in ids]:
+				del self.views[view_key]
+
+
+measurement_pool = MeasurementPool()
+
+
+def minmax_indices(values, num_buckets):
+	'''
+	Indices of the minimum and maximum of values in each of num_buckets consecutive buckets, in ascending order.
+	A line through these points looks like the full-resolution line at a pixel width of num_buckets.
+	'''
+	values = np.asarray(values)
+	if values.ndim != 1 or len(values) <= 2*num_buckets:
+		return np.arange(len(values))
+	bucket_size = int(np.ceil(len(values)/num_buckets))
+	num_full = len(values)//bucket_size
+	values_finite = np.where(np.isfinite(values), values, np.nan)
+	buckets = np.reshape(values_finite[:num_full*bucket_size], (num_full, bucket_size))
+	all_nan = np.all(np.isnan(buckets), axis=1)
+	buckets = np.where(all_nan[:, np.newaxis], 0, buckets)
+	offsets = np.arange(num_full)*bucket_size
+	indices = [np.nanargmin(buckets, axis=1)+offsets, np.nanargmax(buckets, axis=1)+offsets,
+			   np.arange(num_full*bucket_size, len(values))]
+	return np.unique(np.concatenate(indices))
+
+def block_mean(data, factors):
+	'''
+	Level-of-detail view of an n-d array: mean over blocks of the given size along each axis (NaN-aware).
+	'''
+	data = np.asarray(data)
+	if all(f <= 1 for f in factors):
+		return data
+	padded_shape = [int(np.ceil(n/f))*f for n, f in zip(data.shape, factors)]
+	padded = np.full(padded_shape, np.nan, dtype=np.result_type(data.dtype, float))
+	padded[tuple(slice(0, n) for n in data.shape)] = data
+	blocks = np.reshape(padded, [d for n, f in zip(padded_shape, factors) for d in (n//f, f)])
+	with np.errstate(invalid='ignore'):
+		finite = np.isfinite(blocks)
+		count = np.sum(finite, axis=tuple(range(1, 2*data.ndim, 2)))
+		total = np.sum(np.where(finite, blocks, 0), axis=tuple(range(1, 2*data.ndim, 2)))
+		return np.where(count > 0, total/np.maximum(count, 1), np.nan)
+
+def decimate_line(x, y, values, width):
+	'''
+	Keeps the min/max points of values (the data of a line trace, x or y) in each of width pixel columns.
+	'''
+	indices = minmax_indices(np.real(values), max(int(width), 1))
+	return np.asarray(x)[indices], np.asarray(y)[indices]
+
+def decimate_heatmap(x, y, z, width, height):
+	'''
+	Averages a heatmap z of shape (len(y), len(x)) and its axes over blocks of pixel size.
+	'''
+	factors = (int(np.ceil(len(y)/max(height, 1))), int(np.ceil(len(x)/max(width, 1))))
+	return block_mean(x, factors[1:]), block_mean(y, factors[:1]), block_mean(z, factors)
 
 def save_default_plot(state, db):
 	plot = default_plot(state, db)
@@ -24,10 +149,9 @@ def cross_section_configurations_add_default(selected_traces, db, current_config
 	measurement_types = []
 	cross_sections = []
 	# load measurements
-	with db_session:
-		for measurement_id in measurements_to_load:
-			measurements[measurement_id] = save_exdir.load_exdir(db.Data[int(measurement_id)].filename, db, lazy=True)
-			measurement_types.append(measurements[measurement_id].measurement_type)
+	for measurement_id in measurements_to_load:
+		measurements[measurement_id] = measurement_pool.get(measurement_id, db)
+		measurement_types.append(measurements[measurement_id].measurement_type)
 
 	for trace_id, trace in selected_traces.to_dict('index').items():
 		dataset_name = trace['dataset']
@@ -41,8 +165,6 @@ def cross_section_configurations_add_default(selected_traces, db, current_config
 				else:
 					current_value = parameter.values[0]
 				cross_sections.append({'trace-id':trace_id, 'parameter-id':parameter_id, 'parameter':parameter.name, 'value':0})
-		for measurement_id, measurement in measurements.items():
-			measurement.exdir.close()
 	return cross_sections
 
 def add_default_traces(loaded_measurements, db, old_traces=[], conditional_dropdowns=[], interactive=True):
@@ -55,7 +177,7 @@ def add_default_traces(loaded_measurements, db, old_traces=[], conditional_dropd
 	with db_session:
 		for m in loaded_measurements:
 			measurement_id = m['id']
-			measurement_state = save_exdir.load_exdir(db.Data[int(measurement_id)].filename, db, lazy=True)
+			measurement_state = measurement_pool.get(measurement_id, db)
 			for dataset in measurement_state.datasets.keys():
 				if len(measurement_state.datasets[dataset].parameters) < 1:
 					continue
@@ -104,7 +226,6 @@ def add_default_traces(loaded_measurements, db, old_traces=[], conditional_dropd
 					   'row': row,
 					   'col': col}
 					data.append(row)
-			measurement_state.exdir.close()
 
 	for measurement_signature_id, data_ids in enumerate(measurement_signatures_new.values()):
 		for data_id in data_ids:
@@ -117,7 +238,7 @@ def default_measurements(db):
 	with db_session:
 		last_measurement = select((measurement.id, measurement.filename) for measurement in db.Data).order_by(lambda id,filename: desc(id)).first()
 		last_meaningful_measurement = last_measurement
-		while (len(save_exdir.load_exdir(last_meaningful_measurement[1], db).datasets) == 0):
+		while (len(measurement_pool.get(last_meaningful_measurement[0], db).datasets) == 0):
 			last_meaningful_measurement = select((measurement.id, measurement.filename) for measurement in db.Data if measurement.id < last_meaningful_measurement[0]).order_by(lambda id,filename: desc(id)).first()
 
 		if last_measurement != last_meaningful_measurement:
@@ -126,6 +247,39 @@ def default_measurements(db):
 			data = [{'id': last_meaningful_measurement[0], 'label': 'current'}]
 	return add_fits_to_measurements(data, db)
 
+def live_update_traces(message, selected_traces):
+	'''
+	Converts an update message of live_updates.LiveUpdatePublisher into updates of the traces of a figure
+	built by plot(selected_traces, ...), without reloading the measurement.
+
+	Line traces along the last sweep parameter of the dataset are extended with the new points (the arguments
+	of Plotly.extendTraces / the extendData property of dash_core_components.Graph). All other traces of the
+	dataset get patches with the new block, which the viewer writes into its copy of the trace data.
+
+	Output: (extend_data, trace_indices), patches
+		extend_data (dict): {'x': [[...], ...], 'y': [[...], ...]} for the traces in trace_indices
+		patches (list of dict): {'trace': trace index, 'index', 'start', 'stop', 'data'} with data after op
+	'''
+	extend_data = {'x': [], 'y': []}
+	trace_indices = []
+	patches = []
+	operations = {'Im': np.imag, 'Re': np.real, 'Abs': np.abs, 'Ph': np.angle}
+	for trace_id, trace in enumerate(selected_traces.to_dict('records')):
+		if int(trace['id']) != message['id'] or trace['dataset'] != message['dataset']:
+			continue
+		op = operations.get(trace['op'], np.asarray)
+		for block in message['blocks']:
+			data = op(block['data'])
+			if trace['style'] != '2d' and data.ndim == 1 and trace['x-axis'] == block['axis'] and \
+					trace['y-axis'] == 'data':
+				extend_data['x'].append(np.asarray(block['x']).tolist())
+				extend_data['y'].append(data.tolist())
+				trace_indices.append(trace_id)
+			else:
+				patches.append({'trace': trace_id, 'index': block['index'], 'start': block['start'],
+								'stop': block['stop'], 'data': data})
+	return (extend_data, trace_indices), patches
+
 def add_fits_to_measurements(measurements, db):
 	extra_measurements = []
 	with db_session:
@@ -156,17 +310,20 @@ def ax_id(ax_id, ax_num):
 		cols = int(np.ceil(np.sqrt(ax_num)))
 		return (ax_id//cols, ax_id%cols)
 
-def plot(selected_traces, cross_sections, db):
+def plot(selected_traces, cross_sections, db, width=1200, height=900):
+	'''
+	Builds the figure of the selected traces. Measurements come from measurement_pool, and traces are decimated
+	to the pixel size of their subplot in a figure of width x height pixels (None for full resolution).
+	'''
 	from time import time
 	start_time = time()
 	measurements_to_load = selected_traces['id'].unique()
 	measurements = {}
 	measurement_types = []
 	# load measurements
-	with db_session:
-		for measurement_id in measurements_to_load:
-			measurements[measurement_id] = save_exdir.load_exdir(db.Data[int(measurement_id)].filename, db, lazy=True)
-			measurement_types.append(measurements[measurement_id].measurement_type)
+	for measurement_id in measurements_to_load:
+		measurements[measurement_id] = measurement_pool.get(measurement_id, db)
+		measurement_types.append(measurements[measurement_id].measurement_type)
 
 	load_time = time()
 	print ('load time: ', load_time - start_time)
@@ -227,35 +384,51 @@ def plot(selected_traces, cross_sections, db):
 			if parameter_values['trace-id'] == trace_id:
 				diff = np.asarray(dataset.parameters[parameter_values['parameter-id']].values)-float(parameter_values['value'])
 				cross_section_id = np.argmin(np.abs(diff))
-				indexes[parameter_values['parameter-id']] = cross_section_id
+				indexes[parameter_values['parameter-id']] = int(cross_section_id)
 
 		for parameter_id, parameter in enumerate(dataset.parameters):
 			if parameter.name == trace['x-axis']:
-				dataset_x = np.memmap.tolist(parameter.values)
 				title_x = '{name} ({unit})'.format(name=parameter.name, unit=parameter.unit)
 				x_axis_id = parameter_id
 			if parameter.name == trace['y-axis']:
-				dataset_y = np.memmap.tolist(parameter.values)
 				title_y = '{name} ({unit})'.format(name=parameter.name, unit=parameter.unit)
 				y_axis_id = parameter_id
 
-		data_flat = dataset.data[indexes]
-		if trace['style'] != '2d':
-			trace_data = data_flat
-		else:
-			if x_axis_id>y_axis_id:
-				trace_data = data_flat.T
-			else:
-				trace_data = data_flat
-
-		if trace['op'] == 'Im': data_to_plot = np.imag(trace_data)
-		elif trace['op'] == 'Re': data_to_plot = np.real(trace_data)
-		elif trace['op'] == 'Abs': data_to_plot = np.abs(trace_data)
-		elif trace['op'] == 'Ph': data_to_plot = np.angle(trace_data)
-		else: data_to_plot = trace_data
+		# pixel size of the subplot
+		subplot_width = width*(1.0-2*x_offset)/num_cols if width else None
+		subplot_height = height*(1.0-2*y_offset)/num_rows if height else None
 
-		x = dataset_x if x_axis_id != -1 else data_to_plot
-		y = dataset_y if y_axis_id != -1 else data_to_plot
+		def compute_view(measurement):
+			dataset = measurement.datasets[dataset_name]
+			data_flat = dataset.data[tuple(indexes)]
+			if trace['style'] != '2d':
+				trace_data = data_flat
+			else:
+				if x_axis_id>y_axis_id:
+					trace_data = data_flat.T
+				else:
+					trace_data = data_flat
+
+			if trace['op'] == 'Im': data_to_plot = np.imag(trace_data)
+			elif trace['op'] == 'Re': data_to_plot = np.real(trace_data)
+			elif trace['op'] == 'Abs': data_to_plot = np.abs(trace_data)
+			elif trace['op'] == 'Ph': data_to_plot = np.angle(trace_data)
+			else: data_to_plot = np.asarray(trace_data)
+
+			x = np.asarray(dataset.parameters[x_axis_id].values) if x_axis_id != -1 else data_to_plot
+			y = np.asarray(dataset.parameters[y_axis_id].values) if y_axis_id != -1 else data_to_plot
+			if trace['style'] == '2d':
+				z = data_to_plot.T
+				if subplot_width and subplot_height:
+					x, y, z = decimate_heatmap(x, y, z, subplot_width, subplot_height)
+				return x.tolist(), y.tolist(), z
+			if subplot_width and np.ndim(data_to_plot) == 1:
+				x, y = decimate_line(x, y, data_to_plot, subplot_width)
+			return np.asarray(x).tolist(), np.asarray(y).tolist(), None
+
+		view_key = (dataset_name, tuple(str(i) for i in indexes), x_axis_id, y_axis_id, trace['op'], trace['style'],
+					subplot_width, subplot_height)
+		x, y, z = measurement_pool.get_view(trace['id'], db, view_key, compute_view)
 		#print ('new trace shape:', trace_data.shape, 'x shape:',np.asarray(x).shape, 'y shape:', np.asarray(y).shape)
 
 
@@ -284,7 +457,7 @@ def plot(selected_traces, cross_sections, db):
 							   'x': (col + 1.0-x_offset)/num_cols,
 							   'y': (row + 0.5)/num_rows}
 			plot_trace['colorscale'] = 'Blackbody'
-			plot_trace['z'] = data_to_plot.T
+			plot_trace['z'] = z
 		else:
 			plot_trace['mode'] = style
 			plot_trace['marker'] = {'size': 5 if trace['style'] == 'o' else 2, 'color':trace['color']}
@@ -309,7 +482,4 @@ def plot(selected_traces, cross_sections, db):
 		#print(layout['xaxis{}'.format(row*num_cols+col+1)], layout['yaxis{}'.format(row*num_cols+col+1)])
 	figure['layout'] = layout
 
-	for measurement_id, measurement in measurements.items():
-		measurement.exdir.close()
-
 	return figure
@@ -14,6 +14,8 @@ class MeasurementParameter:
         self.name = param[2] if len(param) > 2 else kwargs['name']
         self.unit = param[3] if len(param) > 3 else ''
         self.pre_setter = param[4] if len(param) > 4 else None
+        # instrument or other resource the setter talks to; setters of different resources can run concurrently
+        self.resource = param[5] if len(param) > 5 else None
         self.setter_time = 0
 
         if 'name' in kwargs:
@@ -22,6 +24,8 @@ class MeasurementParameter:
             self.unit = kwargs['unit']
         if 'pre_setter' in kwargs:
             self.pre_setter = kwargs['pre_setter']
+        if 'resource' in kwargs:
+            self.resource = kwargs['resource']
 
     def __str__(self):
         return '{name} ({units}),:[{min}, {max}] ({num_points} points) {setter_str}'.format(#'{name} ({units}): [{min}, {max}] ({num_points} points) {setter_str}'.format(
@@ -74,8 +78,10 @@ class MeasurementState:
         self.start = datetime.now()  # time.time()
         self.stop = datetime.now()
         self.measurement_time = 0
+        self.setter_time = 0 # wall-clock time spent in parameter setters
         self.started_sweeps = 0
         self.done_sweeps = 0
+        self.updated_indeces = [] # sweep indices measured since the last on_update hooks
         self.filename = ''
         self.id = None
         self.owner = 'qtlab'
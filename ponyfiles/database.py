@@ -3,6 +3,8 @@ from .data_structures import *
 from.data_structures import  MeasurementState
 from datetime import datetime
 from decimal import Decimal
+from contextlib import contextmanager
+import threading
 
 
 class MyDatabase:
@@ -65,14 +67,31 @@ class MyDatabase:
             # id = PrimaryKey(int, auto=True)
         self.Invalidations = Invalidations
 
-        db.bind(provider, user=user, password=password, host=host, database=database, port=port)
+        if provider == 'sqlite':
+            # file name (or ':memory:') in database, e.g. for benchmarks without a database server
+            db.bind(provider, database, create_db=True)
+        else:
+            db.bind(provider, user=user, password=password, host=host, database=database, port=port)
         db.generate_mapping(create_tables=True)
         self.db = db
+        # deferred_commit nesting depth, per thread like the db_sessions whose commits it defers
+        self._deferred = threading.local()
+
+    @property
+    def deferred_commits(self):
+        return getattr(self._deferred, 'depth', 0)
 
     def create_in_database(self, state):
         """
-        Creates entity instance in program memory space
-        and commits it into the database.
+        Inserts the measurement record and its sweep parameters, metadata and references
+        into the database and commits (unless commits are deferred, see deferred_commit).
+
+        The rows are written with one multi-row INSERT per table instead of one
+        pony entity per row, through pony's raw SQL API. They bypass the pony
+        entity cache: queries and collections loaded afterwards see them, but
+        collections that were already loaded in the db_session (e.g.
+        reference_two of a referenced measurement, or metadata of a measurement)
+        do not include the new rows until the next db_session.
 
         Parameters
         ----------
@@ -83,42 +102,101 @@ class MyDatabase:
         id : int
             state database id
         """
-        d = self.Data(comment=state.comment,
-                      measurement_type=state.measurement_type,
-                      sample_name=state.sample_name,
-                      start=state.start,
-                      filename=state.filename,
-                      type_revision=state.type_revision,
-                      owner=state.owner,
-                      incomplete=True)
-
+        start = state.start
+        if self.db.provider_name == 'sqlite':
+            start = start.isoformat(' ', timespec='milliseconds')  # SQLite stores datetimes as text
+        # missing Optional(str) values are stored as empty strings, as pony does
+        data_id = self.db.insert(self.Data, returning='id', comment=state.comment or '',
+                                 measurement_type=state.measurement_type, sample_name=state.sample_name,
+                                 start=start, filename=state.filename or '',
+                                 type_revision=state.type_revision or '', owner=state.owner or '',
+                                 incomplete=True)
+
+        linear_sweeps = []
         for dataset in state.datasets.keys():
             for parameter in state.datasets[dataset].parameters:
-                minv = np.min(parameter.values)
-                maxv = np.max(parameter.values)
-                number = len(parameter.values)
-                name = parameter.name
-                unit = parameter.unit
-                self.Linear_sweep(data_id=d,
-                                  min_value=minv,
-                                  max_value=maxv,
-                                  num_points=number,
-                                  parameter_name=name,
-                                  parameter_units=unit)
-
-        for name, value in state.metadata.items():
-            # print(name, value)
-            self.Metadata(data_id=d, name=name, value=value)
-        # print('Inserting references:', state.references)
+                linear_sweeps.append((data_id,
+                                      float(np.min(parameter.values)),
+                                      float(np.max(parameter.values)),
+                                      len(parameter.values),
+                                      parameter.name,
+                                      parameter.unit if parameter.unit is not None else ''))
+        self.insert_rows(self.Linear_sweep, ('data_id', 'min_value', 'max_value', 'num_points',
+                                             'parameter_name', 'parameter_units'), linear_sweeps)
+
+        self.insert_rows(self.Metadata, ('data_id', 'name', 'value'),
+                         [(data_id, name, str(value)) for name, value in state.metadata.items()])
+
+        references = []
         for ref_description, ref_that in state.references.items():
             if type(ref_description) is tuple:
-                self.Reference(this=d, that=ref_that, ref_type=ref_description[0], ref_comment=ref_description[1])
+                references.append((data_id, ref_that, ref_description[0], ref_description[1]))
             else:
-                self.Reference(this=d, that=ref_that, ref_type=ref_description, ref_comment='-')
+                references.append((data_id, ref_that, ref_description, '-'))
+        self.insert_rows(self.Reference, ('this', 'that', 'ref_type', 'ref_comment'), references)
 
-        commit()
-        state.id = d.id
-        return d.id
+        self.commit()
+        state.id = data_id
+        return data_id
+
+    def insert_rows(self, entity, attrs, rows, max_parameters=900):
+        """
+        Inserts rows into the table of entity with multi-row INSERT statements.
+
+        Parameters
+        ----------
+        entity : MyDatabase entity, e.g. MyDatabase.Metadata
+        attrs : tuple of str
+            attribute names of the columns
+        rows : list of tuples
+            column values (int, float or str, passed to the database driver as they are),
+            references to Data as ids
+        max_parameters : int
+            maximal number of query parameters of one statement (SQLite allows 999)
+        """
+        if not rows:
+            return
+        quote = self.db.provider.quote_name
+        insert = 'INSERT INTO {} ({}) VALUES '.format(quote(entity._table_),
+                                                      ', '.join(quote(getattr(entity, attr).columns[0])
+                                                                for attr in attrs))
+        rows_per_statement = max(max_parameters // len(attrs), 1)
+        for chunk_start in range(0, len(rows), rows_per_statement):
+            chunk = rows[chunk_start:chunk_start+rows_per_statement]
+            values = {}
+            placeholders = []
+            for row_id, row in enumerate(chunk):
+                names = ['p{}_{}'.format(row_id, column_id) for column_id in range(len(attrs))]
+                values.update(zip(names, row))
+                placeholders.append('(' + ', '.join('$' + name for name in names) + ')')
+            self.db.execute(insert + ', '.join(placeholders), {}, values)
+
+    def commit(self):
+        if not self.deferred_commits:
+            commit()
+
+    @contextmanager
+    def deferred_commit(self):
+        """
+        Defers the commits of create_in_database and update_in_database to the end of the block,
+        so that a group of saves (e.g. the calibrations of a scan) is committed at once:
+
+            with db_session, db.deferred_commit():
+                for ...:
+                    exdir_db.save_measurement(...)
+
+        The saved records are visible to queries of the same db_session (e.g. Exdir_db.select_measurement)
+        inside the block, but not to collections loaded before the saves (see create_in_database). The
+        records saved before an exception are committed as well, as their files have already been written.
+
+        The deferral applies to the db_session of the calling thread only; other threads keep committing.
+        """
+        self._deferred.depth = self.deferred_commits + 1
+        try:
+            yield self
+        finally:
+            self._deferred.depth -= 1
+            self.commit()
 
     def update_in_database(self, state):
         d = self.Data[state.id]
@@ -133,13 +211,14 @@ class MyDatabase:
         d.stop = state.stop
         d.filename = state.filename
 
+        metadata = {m.name: m for m in d.metadata}
         for k, v in state.metadata.items():
-            if k not in d.metadata.name:
+            if k not in metadata:
                 self.Metadata(data_id=d, name=k, value=str(v))
-            else:
-                self.Metadata[d, k].value = str(v)
+            elif metadata[k].value != str(v):
+                metadata[k].value = str(v)
         # d.metadata.update(state.metadata)
-        commit()
+        self.commit()
         return d.id
 
     def get_from_database(self, filename = ''):
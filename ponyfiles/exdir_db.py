@@ -2,7 +2,7 @@ from . import save_exdir, data_structures
 from .database import MyDatabase
 from .data_structures import MeasurementState
 
-from pony.orm import desc, count
+from pony.orm import desc, count, select
 import datetime
 
 
@@ -14,6 +14,8 @@ class Exdir_db:
         self.sample_name = sample_name
         self.old_prefix = old_prefix
         self.new_prefix = new_prefix
+        # number of invalidate calls, lets caches of database contents (e.g. CalibrationSurface) notice them
+        self.invalidations = 0
 
     def save_measurement(self, data):
         """
@@ -55,26 +57,98 @@ class Exdir_db:
         self.save_measurement(data)
         return data
 
+    def deferred_commit(self):
+        """
+        Context manager that commits a group of saves at once (see MyDatabase.deferred_commit).
+        Saved measurements can be selected (e.g. by select_measurement) inside the group.
+        """
+        return self.db.deferred_commit()
+
     def invalidate(self, data_id, reason='anonymous', chain=True):
-        invalidation_time=str(datetime.datetime.now())
-        invalidation_chain = {(None, self.db.Data[data_id])}
-        invalidation_chain_processed = set()
+        """
+        Marks a measurement as invalid. If chain is True, all measurements that reference it
+        (directly or through other measurements) with a reference type listed in Invalidations
+        are invalidated as well.
+
+        The reference graph is walked by a single recursive query in the database and the
+        invalidation metadata of all invalidated measurements is inserted by set-based statements
+        in the current transaction, so the number of queries does not depend on the size of the graph.
+        Measurements that have already been invalidated keep their invalidation metadata. Cached results of
+        earlier queries of the db_session are dropped, so that later queries see the invalidation.
+
+        Parameters
+        ----------
+        data_id : int
+            id of the measurement
+        reason : str
+            invalidation reason
+        chain : bool
+            invalidate dependent measurements
+
+        Returns
+        -------
+        int
+            number of invalidated measurements
+        """
+        self.db.Data[data_id]  # raises ObjectNotFound for unknown measurements
+        self.invalidations += 1
+        invalidation_time = str(datetime.datetime.now())
+        database = self.db.db
+        quote = database.provider.quote_name
+        metadata = quote(self.db.Metadata._table_)
+        reference = quote(self.db.Reference._table_)
+        invalidations = quote(self.db.Invalidations._table_)
+        this, that, ref_type = (quote(c) for c in (self.db.Reference.this.columns[0],
+                                                   self.db.Reference.that.columns[0],
+                                                   self.db.Reference.ref_type.columns[0]))
+        metadata_data_id, metadata_name, metadata_value = (quote(c) for c in (self.db.Metadata.data_id.columns[0],
+                                                                              self.db.Metadata.name.columns[0],
+                                                                              self.db.Metadata.value.columns[0]))
+        invalidations_ref_type = quote(self.db.Invalidations.ref_type.columns[0])
+
+        invalidating = 'r.{ref_type} IN (SELECT {invalidations_ref_type} FROM {invalidations})'.format(
+            ref_type=ref_type, invalidations_ref_type=invalidations_ref_type, invalidations=invalidations)
+        not_invalidated = 'NOT EXISTS (SELECT 1 FROM {metadata} m WHERE m.{data_id} = {id} AND m.{name} = $name)'
+        insert = 'INSERT INTO {metadata} ({data_id}, {name}, {value}) '.format(
+            metadata=metadata, data_id=metadata_data_id, name=metadata_name, value=metadata_value)
+
+        # ids of the invalidated measurements, collected by a recursive query over the references
+        recursion = ''
+        if chain:
+            recursion = (' UNION SELECT r.{this} FROM {reference} r JOIN invalidation_chain c ON r.{that} = c.id '
+                         'WHERE {invalidating}').format(this=this, that=that, reference=reference,
+                                                        invalidating=invalidating)
+        database.execute('DROP TABLE IF EXISTS invalidation_chain_ids', {}, {})
+        database.execute('CREATE TEMPORARY TABLE invalidation_chain_ids AS '
+                         'WITH RECURSIVE invalidation_chain(id) AS (SELECT CAST($data_id AS INTEGER)' + recursion + ') '
+                         'SELECT id FROM invalidation_chain',
+                         {}, {'data_id': data_id})
         try:
-            while (True):
-                reason_data, current_data = invalidation_chain.pop()
-                self.db.Metadata(data_id = current_data.id, name = 'invalidation', value = 'True')
-                self.db.Metadata(data_id = current_data.id, name = 'invalidation_time', value = invalidation_time)
-                self.db.Metadata(data_id = current_data.id, name = 'invalidation_reason', value = reason)
-                if reason_data:
-                    self.db.Metadata(data_id = current_data.id, name = 'invalidation_reason_chain', value = str(reason_data.id))
-                if chain:
-                    invalidation_chain.update(list((reference.that, reference.this)
-                                                   for reference in self.db.Reference.select(lambda r: r.that.id==current_data.id)
-                                                   if reference.ref_type in self.db.Invalidations.ref_type))
-                invalidation_chain_processed.add(current_data)
-                invalidation_chain = {i for i in invalidation_chain if i[1] not in invalidation_chain_processed}
-        except KeyError:  # everything has been invalidated
-            pass
+            if chain:
+                # the measurement each newly invalidated measurement was reached from
+                database.execute(insert + ('SELECT r.{this}, $reason_chain, CAST(MIN(r.{that}) AS TEXT) FROM {reference} r '
+                                           'WHERE r.{this} IN (SELECT id FROM invalidation_chain_ids) '
+                                           'AND r.{that} IN (SELECT id FROM invalidation_chain_ids) '
+                                           'AND r.{this} <> $data_id AND {invalidating} AND ').format(
+                                     this=this, that=that, reference=reference, invalidating=invalidating) +
+                                 not_invalidated.format(metadata=metadata, data_id=metadata_data_id,
+                                                        name=metadata_name, id='r.'+this) +
+                                 ' GROUP BY r.' + this,
+                                 {}, {'data_id': data_id, 'name': 'invalidation',
+                                      'reason_chain': 'invalidation_reason_chain'})
+            for name, value in [('invalidation', 'True'),
+                                ('invalidation_time', invalidation_time),
+                                ('invalidation_reason', reason)]:
+                database.execute(insert + 'SELECT c.id, $name, $value FROM invalidation_chain_ids c WHERE ' +
+                                 not_invalidated.format(metadata=metadata, data_id=metadata_data_id,
+                                                        name=metadata_name, id='c.id'),
+                                 {}, {'name': name, 'value': value})
+            return database.execute('SELECT COUNT(*) FROM invalidation_chain_ids', {}, {}).fetchone()[0]
+        finally:
+            database.execute('DROP TABLE invalidation_chain_ids', {}, {})
+            # pony keeps the results of queries in the db_session until it modifies entities itself, and does not
+            # notice the raw statements above (there is no public API to drop the results)
+            database._get_cache().query_results.clear()
 
     def replace_file_prefixes(self, filename):
         try:
@@ -161,3 +235,31 @@ class Exdir_db:
             print('reference:',  k, ':', v)
 
         return q2
+
+    def select_measurements_metadata(self, measurement_type: str, metadata={}, ignore_invalidation=False):
+        """
+        Loads the metadata of all records that correspond to the parameters provided,
+        without loading the measurement files.
+
+        Parameters
+        ----------
+        measurement_type
+        metadata
+        ignore_invalidation
+
+        Returns
+        -------
+        list[tuple]
+            (id, metadata dict) of each record, in the order of ids. Records invalidated by
+            invalidate are left out unless ignore_invalidation is True.
+        """
+        q = self.select_measurements_db(measurement_type, metadata=metadata, ignore_invalidation=ignore_invalidation)
+        records = {d.id: {} for d in q}
+        if not records:
+            return []
+        ids = list(records.keys())
+        for data_id, name, value in select((m.data_id.id, m.name, m.value) for m in self.db.Metadata
+                                           if m.data_id.id in ids):
+            records[data_id][name] = value
+        return sorted((data_id, record) for data_id, record in records.items()
+                      if ignore_invalidation or record.get('invalidation') != 'True')
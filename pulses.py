@@ -152,58 +152,85 @@ class pulses:
     def awg(self, channel, length, waveform):
         return waveform
 
-    def set_seq(self, seq, force=True):
-        from time import time
+    def _seq_waveforms(self, seq):
+        """Assemble the per-channel complex waveforms of a pulse sequence (with global_pre and global_post)."""
         pulse_seq_padded = self.global_pre + seq + self.global_post
+        virtual_phase = {k: 0 for k in self.channels.keys()}
+        df = {k: 0 for k in self.channels.keys()}
+        offsets = {k: 0 for k in self.channels.keys()}
+        pulse_shape = {k: [] for k in self.channels.keys()}
+        for channel, channel_device in self.channels.items():
+            for pulse in pulse_seq_padded:
+                if hasattr(pulse[channel], 'is_vz'):
+                    virtual_phase[channel] += pulse[channel].phi
+                    continue
+                if hasattr(pulse[channel], 'is_vf'):
+                    df[channel] = pulse[channel].freq
+                    continue
+                if hasattr(pulse[channel], 'is_offset'):
+                    offsets[channel] = pulse[channel].offset
+                    continue
+                # print (channel, df[channel])
+                pulse_shape[channel].extend(pulse[channel] * np.exp(1j * (
+                            virtual_phase[channel] + 2 * np.pi * df[channel] / self.channels[
+                        channel].get_clock() * np.arange(len(pulse[channel])))) + offsets[channel])
+                virtual_phase[channel] += 2 * np.pi * df[channel] / self.channels[channel].get_clock() * len(
+                    pulse[channel])
+            pulse_shape[channel] = np.asarray(pulse_shape[channel])
+        return pulse_shape
+
+    def _upload(self, waveforms):
         try:
             for channel, channel_device in self.channels.items():
                 channel_device.freeze()
-            virtual_phase = {k: 0 for k in self.channels.keys()}
-            df = {k: 0 for k in self.channels.keys()}
-            offsets = {k: 0 for k in self.channels.keys()}
-            pulse_shape = {k: [] for k in self.channels.keys()}
             for channel, channel_device in self.channels.items():
-                for pulse in pulse_seq_padded:
-                    if hasattr(pulse[channel], 'is_vz'):
-                        virtual_phase[channel] += pulse[channel].phi
-                        continue
-                    if hasattr(pulse[channel], 'is_vf'):
-                        df[channel] = pulse[channel].freq
-                        continue
-                    if hasattr(pulse[channel], 'is_offset'):
-                        offsets[channel] = pulse[channel].offset
-                        continue
-                    # print (channel, df[channel])
-                    pulse_shape[channel].extend(pulse[channel] * np.exp(1j * (
-                                virtual_phase[channel] + 2 * np.pi * df[channel] / self.channels[
-                            channel].get_clock() * np.arange(len(pulse[channel])))) + offsets[channel])
-                    virtual_phase[channel] += 2 * np.pi * df[channel] / self.channels[channel].get_clock() * len(
-                        pulse[channel])
-                pulse_shape[channel] = np.asarray(pulse_shape[channel])
-
-                if len(pulse_shape[channel]) > channel_device.get_nop():
-                    tmp = np.zeros(channel_device.get_nop(), dtype=pulse_shape[channel].dtype)
-                    tmp = pulse_shape[channel][-channel_device.get_nop():]
-                    pulse_shape[channel] = tmp
-                    raise (ValueError('pulse sequence too long'))
-                else:
-                    tmp = np.zeros(channel_device.get_nop(), dtype=pulse_shape[channel].dtype)
-                    tmp[-len(pulse_shape[channel]):] = pulse_shape[channel]
-                    pulse_shape[channel] = tmp
-                # print (channel, pulse_shape[channel], len(pulse_shape[channel]))
                 # print ('Calling set_waveform on device '+channel)
-                # setter_start = time()
-                channel_device.set_waveform(pulse_shape[channel])
-        # print ('channel {} time: {}'.format(channel, time() - setter_start))
+                channel_device.set_waveform(waveforms[channel])
         finally:
             for channel, channel_device in self.channels.items():
-                # setter_start = time()
                 channel_device.unfreeze()
-        # print ('channel {} unfreeze time: {}'.format(channel, time() - setter_start))
 
-        self.last_seq = seq
         devices = []
         for channel in self.channels.values():
             devices.extend(channel.get_physical_devices())
         for device in list(set(devices)):
             device.run()
+
+    def set_seq(self, seq, force=True):
+        waveforms = {}
+        for channel, pulse_shape in self._seq_waveforms(seq).items():
+            nop = self.channels[channel].get_nop()
+            if len(pulse_shape) > nop:
+                raise (ValueError('pulse sequence too long'))
+            waveforms[channel] = np.zeros(nop, dtype=pulse_shape.dtype)
+            waveforms[channel][-len(pulse_shape):] = pulse_shape
+        self._upload(waveforms)
+        self.last_seq = seq
+
+    def set_seq_segmented(self, seqs):
+        """
+        Upload several pulse sequences at once as consecutive segments of a single waveform.
+
+        The waveform of each channel is split into len(seqs) equal slots, and each sequence is right-aligned in its
+        slot, just as set_seq aligns a single sequence to the end of the waveform. If every sequence contains a
+        readout trigger, a single AWG run produces len(seqs) readout triggers in the order of seqs, so a
+        measurer with measure_segmented(len(seqs)) can acquire all of them in one capture.
+
+        :param seqs: list of pulse sequences
+        :returns: segment length in samples for each channel
+        """
+        segment_waveforms = [self._seq_waveforms(seq) for seq in seqs]
+        waveforms = {}
+        segment_nops = {}
+        for channel, channel_device in self.channels.items():
+            segment_nop = channel_device.get_nop() // len(seqs)
+            waveforms[channel] = np.zeros(channel_device.get_nop(), dtype=complex)
+            for segment_id, segment in enumerate(segment_waveforms):
+                if len(segment[channel]) > segment_nop:
+                    raise ValueError('pulse sequence too long for {} segments'.format(len(seqs)))
+                waveforms[channel][(segment_id+1)*segment_nop-len(segment[channel]):(segment_id+1)*segment_nop] = \
+                    segment[channel]
+            segment_nops[channel] = segment_nop
+        self._upload(waveforms)
+        self.last_seq = seqs
+        return segment_nops
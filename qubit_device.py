@@ -1,5 +1,4 @@
 from . import pulses, awg_iq_multi, modem_readout, awg_channel
-from .instrument_drivers.TSW14J56driver import TSW14J56_evm_reducer
 
 import copy
 from .ponyfiles.exdir_db import Exdir_db
@@ -402,6 +401,7 @@ class qubit_device:
     def setup_adc_reducer_iq(self, qubits, raw=False): ### pimp this code to make it more universal. All the hardware belongs to the hardware
         # file, but how do we do that here without too much boilerplate???
         # params: qubits: str or list #
+        from .instrument_drivers.TSW14J56driver import TSW14J56_evm_reducer
         feature_id = 0
 
         adc_reducer = TSW14J56_evm_reducer(self.modem.adc_device)
@@ -430,6 +430,7 @@ class qubit_device:
         return adc_reducer, qubit_measurement_dict
 
     def set_adc_features_and_thresholds(self, features, thresholds, disable_rest=True, raw=False):
+        from .instrument_drivers.TSW14J56driver import TSW14J56_evm_reducer
         adc_reducer = TSW14J56_evm_reducer(self.modem.adc_device)
         adc_reducer.output_raw = raw
         adc_reducer.last_cov = False
@@ -0,0 +1,162 @@
+'''
+Background ramps of slow bias sources.
+
+Sources that must not jump (flux bias DACs, current sources) are moved in small steps with a delay after each step.
+RampScheduler runs the ramps of any number of channels in a single background thread, so that the caller does not
+sleep through every step and ramps of different channels proceed at the same time:
+
+    scheduler = RampScheduler()
+    f1 = scheduler.ramp('coil 1', 0., 1., step=0.01, write=lambda v: dac.set_voltage(v, channel=1), step_delay=0.01)
+    f2 = scheduler.ramp('coil 2', 0., -1., step=0.01, write=lambda v: dac.set_voltage(v, channel=2), step_delay=0.01)
+    scheduler.wait()                # or: await scheduler.ramp_done(), or f1.result()
+
+Every ramp returns a concurrent.futures.Future that is done as soon as the target value is written. Steps of several
+channels that are due at the same time and have a command template are written in one call of write_batch (e.g.
+Instrument.write_batch), otherwise every channel is written with its own write function.
+'''
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _Ramp:
+    def __init__(self, key, value, target, step, write, step_delay, command):
+        self.key = key
+        self.value = value
+        self.target = target
+        self.step = abs(step)
+        self.write = write
+        self.step_delay = step_delay
+        self.command = command
+        self.next_time = time.time()
+        self.future = Future()
+
+    def next_value(self):
+        delta = self.target - self.value
+        if abs(delta) <= self.step:
+            return self.target
+        return self.value + (self.step if delta > 0 else -self.step)
+
+
+class RampScheduler:
+    def __init__(self, write_batch=None):
+        '''
+        :param write_batch: function that writes a list of commands in one message. Used for simultaneous steps
+            of ramps with a command template (see ramp).
+        '''
+        self.write_batch = write_batch
+        self.ramps = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def ramp(self, key, start, target, step, write, step_delay=0.01, command=None):
+        '''
+        Starts a ramp of a channel. If the channel is already ramping, the running ramp continues to the new
+        target and its future is returned.
+
+        :param key: channel identifier
+        :param start: current value of the channel
+        :param target: final value
+        :param step: maximum step size
+        :param write: function that writes a value to the channel
+        :param step_delay: delay after each step in s
+        :param command: function that returns the command of a value, for write_batch
+        :returns: concurrent.futures.Future with the final value
+        '''
+        with self.condition:
+            if key in self.ramps:
+                ramp = self.ramps[key]
+                ramp.target = target
+                ramp.step = abs(step)
+                ramp.step_delay = step_delay
+            else:
+                ramp = _Ramp(key, start, target, step, write, step_delay, command)
+                self.ramps[key] = ramp
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+            return ramp.future
+
+    def is_ramping(self, key):
+        with self.condition:
+            return key in self.ramps
+
+    def futures(self, keys=None):
+        with self.condition:
+            return [ramp.future for key, ramp in self.ramps.items() if keys is None or key in keys]
+
+    def wait(self, keys=None, timeout=None):
+        '''
+        Waits for the ramps of the given channels (default: all running ramps) and re-raises write errors.
+        '''
+        for future in self.futures(keys):
+            future.result(timeout)
+
+    async def ramp_done(self, keys=None):
+        '''
+        Coroutine version of wait.
+        '''
+        futures = [asyncio.wrap_future(future) for future in self.futures(keys)]
+        if futures:
+            await asyncio.gather(*futures)
+
+    def stop(self, keys=None):
+        '''
+        Stops ramps at their current value. Their futures are cancelled.
+        '''
+        with self.condition:
+            for key in list(self.ramps.keys()):
+                if keys is None or key in keys:
+                    self.ramps.pop(key).future.cancel()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not len(self.ramps):
+                    self.thread = None
+                    return
+                now = time.time()
+                due = [ramp for ramp in self.ramps.values() if ramp.next_time <= now]
+                if not len(due):
+                    self.condition.wait(min(ramp.next_time for ramp in self.ramps.values()) - now)
+                    continue
+            self._step(due)
+
+    def _step(self, ramps):
+        values = [ramp.next_value() for ramp in ramps]
+        batched = [(ramp, value) for ramp, value in zip(ramps, values)
+                   if ramp.command is not None and self.write_batch is not None]
+        failed = {}
+        if len(batched) > 1:
+            try:
+                self.write_batch([ramp.command(value) for ramp, value in batched])
+            except Exception as e:
+                failed.update({ramp.key: e for ramp, value in batched})
+        else:
+            batched = []
+        for ramp, value in zip(ramps, values):
+            if any(ramp is batched_ramp for batched_ramp, batched_value in batched):
+                continue
+            try:
+                ramp.write(value)
+            except Exception as e:
+                failed[ramp.key] = e
+
+        now = time.time()
+        with self.condition:
+            for ramp, value in zip(ramps, values):
+                if self.ramps.get(ramp.key) is not ramp:
+                    continue # stopped while writing
+                if ramp.key in failed:
+                    del self.ramps[ramp.key]
+                    ramp.future.set_exception(failed[ramp.key])
+                    continue
+                ramp.value = value
+                if value == ramp.target:
+                    del self.ramps[ramp.key]
+                    ramp.future.set_result(value)
+                else:
+                    ramp.next_time = now + ramp.step_delay
@@ -0,0 +1,793 @@
+'''
+Simulated instruments for running calibrations and measurements without the lab.
+
+The simulated instruments implement the parts of the driver interfaces that the measurement code uses, and count
+the calls that would be slow on real hardware (e.g. SimulatedSpectrumAnalyzer.measure_count):
+
+    awg = dummy_awg.DummyAWG(channels=2)
+    lo = SimulatedLO(6e9)
+    mixer = SimulatedIQMixer(awg, awg, 0, 1, lo, amplitude_imbalance=1.05, phase_imbalance=0.05)
+    sa = SimulatedSpectrumAnalyzer(mixer)
+    iq = awg_iq_multi.Awg_iq_multi(awg, awg, 0, 1, lo, exdir_db)
+
+For pulsed measurements, SimulatedAWG drives the excitation and readout mixers of SimulatedQubits and triggers a
+SimulatedDigitizer, which measures the readout signal transmitted through their resonators. The latencies of the
+instruments (uploads, sweeps, captures, setters) are configurable and zero by default. A complete setup for
+qubit_device is tunable_coupling_transmons/simulated_setup.py.
+
+SimulatedParamp is the gain of a flux-tunable parametric amplifier as a function of the pump and bias settings, for
+tuning up paramp.paramp against a SimulatedVNA.
+
+SimulatedVisaResource stands in for the pyvisa resource of a VISA driver (e.g. Agilent_N5242A, nndac) and answers its
+SCPI commands, for checking the drivers themselves.
+'''
+
+import time
+
+import numpy as np
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+class SimulatedLO:
+    def __init__(self, frequency=6e9, power=0, latency=0.0):
+        '''
+        :param latency: duration of set_frequency and set_power in seconds
+        '''
+        self.frequency = frequency
+        self.power = power
+        self.status = True
+        self.latency = latency
+        self.set_count = 0
+
+    def set_frequency(self, frequency):
+        _sleep(self.latency)
+        self.set_count += 1
+        self.frequency = frequency
+
+    def get_frequency(self):
+        return self.frequency
+
+    def set_power(self, power):
+        _sleep(self.latency)
+        self.set_count += 1
+        self.power = power
+
+    def get_power(self):
+        return self.power
+
+    def set_status(self, status):
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+
+class SimulatedIQMixer:
+    '''
+    IQ mixer driven by the I and Q channels of AWGs (DummyAWG interface: get_waveform, get_offset, get_clock).
+
+    The complex envelope of the RF output is
+        conversion*(x_I + 1j*amplitude_imbalance*exp(1j*phase_imbalance)*x_Q + lo_leakage)
+    where x_I and x_Q are the waveforms including the DC offsets, so that the image sideband of a CW tone is
+    suppressed only for the right complex Q amplitude and the carrier only for the right DC offsets. With full_scale,
+    x_I and x_Q are clipped at +-full_scale, as the outputs of a real AWG.
+    '''
+    def __init__(self, awg_I, awg_Q, channel_I, channel_Q, lo, amplitude_imbalance=1.0, phase_imbalance=0.0,
+                 lo_leakage=0.0, conversion_loss=6.0, full_scale=None):
+        '''
+        :param phase_imbalance: quadrature phase error in radians
+        :param lo_leakage: complex LO leakage in units of the AWG amplitude
+        :param conversion_loss: conversion loss in dB, a full-scale CW tone has -conversion_loss dBm
+        :param full_scale: AWG output amplitude at which the waveforms are clipped, None for no clipping
+        '''
+        self.awg_I = awg_I
+        self.awg_Q = awg_Q
+        self.channel_I = channel_I
+        self.channel_Q = channel_Q
+        self.lo = lo
+        self.amplitude_imbalance = amplitude_imbalance
+        self.phase_imbalance = phase_imbalance
+        self.lo_leakage = lo_leakage
+        self.conversion_loss = conversion_loss
+        self.full_scale = full_scale
+
+    def envelope(self):
+        x_I = np.asarray(self.awg_I.get_waveform(self.channel_I)) + self.awg_I.get_offset(self.channel_I)
+        x_Q = np.asarray(self.awg_Q.get_waveform(self.channel_Q)) + self.awg_Q.get_offset(self.channel_Q)
+        if self.full_scale is not None:
+            x_I, x_Q = np.clip(x_I, -self.full_scale, self.full_scale), np.clip(x_Q, -self.full_scale, self.full_scale)
+        quadrature = self.amplitude_imbalance*np.exp(1j*self.phase_imbalance)
+        return (x_I + 1j*quadrature*x_Q + self.lo_leakage)*10**(-self.conversion_loss/20)
+
+    def get_spectrum(self):
+        '''
+        Returns the frequencies and powers (mW) of the spectral lines of the RF output.
+        '''
+        if not self.lo.get_status():
+            return np.zeros(0), np.zeros(0)
+        envelope = self.envelope()
+        amplitudes = np.fft.fft(envelope)/len(envelope)
+        frequencies = self.lo.get_frequency() + np.fft.fftfreq(len(envelope), 1/self.awg_I.get_clock())
+        return frequencies, np.abs(amplitudes)**2
+
+
+class SimulatedSpectrumAnalyzer:
+    '''
+    Spectrum analyzer that measures the spectral lines of a source (e.g. SimulatedIQMixer.get_spectrum) on top of
+    a noise floor. Each point integrates the lines within half a resolution bandwidth and has a log-normal
+    measurement noise.
+    '''
+    def __init__(self, source, noise_floor=-100.0, noise=0.05, seed=None, measure_latency=0.0):
+        '''
+        :param source: object with get_spectrum() returning the line frequencies and powers in mW
+        :param noise_floor: displayed average noise level in dBm
+        :param noise: standard deviation of the measured power in dB
+        :param measure_latency: duration of measure in seconds
+        '''
+        self.source = source
+        self.measure_latency = measure_latency
+        self.noise_floor = noise_floor
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+        self.centerfreq = 0
+        self.span = 0
+        self.nop = 1
+        self.res_bw = 1e6
+        self.video_bw = 1e3
+        self.detector = 'rms'
+        self.sweep_time = 50e-3
+        self.measure_count = 0
+
+    def set_centerfreq(self, centerfreq):
+        self.centerfreq = centerfreq
+
+    def get_centerfreq(self):
+        return self.centerfreq
+
+    def set_span(self, span):
+        self.span = span
+
+    def get_span(self):
+        return self.span
+
+    def set_nop(self, nop):
+        self.nop = int(nop)
+
+    def get_nop(self):
+        return self.nop
+
+    def set_res_bw(self, res_bw):
+        self.res_bw = res_bw
+
+    def set_video_bw(self, video_bw):
+        self.video_bw = video_bw
+
+    def set_detector(self, detector):
+        self.detector = detector
+
+    def set_sweep_time(self, sweep_time):
+        self.sweep_time = sweep_time
+
+    def set_sweep_time_auto(self, auto):
+        pass
+
+    def get_freqpoints(self):
+        if self.nop == 1:
+            return np.asarray([self.centerfreq])
+        return np.linspace(self.centerfreq-self.span/2, self.centerfreq+self.span/2, self.nop)
+
+    def get_points(self):
+        return {'Power': [('Frequency', self.get_freqpoints(), 'Hz')]}
+
+    def get_dtype(self):
+        return {'Power': float}
+
+    def get_opts(self):
+        return {'Power': {'log': 10}}
+
+    def measure(self):
+        _sleep(self.measure_latency)
+        self.measure_count += 1
+        line_frequencies, line_powers = self.source.get_spectrum()
+        points = self.get_freqpoints()
+        within = np.abs(points[:, np.newaxis] - line_frequencies[np.newaxis, :]) <= self.res_bw/2
+        power = np.sum(within*line_powers[np.newaxis, :], axis=1) + 10**(self.noise_floor/10)
+        power_dbm = 10*np.log10(power) + self.random.normal(scale=self.noise, size=power.shape)
+        return {'Power': power_dbm}
+
+
+class SimulatedAWG:
+    '''
+    Multi-channel AWG with analog outputs (interface of dummy_awg.DummyAWG) and digital outputs for triggers
+    (set_digital, used by awg_digital in 'waveform' mode).
+
+    Every set_waveform and set_digital call that changes a waveform takes upload_latency seconds and run takes
+    run_latency seconds. As in HDAWG_1808_new, a waveform equal to the one already loaded is not uploaded again
+    (counted in skipped_upload_count). Uploads are counted in upload_count and bytes_uploaded (8 bytes per analog and
+    1 byte per digital sample). revision changes with every upload, so that the simulated response to the waveforms
+    can be cached.
+    '''
+    def __init__(self, channels=4, digital_channels=4, clock=1e9, nop=1000, upload_latency=0.0, run_latency=0.0):
+        self.channels = channels
+        self.digital_channels = digital_channels
+        self.clock = clock
+        self.upload_latency = upload_latency
+        self.run_latency = run_latency
+        self.status = 1
+        self.frozen = False
+        self.trigger_mode = 'CONT'
+        self.amplitude = np.ones(channels)
+        self.offset = np.zeros(channels)
+        self.upload_count = 0
+        self.skipped_upload_count = 0
+        self.bytes_uploaded = 0
+        self.run_count = 0
+        self.revision = 0
+        self.set_nop(nop)
+
+    def get_nop(self):
+        return self.nop
+
+    def set_nop(self, nop):
+        self.nop = int(nop)
+        self.waveform = np.zeros((self.channels, self.nop))
+        self.digital = np.zeros((self.digital_channels, self.nop), dtype=bool)
+        self.revision += 1
+
+    def get_clock(self):
+        return self.clock
+
+    def set_clock(self, clock):
+        self.clock = clock
+        self.revision += 1
+
+    def set_offset(self, offset, channel):
+        self.offset[channel] = offset
+        self.revision += 1
+
+    def get_offset(self, channel):
+        return self.offset[channel]
+
+    def set_amplitude(self, amplitude, channel=None):
+        if channel is None:
+            self.amplitude[:] = amplitude
+        else:
+            self.amplitude[channel] = amplitude
+
+    def get_amplitude(self, channel=None):
+        return self.amplitude if channel is None else self.amplitude[channel]
+
+    def set_status(self, status, channel=None):
+        self.status = status
+
+    def set_trigger_mode(self, mode):
+        self.trigger_mode = mode
+
+    def run(self):
+        _sleep(self.run_latency)
+        self.run_count += 1
+        self.status = 1
+
+    def stop(self):
+        self.status = 0
+
+    def get_waveform(self, channel):
+        return self.waveform[channel, :]
+
+    def set_waveform(self, waveform, channel):
+        waveform = np.real(waveform)
+        if np.array_equal(self.waveform[channel, :], waveform):
+            self.skipped_upload_count += 1
+            return
+        _sleep(self.upload_latency)
+        self.waveform[channel, :] = waveform
+        self.upload_count += 1
+        self.bytes_uploaded += self.nop*8
+        self.revision += 1
+
+    def get_digital(self, channel):
+        return self.digital[channel, :]
+
+    def set_digital(self, waveform, channel):
+        waveform = np.real(waveform) > 0.5
+        if np.array_equal(self.digital[channel, :], waveform):
+            self.skipped_upload_count += 1
+            return
+        _sleep(self.upload_latency)
+        self.digital[channel, :] = waveform
+        self.upload_count += 1
+        self.bytes_uploaded += self.nop
+        self.revision += 1
+
+    def freeze(self):
+        self.frozen = True
+
+    def unfreeze(self):
+        self.frozen = False
+
+    def get_physical_devices(self):
+        return []
+
+
+def _compose(maps):
+    '''
+    Product maps[-1] @ ... @ maps[0] of a stack of matrices, by pairwise products of neighbours.
+    '''
+    if not len(maps):
+        return np.identity(maps.shape[-1])
+    while len(maps) > 1:
+        if len(maps) % 2:
+            maps = np.concatenate([maps, np.identity(maps.shape[-1])[np.newaxis]])
+        maps = np.matmul(maps[1::2], maps[0::2])
+    return maps[0]
+
+
+class SimulatedQubit:
+    '''
+    Qubit driven by an IQ mixer (SimulatedIQMixer) with a dispersively coupled notch-type readout resonator.
+
+    The Bloch vector (x, y, z), z=1 in the ground state, is integrated over the samples of the AWG waveforms in the
+    frame rotating at the qubit frequency, with the complex Rabi frequency
+        rabi_rate*envelope*exp(-2j*pi*(frequency-f_LO)*t)
+    and T1, T2 relaxation. The qubit is in the ground state at the start of the waveforms. The transmission of the
+    resonator is
+        1 - depth/(1 + 2j*(f - f_r)/kappa)
+    with f_r = resonator_frequency in the ground state and f_r = resonator_frequency - chi in the excited state.
+    '''
+    def __init__(self, drive, frequency=5e9, rabi_rate=20e6, T1=20e-6, T2=15e-6, resonator_frequency=7e9, chi=2e6,
+                 kappa=4e6, depth=0.8):
+        '''
+        :param drive: SimulatedIQMixer of the excitation line
+        :param rabi_rate: Rabi frequency in Hz at a unit amplitude of the mixer envelope
+        '''
+        self.drive = drive
+        self.frequency = frequency
+        self.rabi_rate = rabi_rate
+        self.T1 = T1
+        self.T2 = T2
+        self.resonator_frequency = resonator_frequency
+        self.chi = chi
+        self.kappa = kappa
+        self.depth = depth
+
+    def transmission(self, frequency, excited=False):
+        resonance = self.resonator_frequency - (self.chi if excited else 0)
+        return 1 - self.depth/(1 + 2j*(np.asarray(frequency) - resonance)/self.kappa)
+
+    def propagators(self):
+        '''
+        Affine maps of the Bloch vector, 4x4 matrices acting on (x, y, z, 1), for each sample of the AWG waveforms:
+        a rotation by the drive followed by relaxation.
+        '''
+        clock = self.drive.awg_I.get_clock()
+        envelope = self.drive.envelope()
+        if not self.drive.lo.get_status():
+            envelope = np.zeros_like(envelope)
+        t = np.arange(len(envelope))/clock
+        rabi = 2*np.pi*self.rabi_rate*envelope*np.exp(-2j*np.pi*(self.frequency-self.drive.lo.get_frequency())*t)
+        angle = np.abs(rabi)/clock
+        axis = rabi/np.where(angle > 0, np.abs(rabi), 1)
+        nx, ny = np.real(axis), np.imag(axis)
+        c, s = np.cos(angle), np.sin(angle)
+        relaxation = np.asarray([np.exp(-1/(clock*self.T2))]*2+[np.exp(-1/(clock*self.T1))])
+
+        maps = np.zeros((len(envelope), 4, 4))
+        maps[:, 0, :3] = np.asarray([c+(1-c)*nx**2, (1-c)*nx*ny, s*ny]).T
+        maps[:, 1, :3] = np.asarray([(1-c)*nx*ny, c+(1-c)*ny**2, -s*nx]).T
+        maps[:, 2, :3] = np.asarray([-s*ny, s*nx, c]).T
+        maps[:, :3, :3] *= relaxation[np.newaxis, :, np.newaxis]
+        maps[:, 2, 3] = 1-relaxation[2]
+        maps[:, 3, 3] = 1
+        return maps
+
+    def excited_populations(self, intervals):
+        '''
+        Excited state populations at the end of sample intervals (start, stop) of the AWG waveforms, for a qubit in
+        the ground state at the start of each interval.
+        '''
+        maps = self.propagators()
+        populations = []
+        for start, stop in intervals:
+            z = np.dot(_compose(maps[start:stop]), [0, 0, 1, 1])[2]
+            populations.append((1-z)/2)
+        return np.asarray(populations)
+
+
+class SimulatedDigitizer:
+    '''
+    Digitizer of the readout line with the measurer interface of data_reduce sources (get_points, get_dtype,
+    get_opts, measure) and the nums/nop interface of TSW14J56_evm_reducer. 'Voltage' is a (nums, nop) array of
+    shots.
+
+    A capture starts at the rising edge of a digital output of a SimulatedAWG (the readout trigger). In each shot
+    the qubits are projected on the ground or excited state with the populations after their drive before the
+    trigger. The envelope of the readout mixer is transmitted through the resonators of the qubits, delayed by
+    cable_delay and sampled at clock with complex gain, offset and gaussian noise. The response to the waveforms
+    is cached until the next upload to the AWGs or change of the LOs.
+    '''
+    def __init__(self, trigger_awg, trigger_channel, readout, qubits=(), clock=1e9, nop=1024, nums=100,
+                 cable_delay=200e-9, noise=0.05, gain=1.0, offset=0.0, acquisition_latency=0.0, shot_time=0.0,
+                 seed=None):
+        '''
+        :param trigger_awg: SimulatedAWG with the readout trigger
+        :param trigger_channel: digital channel of the readout trigger
+        :param readout: SimulatedIQMixer of the readout line
+        :param qubits: SimulatedQubits with resonators on the readout line
+        :param noise: standard deviation of each quadrature of each sample
+        :param acquisition_latency: duration of a capture in seconds, in addition to shot_time seconds per shot
+        '''
+        self.trigger_awg = trigger_awg
+        self.trigger_channel = trigger_channel
+        self.readout = readout
+        self.qubits = list(qubits)
+        self.clock = clock
+        self.nop = nop
+        self.nums = nums
+        self.cable_delay = cable_delay
+        self.noise = noise
+        self.gain = gain
+        self.offset = offset
+        self.acquisition_latency = acquisition_latency
+        self.shot_time = shot_time
+        self.random = np.random.RandomState(seed)
+        self.capture_count = 0
+        self.bytes_read = 0
+        self._response_state = None
+        self._response = None
+
+    def get_clock(self):
+        return self.clock
+
+    def get_nop(self):
+        return self.nop
+
+    def set_nop(self, nop):
+        self.nop = int(nop)
+
+    def get_nums(self):
+        return self.nums
+
+    def set_nums(self, nums):
+        self.nums = int(nums)
+
+    def get_points(self):
+        return {'Voltage': [('Sample', np.arange(self.nums), ''),
+                            ('Time', np.arange(self.nop)/self.clock, 's')]}
+
+    def get_dtype(self):
+        return {'Voltage': complex}
+
+    def get_opts(self):
+        return {'Voltage': {'log': None}}
+
+    def trigger_edges(self):
+        '''
+        Sample indices of the rising edges of the readout trigger.
+        '''
+        trigger = self.trigger_awg.get_digital(self.trigger_channel)
+        return np.flatnonzero(np.logical_and(trigger, np.logical_not(np.roll(trigger, 1))))
+
+    def _state(self):
+        '''
+        Parameters the response depends on, None if it cannot be cached (AWGs without revision).
+        '''
+        mixers = [self.readout] + [qubit.drive for qubit in self.qubits]
+        awgs = [mixer.awg_I for mixer in mixers] + [mixer.awg_Q for mixer in mixers] + [self.trigger_awg]
+        if not all(hasattr(awg, 'revision') for awg in awgs):
+            return None
+        return (tuple(awg.revision for awg in awgs),
+                tuple((mixer.lo.get_frequency(), mixer.lo.get_status()) for mixer in mixers),
+                tuple(tuple((k, v) for k, v in sorted(vars(qubit).items()) if k != 'drive') for qubit in self.qubits),
+                (self.nop, self.clock, self.cable_delay, self.gain))
+
+    def response(self):
+        '''
+        Noise-free captures at the readout triggers for all states of the qubits, array of shape (states, triggers,
+        nop) (bit q of the state index is the state of qubit q), and the excited state populations of the qubits at
+        the triggers, array of shape (triggers, qubits).
+        '''
+        state = self._state()
+        if state is not None and state == self._response_state:
+            return self._response
+        triggers = self.trigger_edges()
+        awg_clock = self.readout.awg_I.get_clock()
+        envelope = self.readout.envelope() if self.readout.lo.get_status() else np.zeros(self.readout.awg_I.get_nop())
+        spectrum = np.fft.fft(envelope)
+        frequencies = self.readout.lo.get_frequency() + np.fft.fftfreq(len(envelope), 1/awg_clock)
+        awg_time = np.arange(len(envelope))/awg_clock
+        sample_times = (triggers[:, np.newaxis]/awg_clock + np.arange(self.nop)[np.newaxis, :]/self.clock -
+                        self.cable_delay)
+
+        captures = np.zeros((2**len(self.qubits), len(triggers), self.nop), dtype=complex)
+        for state_id in range(2**len(self.qubits)):
+            transmission = np.ones(len(frequencies), dtype=complex)
+            for qubit_id, qubit in enumerate(self.qubits):
+                transmission *= qubit.transmission(frequencies, excited=bool(state_id >> qubit_id & 1))
+            signal = np.fft.ifft(spectrum*transmission)*self.gain
+            captures[state_id] = np.interp(sample_times, awg_time, np.real(signal), left=0, right=0) + \
+                1j*np.interp(sample_times, awg_time, np.imag(signal), left=0, right=0)
+
+        intervals = list(zip(np.concatenate([[0], triggers[:-1]]), triggers))
+        populations = np.asarray([qubit.excited_populations(intervals) for qubit in self.qubits]).reshape(
+            len(self.qubits), len(triggers)).T
+        self._response = captures, populations
+        self._response_state = state
+        return self._response
+
+    def capture(self, num_segments=1):
+        '''
+        Captures nums shots of num_segments consecutive readout triggers, array of shape (nums, num_segments, nop).
+        '''
+        _sleep(self.acquisition_latency + self.nums*self.shot_time)
+        captures, populations = self.response()
+        if captures.shape[1] < num_segments:
+            raise RuntimeError('SimulatedDigitizer: {} readout triggers in the AWG waveform, {} expected'.format(
+                captures.shape[1], num_segments))
+        excited = self.random.random_sample((self.nums, num_segments, len(self.qubits))) < \
+            populations[np.newaxis, :num_segments, :]
+        state_ids = np.sum(excited*(2**np.arange(len(self.qubits))), axis=-1)
+        data = captures[state_ids, np.arange(num_segments)[np.newaxis, :], :] + self.offset
+        data += self.random.normal(scale=self.noise, size=data.shape) + \
+            1j*self.random.normal(scale=self.noise, size=data.shape)
+        self.capture_count += 1
+        self.bytes_read += data.size*4  # two 16-bit samples per complex sample
+        return data
+
+    def get_data(self):
+        return self.capture()[:, 0, :]
+
+    def measure(self):
+        return {'Voltage': self.get_data()}
+
+    def measure_segmented(self, num_segments):
+        data = self.capture(num_segments)
+        return [{'Voltage': data[:, segment_id, :]} for segment_id in range(num_segments)]
+
+
+class SimulatedVNA:
+    '''
+    VNA (interface of the VNA drivers, e.g. Agilent_N5242A) that measures the transmission of a source, e.g. the
+    readout resonator of a SimulatedQubit, with gaussian noise. A sweep takes measure_latency seconds plus
+    sweep_time_scale times nop/bandwidth seconds.
+    '''
+    def __init__(self, source=None, noise=1e-3, measure_latency=0.0, sweep_time_scale=0.0, seed=None):
+        '''
+        :param source: object with transmission(frequencies), None for a thru
+        :param noise: standard deviation of each quadrature at 1 kHz bandwidth
+        '''
+        self.source = source
+        self.noise = noise
+        self.measure_latency = measure_latency
+        self.sweep_time_scale = sweep_time_scale
+        self.random = np.random.RandomState(seed)
+        self.centerfreq = 7e9
+        self.span = 100e6
+        self.nop = 101
+        self.bandwidth = 1e3
+        self.power = -20
+        self.averages = 1
+        self.status = True
+        self.measure_count = 0
+
+    def set_centerfreq(self, centerfreq):
+        self.centerfreq = centerfreq
+
+    def get_centerfreq(self):
+        return self.centerfreq
+
+    def set_span(self, span):
+        self.span = span
+
+    def get_span(self):
+        return self.span
+
+    def set_xlim(self, start, stop):
+        self.centerfreq = (start+stop)/2
+        self.span = stop-start
+
+    def get_xlim(self):
+        return self.centerfreq-self.span/2, self.centerfreq+self.span/2
+
+    def set_nop(self, nop):
+        self.nop = int(nop)
+
+    def get_nop(self):
+        return self.nop
+
+    def set_bandwidth(self, bandwidth):
+        self.bandwidth = bandwidth
+
+    def get_bandwidth(self):
+        return self.bandwidth
+
+    def set_power(self, power):
+        self.power = power
+
+    def get_power(self):
+        return self.power
+
+    def set_averages(self, averages):
+        self.averages = averages
+
+    def get_averages(self):
+        return self.averages
+
+    def set_status(self, status):
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+    def get_freqpoints(self):
+        if self.nop == 1:
+            return np.asarray([self.centerfreq])
+        return np.linspace(self.centerfreq-self.span/2, self.centerfreq+self.span/2, self.nop)
+
+    def get_points(self):
+        return {'S-parameter': [('Frequency', self.get_freqpoints(), 'Hz')]}
+
+    def get_dtype(self):
+        return {'S-parameter': complex}
+
+    def get_opts(self):
+        return {'S-parameter': {'log': 20}}
+
+    def get_data(self):
+        _sleep(self.measure_latency + self.sweep_time_scale*self.nop/self.bandwidth)
+        self.measure_count += 1
+        frequencies = self.get_freqpoints()
+        transmission = np.ones(len(frequencies), dtype=complex) if self.source is None else \
+            np.asarray(self.source.transmission(frequencies), dtype=complex)
+        noise = self.noise*np.sqrt(self.bandwidth/1e3/self.averages)
+        return transmission + self.random.normal(scale=noise, size=len(frequencies)) + \
+            1j*self.random.normal(scale=noise, size=len(frequencies))
+
+    def measure(self):
+        return {'S-parameter': self.get_data()}
+
+
+class SimulatedDCSource:
+    '''
+    Current and voltage source, e.g. for flux bias. Every set takes latency seconds and is counted in set_count.
+    '''
+    def __init__(self, current=0.0, voltage=0.0, latency=0.0):
+        self.current = current
+        self.voltage = voltage
+        self.status = True
+        self.latency = latency
+        self.set_count = 0
+
+    def set_current(self, current):
+        _sleep(self.latency)
+        self.set_count += 1
+        self.current = current
+
+    def get_current(self):
+        return self.current
+
+    def set_voltage(self, voltage):
+        _sleep(self.latency)
+        self.set_count += 1
+        self.voltage = voltage
+
+    def get_voltage(self):
+        return self.voltage
+
+    def set_status(self, status):
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+
+class SimulatedParamp:
+    '''
+    Flux-tunable Josephson parametric amplifier with a four-wave-mixing pump (SimulatedLO) and a bias
+    (SimulatedDCSource), to be measured as the source of a SimulatedVNA.
+
+    The resonance frequency is tuned by the bias current, frequency*sqrt(|cos(pi*current/period)|), and pulled down
+    by the pump through the Kerr effect, kerr*eps**2, where eps = 10**((P_pump-critical_power)/20) is the pump
+    amplitude relative to the critical one. With the pump detuning x = 2*(f_pump-f_resonance)/kappa the peak power
+    gain is
+        G_0 = 1 + 4*eps**2/((1-eps**2)**2 + x**2 + 4/max_gain)
+    and the gain at the signal frequency f is a Lorentzian around the pump with the bandwidth kappa/sqrt(G_0).
+    '''
+    def __init__(self, pump, bias, frequency=7.6e9, period=2e-3, kappa=100e6, kerr=20e6, critical_power=-20.0,
+                 max_gain=1e3):
+        '''
+        :param pump: SimulatedLO of the pump
+        :param bias: SimulatedDCSource of the flux bias
+        :param period: bias current of one flux quantum in A
+        '''
+        self.pump = pump
+        self.bias = bias
+        self.frequency = frequency
+        self.period = period
+        self.kappa = kappa
+        self.kerr = kerr
+        self.critical_power = critical_power
+        self.max_gain = max_gain
+
+    def peak_gain(self):
+        if not self.pump.get_status() or not self.bias.get_status():
+            return 1.0
+        eps2 = 10**((self.pump.get_power()-self.critical_power)/10)
+        resonance = self.frequency*np.sqrt(np.abs(np.cos(np.pi*self.bias.get_current()/self.period)))-self.kerr*eps2
+        x = 2*(self.pump.get_frequency()-resonance)/self.kappa
+        return 1 + 4*eps2/((1-eps2)**2 + x**2 + 4/self.max_gain)
+
+    def bandwidth(self):
+        '''
+        Full width at half maximum of the gain in Hz.
+        '''
+        return self.kappa/np.sqrt(self.peak_gain())
+
+    def gain(self, frequencies):
+        '''
+        Power gain at the signal frequencies.
+        '''
+        peak_gain = self.peak_gain()
+        detuning = 2*(np.asarray(frequencies)-self.pump.get_frequency())/self.bandwidth()
+        return 1 + (peak_gain-1)/(1 + detuning**2)
+
+    def transmission(self, frequencies):
+        return np.sqrt(self.gain(frequencies))
+
+
+class SimulatedVisaResource:
+    '''
+    pyvisa message based resource of a simulated SCPI instrument, for running the VISA drivers without the lab:
+    async_visa.AsyncVisaResource(SimulatedVisaResource(handler)) replaces the resource opened by async_visa.open_resource.
+    Every command of a message (separated by ';') is passed to handler(command), which returns the response string or
+    None. *OPC? completes after operation_time seconds, or raises TimeoutError after the timeout (in ms as in pyvisa,
+    None is infinite) if the operation takes longer. The next fail calls raise IOError, as on a broken connection.
+    '''
+    def __init__(self, handler=None, operation_time=0.0):
+        self.handler = handler
+        self.operation_time = operation_time
+        self.timeout = 2000
+        self.write_termination = None
+        self.read_termination = None
+        self.fail = 0
+        self.closed = False
+        self.commands = []
+        self._response = None
+
+    def write(self, message):
+        if self.closed:
+            raise IOError('SimulatedVisaResource: resource closed')
+        if self.fail:
+            self.fail -= 1
+            raise IOError('SimulatedVisaResource: connection broken')
+        responses = []
+        for command in message.split(';'):
+            command = command.strip()
+            self.commands.append(command)
+            if command == '*OPC?':
+                if self.timeout is not None and self.operation_time > self.timeout*1e-3:
+                    _sleep(self.timeout*1e-3)
+                    raise TimeoutError('SimulatedVisaResource: timeout expired before operation completed')
+                _sleep(self.operation_time)
+                responses.append('1')
+            elif self.handler is not None:
+                response = self.handler(command)
+                if response is not None:
+                    responses.append(str(response))
+        self._response = ';'.join(responses) if responses else None
+
+    def read(self):
+        if self._response is None:
+            raise TimeoutError('SimulatedVisaResource: no response')
+        response, self._response = self._response, None
+        return response
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def close(self):
+        self.closed = True
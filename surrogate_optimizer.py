@@ -0,0 +1,292 @@
+'''
+Surrogate-guided minimization of targets that are expensive to evaluate, e.g. the operating point of a parametric
+amplifier (paramp.paramp), where every evaluation sets instruments and waits for a measurement.
+
+A surrogate model (gp_surrogate or quadratic_surrogate) is fitted to all evaluations, including the ones of earlier
+optimizations and measurements (add_evaluations), and the target is evaluated in batches of points with the
+largest expected improvement over the best evaluation. The points are searched in a trust region around the best
+evaluation, which grows while the batches improve the best evaluation and shrinks while they do not (as in TuRBO,
+Eriksson et al., NeurIPS 2019), so that narrow optima are refined instead of exploring the whole search box. The
+points of a batch are ordered to keep the moves of the setters short, and only the parameters that change are set.
+The optimization stops when the trust region has shrunk below region_min, when the expected improvement of the
+proposed points falls below ei_threshold (in the units of the target) or after max_evaluations:
+
+    optimizer = surrogate_optimizer(target, (pump.set_frequency, 7.02e9, 6.97e9, 7.07e9),
+                                    (pump.set_power, -22, -27, -17), (bias.set_current, 3e-4, 2e-4, 4e-4))
+    x, y = optimizer.minimize()
+
+The parameters are (setter, initial value, lower bound, upper bound), as in sweep.optimize. The search is done in
+the box of the bounds. The added evaluations only guide the search: the point returned by minimize is the best one
+evaluated by it, as the target may have drifted since the added evaluations were made.
+'''
+
+import numpy as np
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.special import ndtr
+
+
+def expected_improvement(mean, std, best, xi=0.0):
+    '''
+    Expected improvement of a minimization over best at points with a normal predictive distribution.
+    '''
+    improvement = best - xi - mean
+    z = improvement/std
+    return improvement*ndtr(z) + std*np.exp(-z**2/2)/np.sqrt(2*np.pi)
+
+
+class gp_surrogate:
+    '''
+    Gaussian process with a constant mean and a squared exponential kernel with a length scale for every parameter.
+    The length scales and the noise level (relative to the variance of the evaluations) maximize the marginal
+    likelihood, starting from the best combination of length_scales and noise_levels.
+    '''
+    def __init__(self, length_scales=(0.05, 0.1, 0.2, 0.4), noise_levels=(1e-4, 1e-3, 1e-2)):
+        self.length_scales = length_scales
+        self.noise_levels = noise_levels
+
+    def kernel(self, u1, u2, length_scales):
+        distances = np.sum(((u1[:, np.newaxis, :]-u2[np.newaxis, :, :])/length_scales)**2, axis=-1)
+        return np.exp(-distances/2)
+
+    def likelihood(self, log_parameters, y):
+        length_scales, noise_level = np.exp(log_parameters[:-1]), np.exp(log_parameters[-1])
+        try:
+            cholesky = np.linalg.cholesky(self.kernel(self.u, self.u, length_scales)+noise_level*np.identity(len(y)))
+        except np.linalg.LinAlgError:
+            return -np.inf, None, None
+        alpha = cho_solve((cholesky, True), y)
+        return -0.5*np.dot(y, alpha)-np.sum(np.log(np.diag(cholesky))), cholesky, alpha
+
+    def fit(self, u, y):
+        from scipy.optimize import minimize
+        self.u = np.asarray(u, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean = np.mean(y)
+        self.scale = np.std(y) if np.std(y) > 0 else 1.
+        y = (y-self.mean)/self.scale
+        dimensions = self.u.shape[1]
+        initial = max(([np.log(length_scale)]*dimensions+[np.log(noise_level)]
+                       for length_scale in self.length_scales for noise_level in self.noise_levels),
+                      key=lambda log_parameters: self.likelihood(log_parameters, y)[0])
+        # length scales between 0.01 and 10 of the search box, noise levels between 1e-6 and 1
+        bounds = [(np.log(1e-2), np.log(1e1))]*dimensions+[(np.log(1e-6), 0)]
+        solution = minimize(lambda log_parameters: -self.likelihood(log_parameters, y)[0], initial,
+                            method='L-BFGS-B', bounds=bounds)
+        log_parameters = solution.x if np.isfinite(solution.fun) and solution.fun <= \
+            -self.likelihood(initial, y)[0] else initial
+        self.length_scale, self.noise_level = np.exp(log_parameters[:-1]), np.exp(log_parameters[-1])
+        likelihood, self.cholesky, self.alpha = self.likelihood(log_parameters, y)
+        return self
+
+    def predict(self, u):
+        '''
+        Mean and standard deviation of the target at the (normalized) points u.
+        '''
+        correlations = self.kernel(np.asarray(u, dtype=float), self.u, self.length_scale)
+        mean = np.dot(correlations, self.alpha)
+        v = solve_triangular(self.cholesky, correlations.T, lower=True)
+        variance = np.maximum(1-np.sum(v**2, axis=0), 1e-12)
+        return mean*self.scale+self.mean, np.sqrt(variance)*self.scale
+
+
+class quadratic_surrogate:
+    '''
+    Quadratic polynomial fitted by ridge regression, with the predictive standard deviation of linear regression.
+    Suited to the neighbourhood of a smooth optimum; with fewer evaluations than coefficients the ridge term keeps
+    the fit defined.
+    '''
+    def __init__(self, ridge=1e-6):
+        self.ridge = ridge
+
+    def features(self, u):
+        u = np.asarray(u, dtype=float)
+        rows, columns = np.triu_indices(u.shape[1])
+        return np.hstack([np.ones((u.shape[0], 1)), u, u[:, rows]*u[:, columns]])
+
+    def fit(self, u, y):
+        a = self.features(u)
+        y = np.asarray(y, dtype=float)
+        self.inverse = np.linalg.inv(np.dot(a.T, a)+self.ridge*np.identity(a.shape[1]))
+        self.coefficients = np.dot(self.inverse, np.dot(a.T, y))
+        residuals = y-np.dot(a, self.coefficients)
+        self.variance = max(np.sum(residuals**2)/max(len(y)-a.shape[1], 1), 1e-12)
+        return self
+
+    def predict(self, u):
+        a = self.features(u)
+        leverage = np.sum(np.dot(a, self.inverse)*a, axis=1)
+        return np.dot(a, self.coefficients), np.sqrt(self.variance*(1+leverage))
+
+
+class surrogate_optimizer:
+    def __init__(self, target, *params, surrogate=None, batch_size=1, ei_threshold=0.0, patience=1,
+                 max_evaluations=100, candidates=2000, move_costs=None, seed=None):
+        '''
+        :param target: function without arguments that measures the cost at the current parameters
+        :param params: (setter, initial value, lower bound, upper bound) of every parameter
+        :param surrogate: gp_surrogate (default) or quadratic_surrogate
+        :param batch_size: number of points evaluated between the fits of the surrogate (1 needs the fewest evaluations)
+        :param ei_threshold: the optimization stops when the largest expected improvement is below this
+        :param patience: number of batches evaluated with the expected improvement below ei_threshold before stopping
+        :param max_evaluations: maximal number of evaluations of the target
+        :param candidates: number of random points at which the expected improvement is computed
+        :param move_costs: relative costs of moving each setter across its range, for ordering the batches
+        '''
+        self.target = target
+        self.setters = [p[0] for p in params]
+        self.initial = np.asarray([p[1] for p in params], dtype=float)
+        self.lower = np.asarray([p[2] for p in params], dtype=float)
+        self.upper = np.asarray([p[3] for p in params], dtype=float)
+        self.surrogate = surrogate if surrogate is not None else gp_surrogate()
+        self.batch_size = batch_size
+        self.ei_threshold = ei_threshold
+        self.patience = patience
+        self.max_evaluations = max_evaluations
+        self.candidates = candidates
+        self.move_costs = np.ones(len(params)) if move_costs is None else np.asarray(move_costs, dtype=float)
+        self.random = np.random.RandomState(seed)
+        # the candidates are drawn in the trust region, a box around the best evaluation with sides of region times
+        # the search box (stretched by the relative length scales of gp_surrogate). It is doubled after
+        # success_tolerance batches that improve the best evaluation and halved after failure_tolerance batches
+        # that do not.
+        self.region = 0.8
+        self.region_min = 2**-7
+        self.region_max = 1.6
+        self.success_tolerance = 3
+        self.failure_tolerance = int(np.ceil(max(4, len(params))/batch_size))
+        self.batch_spread = 0.1  # distance (relative to the trust region) within which the points of a batch penalize each other
+
+        self.x = []  # all evaluations, including the added ones
+        self.y = []
+        self.evaluation_count = 0
+        self.current = None  # last values set by the setters
+
+    def normalize(self, x):
+        return (np.asarray(x, dtype=float)-self.lower)/(self.upper-self.lower)
+
+    def denormalize(self, u):
+        return self.lower+np.asarray(u, dtype=float)*(self.upper-self.lower)
+
+    def add_evaluations(self, x, y):
+        '''
+        Adds evaluations of the target made elsewhere (e.g. loaded from saved measurements).
+        :param x: points, array of shape (evaluations, parameters)
+        :param y: values of the target
+        '''
+        for x_, y_ in zip(np.reshape(x, (-1, len(self.setters))), np.ravel(y)):
+            if np.all(np.isfinite(x_)) and np.isfinite(y_):
+                self.x.append(np.asarray(x_, dtype=float))
+                self.y.append(float(y_))
+
+    def set(self, x):
+        '''
+        Sets the parameters that differ from the current values.
+        '''
+        for value_id, value in enumerate(x):
+            if self.current is None or self.current[value_id] != value:
+                self.setters[value_id](value)
+        self.current = np.asarray(x, dtype=float)
+
+    def evaluate(self, x):
+        self.set(x)
+        y = self.target()
+        self.evaluation_count += 1
+        self.x.append(self.current)
+        self.y.append(float(y))
+        return y
+
+    def order(self, u):
+        '''
+        Orders the points (nearest neighbour first) to keep the moves of the setters from the current values short.
+        '''
+        u = list(u)
+        position = self.normalize(self.current if self.current is not None else self.initial)
+        ordered = []
+        while u:
+            distances = [np.sum(self.move_costs*np.abs(point-position)) for point in u]
+            position = u.pop(int(np.argmin(distances)))
+            ordered.append(position)
+        return ordered
+
+    def initial_design(self):
+        '''
+        The initial values and a step of a quarter of the range along every axis, within the bounds (the vertices of
+        the initial simplex of sweep.optimize with hint_abs_errors of half the ranges).
+        '''
+        u0 = np.clip(self.normalize(self.initial), 0, 1)
+        design = [u0]
+        for axis in range(len(u0)):
+            u = u0.copy()
+            u[axis] = u[axis]+0.25 if u[axis]+0.25 <= 1 else u[axis]-0.25
+            design.append(u)
+        return design
+
+    def fit(self):
+        u = self.normalize(self.x)
+        # evaluations far outside of the search box do not inform the surrogate inside of it
+        inside = np.all((u > -0.5) & (u < 1.5), axis=1)
+        return self.surrogate.fit(u[inside], np.asarray(self.y)[inside])
+
+    def propose(self):
+        '''
+        Batch of normalized points in the trust region with the largest expected improvement and the largest
+        expected improvement. Points close to the points already in the batch are penalized to spread the batch out.
+        '''
+        surrogate = self.fit()
+        best = np.argmin(self.y)
+        dimensions = len(self.setters)
+        weights = np.asarray(getattr(surrogate, 'length_scale', np.ones(dimensions)), dtype=float)*np.ones(dimensions)
+        half_sides = self.region*weights/np.prod(weights)**(1/dimensions)/2
+        center = np.clip(self.normalize(self.x[best]), 0, 1)
+        lower, upper = np.clip(center-half_sides, 0, 1), np.clip(center+half_sides, 0, 1)
+        candidates = lower+(upper-lower)*self.random.uniform(size=(self.candidates, dimensions))
+        mean, std = surrogate.predict(candidates)
+        improvement = expected_improvement(mean, std, self.y[best])
+        max_improvement = np.max(improvement)
+        batch = []
+        for point_id in range(self.batch_size):
+            chosen = int(np.argmax(improvement))
+            if improvement[chosen] <= 0:
+                break
+            batch.append(candidates[chosen])
+            distances = np.sum(((candidates-candidates[chosen])/(upper-lower))**2, axis=1)
+            improvement = improvement*(1-np.exp(-distances/(2*self.batch_spread**2)))
+        return batch, max_improvement
+
+    def minimize(self):
+        '''
+        Runs the optimization, sets the parameters to the best evaluation of this run and returns it. If the run has
+        not evaluated the target (e.g. max_evaluations is 0), the best added evaluation is evaluated again.
+        :return: (best point, best value)
+        '''
+        first = len(self.y)
+        design = self.initial_design()
+        inside = sum(np.all((u >= 0) & (u <= 1)) for u in self.normalize(self.x)) if self.x else 0
+        # the initial design is skipped if the added evaluations already cover the search box
+        if inside < len(design):
+            for u in self.order(design)[:self.max_evaluations]:
+                self.evaluate(self.denormalize(u))
+        below_threshold = 0
+        successes, failures = 0, 0
+        while self.evaluation_count < self.max_evaluations and self.region >= self.region_min:
+            batch, max_improvement = self.propose()
+            below_threshold = below_threshold+1 if max_improvement < self.ei_threshold else 0
+            if below_threshold > self.patience or not len(batch):
+                break
+            best = min(self.y)
+            for u in self.order(batch)[:self.max_evaluations-self.evaluation_count]:
+                self.evaluate(self.denormalize(u))
+            # an improvement by more than 1e-3 of the best value is a success, as in TuRBO
+            if min(self.y) < best-1e-3*abs(best):
+                successes, failures = successes+1, 0
+            else:
+                successes, failures = 0, failures+1
+            if successes >= self.success_tolerance:
+                self.region, successes = min(2*self.region, self.region_max), 0
+            elif failures >= self.failure_tolerance:
+                self.region, failures = self.region/2, 0
+        if len(self.y) == first:
+            self.evaluate(self.x[int(np.argmin(self.y))])
+        best = first+int(np.argmin(self.y[first:]))
+        self.set(self.x[best])
+        return self.x[best], self.y[best]
@@ -117,6 +117,7 @@ def sweep(measurer, *parameters, shuffle=False,
           use_deferred=False,
           ignore_callback_errors=True,
           on_update_divider = 1,
+          parallel_setters = False,
           **kwargs):
     """
     Performs a n-d parametric sweep.
@@ -127,11 +128,19 @@ def sweep(measurer, *parameters, shuffle=False,
         an object that supports get_points(), measure(), get_dtype() and get_opts() methods.
     parameters : list[tuple]
         tuple associated with a parameter has the following meaning: (param_values, param_setter, param_name)
+        or (param_values, param_setter, param_name, unit, pre_setter, resource)
     shuffle
     on_start
     on_update
     on_finish
-    use_deferred
+    use_deferred : bool
+        use measurer.measure_deferred_result if available: the result of a point is passed to the sweep later, e.g.
+        the TSW14J56 reducer returns once the capture is started, so the setters of the next point run during it.
+    parallel_setters : bool
+        if several parameters change at a sweep point, run the setters of different resources (see
+        MeasurementParameter.resource) concurrently. Setters of the same resource, and setters without a resource,
+        run one after another in the order of the parameters. All setters are finished before measure() is called.
+        Setter time of each parameter is accumulated in its setter_time, the wall-clock time in state.setter_time.
     kwargs
 
     Returns
@@ -175,6 +184,7 @@ def sweep(measurer, *parameters, shuffle=False,
             state.datasets[dataset].data[tuple(indeces+[...])] = single_measurement_result[dataset]
             state.datasets[dataset].indeces_updates = tuple(indeces+[...])
         state.done_sweeps += 1
+        state.updated_indeces.append(tuple(indeces))
 
         if (not (state.done_sweeps % on_update_divider)) or state.done_sweeps == state.total_sweeps:
             for event_handler, arguments in on_update:
@@ -184,6 +194,7 @@ def sweep(measurer, *parameters, shuffle=False,
                     if not ignore_callback_errors:
                         raise
                     #traceback.print_exc()
+            state.updated_indeces = []
 
     for event_handler, arguments in on_start:
         try:
@@ -193,38 +204,68 @@ def sweep(measurer, *parameters, shuffle=False,
                 raise
             #traceback.print_exc()
 
+    def run_setters(group):
+        for sweep_parameter, value in group:
+            setter_start = time.time()
+            sweep_parameter.setter(value)
+            sweep_parameter.setter_time += time.time() - setter_start
+
+    setter_executor = None
+
     ################
     if hasattr(measurer, 'pre_sweep'):
         measurer.pre_sweep()
-    for indeces in all_indeces:
-        if state.request_stop_acq:
-            break
-        # check which values have changed this sweep
-        measurement_start = time.time()
-        old_parameter_values = state.parameter_values
-        state.parameter_values = [sweep_parameters[parameter_id].values[value_id] for parameter_id, value_id in enumerate(indeces)]
-        changed_values = np.logical_not(np.equal(old_parameter_values, state.parameter_values))#[old_parameter_values!=state.parameter_values for old_val, val in zip(old_vals, vals)]
-        # set to new param vals
-        for value, sweep_parameter, changed in zip(state.parameter_values, sweep_parameters, changed_values):
-            if changed:
-                setter_start = time.time()
-                sweep_parameter.setter(value)
-                sweep_parameter.setter_time += time.time() - setter_start
-        #measuring
-
-        if hasattr(measurer, 'measure_deferred_result') and use_deferred:
-            measurer.measure_deferred_result(set_single_measurement_result, (indeces, ))
-        else:
-            mpoint = measurer.measure()
-            #saving data to containers
-            set_single_measurement_result(mpoint, indeces)
-
-        state.measurement_time += time.time() - measurement_start
+    try:
+        for indeces in all_indeces:
+            if state.request_stop_acq:
+                break
+            # check which values have changed this sweep
+            measurement_start = time.time()
+            old_parameter_values = state.parameter_values
+            state.parameter_values = [sweep_parameters[parameter_id].values[value_id] for parameter_id, value_id in enumerate(indeces)]
+            changed_values = np.logical_not(np.equal(old_parameter_values, state.parameter_values))#[old_parameter_values!=state.parameter_values for old_val, val in zip(old_vals, vals)]
+            # set to new param vals
+            setters_start = time.time()
+            setter_groups = {}
+            for value, sweep_parameter, changed in zip(state.parameter_values, sweep_parameters, changed_values):
+                if changed:
+                    resource = sweep_parameter.resource if parallel_setters else None
+                    setter_groups.setdefault(resource, []).append((sweep_parameter, value))
+            if len(setter_groups) > 1:
+                from concurrent.futures import ThreadPoolExecutor, wait
+                if setter_executor is None:
+                    setter_executor = ThreadPoolExecutor(max_workers=len(sweep_parameters))
+                # barrier: wait for all resources before measuring (also if a setter fails, so that no setter is
+                # still running when the sweep stops), then re-raise the first setter exception
+                futures = [setter_executor.submit(run_setters, group) for group in setter_groups.values()]
+                wait(futures)
+                for future in futures:
+                    future.result()
+            else:
+                for group in setter_groups.values():
+                    run_setters(group)
+            state.setter_time += time.time() - setters_start
+            #measuring
+
+            if hasattr(measurer, 'measure_deferred_result') and use_deferred:
+                measurer.measure_deferred_result(set_single_measurement_result, (indeces, ))
+            else:
+                mpoint = measurer.measure()
+                #saving data to containers
+                set_single_measurement_result(mpoint, indeces)
+
+            state.measurement_time += time.time() - measurement_start
 
         
-    if hasattr(measurer, 'join_deferred'):
-        print ('Waiting to join deferred threads:')
-        measurer.join_deferred()
+        if hasattr(measurer, 'join_deferred'):
+            print ('Waiting to join deferred threads:')
+            measurer.join_deferred()
+    finally:
+        if setter_executor is not None:
+            setter_executor.shutdown()
+        # e.g. returns a VNA to free-running triggering, also if the sweep was interrupted
+        if hasattr(measurer, 'post_sweep'):
+            measurer.post_sweep()
 
     for event_handler, arguments in on_finish:
         try:
@@ -2,6 +2,7 @@ from . import sweep
 from . import plotly_plot
 from .fitters.fit_dataset import fit_dataset_1d
 from datetime import timedelta
+from functools import partial
 '''
 Interactive stuff:
 - (matplotlib) UI &  & telegram bot,
@@ -49,6 +50,20 @@ class Sweeper:
                               (lambda x: save_exdir.close_exdir(x.fit), tuple()),
                               (lambda x: plotly_plot.save_default_plot(x, db), tuple())]
 
+    def publish_live_updates(self, channel):
+        """
+        Publish the newly measured points of every sweep to channel (see live_updates).
+        :param channel: object with a publish(message) method, e.g. live_updates.QueueChannel
+        :return: the LiveUpdatePublisher
+        """
+        from .live_updates import LiveUpdatePublisher
+        publisher = LiveUpdatePublisher(channel)
+        # after create_in_database, so that the messages carry the measurement id
+        self.on_start.append((publisher.on_start, tuple()))
+        self.on_update.append((publisher.on_update, tuple()))
+        self.on_finish.insert(0, (publisher.on_finish, tuple()))
+        return publisher
+
     def sweep(self, *args, on_start=[], on_update=[], on_finish=[], **kwargs):
         """
         hook for n-dimensional measurement
@@ -72,18 +87,21 @@ class Sweeper:
         total_time=time_per_sweep*state.total_sweeps
         print("Time left:", timedelta(seconds = round(total_time-state.measurement_time)), end="\r")
 
-    def sweep_fit_dataset_1d_onfly(self, *args, on_start=[], on_update=[], on_finish=[], fitter_arguments=tuple(), **kwargs):
+    def sweep_fit_dataset_1d_onfly(self, *args, on_start=[], on_update=[], on_finish=[], fitter_arguments=tuple(),
+                                   fitter_kwargs=None, **kwargs):
         """
         hook for 1d sweep measurement process
         :param args:
         :param on_start:
         :param on_update:
         :param on_finish:
-        :param fitter_arguments:
+        :param fitter_arguments: positional arguments of fit_dataset_1d after the measurement
+        :param fitter_kwargs: keyword arguments of fit_dataset_1d, e.g. dict(incremental=True) to refit the slices
+            only after refit_min_new_points new points, starting from their previous fit
         :param kwargs:
         :return:
         """
-        fitter_callback = (fit_dataset_1d, fitter_arguments)
+        fitter_callback = (partial(fit_dataset_1d, **(fitter_kwargs or {})), fitter_arguments)
         #print ('on_start:', on_start)
         #print ('fitter_callback:', [fitter_callback])
         #print ('on_start_fit:', self.on_start_fit)
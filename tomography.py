@@ -1,5 +1,6 @@
 from . import data_reduce
 import numpy as np
+import warnings
 from . import readout_classifier
 #import cvxopt
 #import cvxpy
@@ -15,6 +16,9 @@ class tomography:
 		self.adc_reducer = data_reduce.data_reduce(self.sz_measurer.adc)
 		self.adc_reducer.filters['SZ'] = {k:v for k,v in self.sz_measurer.filter_binary.items()}
 		self.adc_reducer.filters['SZ']['filter'] = lambda x: 1-2*self.sz_measurer.filter_binary_func(x)
+		self.reconstruction_operators = None
+		self.reconstruction_key = None
+		self.batched = False # see multiqubit_tomography.batched, the measurer is the reducer of sz_measurer.adc
 		
 	def get_points(self):
 		points = { p:{} for p in self.proj_seq.keys() }
@@ -29,22 +33,49 @@ class tomography:
 	def set_prepare_seq(self, seq):
 		self.prepare_seq = seq
 	
+	def get_reconstruction_operators(self):
+		'''
+		Pseudo-inverse of the projection-to-basis matrix. It depends only on the operators of proj_seq and
+		reconstruction_basis and is computed on the first measure() and again when they change (also in place);
+		set self.reconstruction_operators = None to rebuild it.
+		'''
+		def operator_key(operator):
+			operator = np.asarray(operator)
+			return operator.shape, operator.dtype.str, operator.tobytes()
+		key = tuple((name, operator_key(operators[name]['operator']))
+					for operators in (self.proj_seq, self.reconstruction_basis) for name in operators.keys())
+		if getattr(self, 'reconstruction_operators', None) is None or getattr(self, 'reconstruction_key', None) != key:
+			self.reconstruction_key = key
+			proj_names = self.proj_seq.keys()
+			basis_axes_names = list(self.reconstruction_basis.keys())
+			#TODO: fix this norm stuff in accordance with theory
+			basis_vector_norms = np.asarray([np.linalg.norm(self.reconstruction_basis[r]['operator']) for r in basis_axes_names])
+			reconstruction_matrix = np.real(np.einsum('pab,rab->pr',
+										np.asarray([self.proj_seq[p]['operator'] for p in proj_names]),
+										np.conj(np.asarray([self.reconstruction_basis[r]['operator'] for r in basis_axes_names]))))
+			# pinv gives the same minimum-norm least-squares solution as lstsq, but can be reused
+			self.reconstruction_operators = (basis_axes_names, np.linalg.pinv(reconstruction_matrix), basis_vector_norms)
+		return self.reconstruction_operators
+
 	def measure(self):
 		meas = {}
-		for p in self.proj_seq.keys():
-			self.pulse_generator.set_seq(self.prepare_seq+self.proj_seq[p]['pulses'])
-			meas[p] = np.real(np.mean(self.adc_reducer.measure()['SZ'])/2)
+		# the measurer mode is checked before the segmented upload, e.g. the covariance outputs of the
+		# TSW14J56 reducer cannot be split by segment
+		if self.batched and not data_reduce.supports_segmented(self.adc_reducer):
+			warnings.warn('tomography.batched: {} cannot acquire segments with its current settings, measuring the '
+						  'projections one by one'.format(type(self.sz_measurer.adc).__name__))
+		if self.batched and data_reduce.supports_segmented(self.adc_reducer):
+			self.pulse_generator.set_seq_segmented([self.prepare_seq+self.proj_seq[p]['pulses'] for p in self.proj_seq.keys()])
+			for p, measurement in zip(self.proj_seq.keys(), self.adc_reducer.measure_segmented(len(self.proj_seq))):
+				meas[p] = np.real(np.mean(measurement['SZ'])/2)
+		else:
+			for p in self.proj_seq.keys():
+				self.pulse_generator.set_seq(self.prepare_seq+self.proj_seq[p]['pulses'])
+				meas[p] = np.real(np.mean(self.adc_reducer.measure()['SZ'])/2)
 
-		proj_names = self.proj_seq.keys()
-		basis_axes_names = self.reconstruction_basis.keys()
-		#TODO: fix this norm stuff in accordance with theory
-		basis_vector_norms = np.asarray([np.linalg.norm(self.reconstruction_basis[r]['operator']) for r in basis_axes_names])
-		
 		if len(self.reconstruction_basis.keys()):
-			reconstruction_matrix = np.real(np.asarray([[np.sum(self.proj_seq[p]['operator']*np.conj(self.reconstruction_basis[r]['operator'])) \
-										for r in basis_axes_names] \
-										for p in proj_names]))
-			projections = np.linalg.lstsq(reconstruction_matrix, [meas[p] for p in proj_names])[0]*(basis_vector_norms**2)
+			basis_axes_names, reconstruction_matrix_pinv, basis_vector_norms = self.get_reconstruction_operators()
+			projections = np.dot(reconstruction_matrix_pinv, [meas[p] for p in self.proj_seq.keys()])*(basis_vector_norms**2)
 			meas.update({k:v for k,v in zip(basis_axes_names, projections)})
 		return meas
 		
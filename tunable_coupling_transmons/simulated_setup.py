@@ -0,0 +1,152 @@
+from qsweepy.simulated_instruments import *
+from qsweepy import awg_iq_multi, awg_digital, awg_channel
+
+import numpy as np
+
+# latencies of the simulated instruments in seconds, zero runs the measurements as fast as the software allows
+device_settings = {'awg_upload_latency': 0.0,
+                   'awg_run_latency': 0.0,
+                   'adc_acquisition_latency': 0.0,
+                   'adc_shot_time': 0.0,  # 50 us for a 20 kHz repetition rate
+                   'sa_measure_latency': 0.0,
+                   'vna_measure_latency': 0.0,
+                   'lo_latency': 0.0,
+                   'dc_latency': 0.0,
+                   'adc_noise': 0.05,
+                   'adc_cable_delay': 200e-9,
+                   'seed': 0,
+                   }
+
+# parameters of the simulated sample
+sample_settings = {'qubit_frequency': 5.0e9,
+                   'rabi_rate': 20e6,  # Rabi frequency at full scale of the excitation mixer
+                   'T1': 20e-6,
+                   'T2': 15e-6,
+                   'resonator_frequency': 7.0e9,
+                   'chi': 2e6,
+                   'kappa': 4e6,
+                   'depth': 0.8,
+                   'ex_mixer_amplitude_imbalance': 1.05,
+                   'ex_mixer_phase_imbalance': 0.05,
+                   'ro_mixer_amplitude_imbalance': 0.97,
+                   'ro_mixer_phase_imbalance': -0.03,
+                   }
+
+cw_settings = {}
+pulsed_settings = {'ex_clock': 1000e6,  # 1 GHz - clocks of some devices
+                   'rep_rate': 20e3,  # 20 kHz - pulse sequence repetition rate
+                   'awg_nop': 8000,
+                   'lo1_freq': 5.1e9,
+                   'lo_ro_freq': 7.05e9,
+                   'trigger_readout_channel_name': 'ro_trg',
+                   'trigger_readout_length': 20e-9,
+                   'modem_dc_calibration_amplitude': 1.0,
+                   'adc_clock': 1000e6,
+                   'adc_nop': 1024,
+                   'adc_nums': 100,
+                   }
+
+
+class hardware_setup():
+    '''
+    Pulsed setup of a single transmon from simulated_instruments: one AWG with the I and Q channels of the
+    excitation (2, 3) and readout (0, 1) mixers, a coil channel (4) and the readout trigger (digital channel 0), a
+    digitizer, a spectrum analyzer for the mixer calibrations and a VNA for the readout resonator.
+    '''
+    def __init__(self, device_settings, pulsed_settings, sample_settings=sample_settings):
+        self.device_settings = device_settings
+        self.pulsed_settings = pulsed_settings
+        self.sample_settings = sample_settings
+        self.cw_settings = cw_settings
+        self.hardware_state = 'undefined'
+
+        self.awg = None
+        self.lo1 = None
+        self.lo_ro = None
+        self.sa = None
+        self.pna = None
+        self.dc = None
+        self.adc_device = None
+        self.adc = None
+        self.qubit = None
+
+        self.ro_trg = None
+        self.coil = None
+        self.iq_devices = None
+
+    def open_devices(self):
+        settings = self.device_settings
+        sample = self.sample_settings
+        self.awg = SimulatedAWG(channels=5, upload_latency=settings['awg_upload_latency'],
+                                run_latency=settings['awg_run_latency'])
+        self.lo1 = SimulatedLO(latency=settings['lo_latency'])
+        self.lo_ro = SimulatedLO(latency=settings['lo_latency'])
+        self.ex_mixer = SimulatedIQMixer(self.awg, self.awg, 2, 3, self.lo1,
+                                         amplitude_imbalance=sample['ex_mixer_amplitude_imbalance'],
+                                         phase_imbalance=sample['ex_mixer_phase_imbalance'], conversion_loss=0)
+        self.ro_mixer = SimulatedIQMixer(self.awg, self.awg, 0, 1, self.lo_ro,
+                                         amplitude_imbalance=sample['ro_mixer_amplitude_imbalance'],
+                                         phase_imbalance=sample['ro_mixer_phase_imbalance'], conversion_loss=0)
+        self.qubit = SimulatedQubit(self.ex_mixer, frequency=sample['qubit_frequency'], rabi_rate=sample['rabi_rate'],
+                                    T1=sample['T1'], T2=sample['T2'], resonator_frequency=sample['resonator_frequency'],
+                                    chi=sample['chi'], kappa=sample['kappa'], depth=sample['depth'])
+
+        self.sa = SimulatedSpectrumAnalyzer(self.ex_mixer, seed=settings['seed'],
+                                            measure_latency=settings['sa_measure_latency'])
+        self.pna = SimulatedVNA(self.qubit, seed=settings['seed'], measure_latency=settings['vna_measure_latency'])
+        self.dc = SimulatedDCSource(latency=settings['dc_latency'])
+
+        self.adc_device = SimulatedDigitizer(self.awg, 0, self.ro_mixer, [self.qubit],
+                                             cable_delay=settings['adc_cable_delay'], noise=settings['adc_noise'],
+                                             acquisition_latency=settings['adc_acquisition_latency'],
+                                             shot_time=settings['adc_shot_time'], seed=settings['seed'])
+        self.adc = self.adc_device
+
+    def set_pulsed_mode(self):
+        self.lo1.set_status(1)
+        self.lo1.set_frequency(self.pulsed_settings['lo1_freq'])
+        self.lo_ro.set_status(1)
+        self.lo_ro.set_frequency(self.pulsed_settings['lo_ro_freq'])
+
+        self.awg.stop()
+        self.awg.set_clock(self.pulsed_settings['ex_clock'])
+        self.awg.set_nop(self.pulsed_settings['awg_nop'])
+        self.awg.run()
+
+        self.ro_trg = awg_digital.awg_digital(self.awg, 0, delay_tolerance=20e-9)  # triggers readout card
+        self.ro_trg.mode = 'waveform'
+        self.coil = awg_channel.awg_channel(self.awg, 4)  # coil control
+
+        self.adc_device.clock = self.pulsed_settings['adc_clock']
+        self.adc.set_nop(self.pulsed_settings['adc_nop'])
+        self.adc.set_nums(self.pulsed_settings['adc_nums'])
+
+        self.hardware_state = 'pulsed_mode'
+
+    def setup_iq_channel_connections(self, exdir_db):
+        self.iq_devices = {'iq_ex1': awg_iq_multi.Awg_iq_multi(self.awg, self.awg, 2, 3, self.lo1, exdir_db=exdir_db),
+                           'iq_ro': awg_iq_multi.Awg_iq_multi(self.awg, self.awg, 0, 1, self.lo_ro, exdir_db=exdir_db)}
+
+        self.iq_devices['iq_ex1'].name = 'ex1'
+        self.iq_devices['iq_ro'].name = 'ro'
+
+        # the spectrum analyzer is switched between the mixers
+        self.iq_devices['iq_ex1'].calibration_switch_setter = lambda: setattr(self.sa, 'source', self.ex_mixer)
+        self.iq_devices['iq_ro'].calibration_switch_setter = lambda: setattr(self.sa, 'source', self.ro_mixer)
+
+        self.iq_devices['iq_ex1'].sa = self.sa
+        self.iq_devices['iq_ro'].sa = self.sa
+
+        self.fast_controls = {'coil': awg_channel.awg_channel(self.awg, 4)}  # coil control
+
+    def get_readout_trigger_pulse_length(self):
+        return self.pulsed_settings['trigger_readout_length']
+
+    def get_modem_dc_calibration_amplitude(self):
+        return self.pulsed_settings['modem_dc_calibration_amplitude']
+
+    def revert_setup(self, old_settings):
+        if 'adc_nums' in old_settings:
+            self.adc.set_nums(old_settings['adc_nums'])
+        if 'adc_nop' in old_settings:
+            self.adc.set_nop(old_settings['adc_nop'])